@@ -0,0 +1,63 @@
+"""«Мои связи» для пользователя с большим числом связей: полный список через OR-join против страниц по ключу.
+
+Запуск: python -m benchmarks.bench_connections [связей]
+"""
+import sqlite3
+import sys
+import time
+
+import db
+from benchmarks.common import remove_db, report, seed_connections, seed_users, temp_db_path
+
+LEGACY_QUERY = """
+    SELECT users.user_id, users.name, users.profession, users.username
+    FROM connections
+    JOIN users ON users.user_id = CASE
+        WHEN connections.from_user = ? THEN connections.to_user
+        ELSE connections.from_user
+    END
+    WHERE (connections.from_user = ? OR connections.to_user = ?)
+    AND connections.status = 'accepted'
+"""
+
+
+def measure(fn, rounds):
+    latencies = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+    users = max(count * 2, 100_000)
+    user_id = 1
+    path = temp_db_path("connections")
+    try:
+        seed_users(path, users)
+        seed_connections(path, user_id, count, users)
+        db.init(path)
+        db.create_tables()
+
+        def legacy():
+            conn = sqlite3.connect(path)
+            conn.execute(LEGACY_QUERY, (user_id, user_id, user_id)).fetchall()
+            conn.close()
+
+        report(f"полный список ({count} связей)", measure(legacy, 20))
+        report("первая страница", measure(lambda: db.run_sync(
+            db._connections_page, user_id, None, None, db.CONNECTIONS_PAGE), 500))
+        middle = users // 2
+        report("страница из середины (Далее)", measure(lambda: db.run_sync(
+            db._connections_page, user_id, middle, None, db.CONNECTIONS_PAGE), 500))
+        report("страница из середины (Назад)", measure(lambda: db.run_sync(
+            db._connections_page, user_id, None, middle, db.CONNECTIONS_PAGE), 500))
+    finally:
+        db.close()
+        remove_db(path)
+
+
+if __name__ == "__main__":
+    main()
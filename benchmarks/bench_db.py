@@ -0,0 +1,83 @@
+"""Латентность обработчиков при конкурентной нагрузке: sqlite3.connect в цикле событий против пула db.
+
+Запуск: python -m benchmarks.bench_db [пользователей] [одновременных обработчиков]
+"""
+import asyncio
+import datetime
+import sqlite3
+import sys
+import time
+
+import db
+from benchmarks.common import remove_db, report, seed_users, temp_db_path
+
+NETWORK_DELAY = 0.005
+
+
+def legacy_get_user(path, user_id):
+    conn = sqlite3.connect(path)
+    c = conn.cursor()
+    c.execute("SELECT * FROM users WHERE user_id=?", (user_id,))
+    row = c.fetchone()
+    conn.close()
+    return row
+
+
+def legacy_get_user_subscription(path, user_id):
+    conn = sqlite3.connect(path)
+    c = conn.cursor()
+    c.execute("SELECT is_premium, subscription_end FROM users WHERE user_id=?", (user_id,))
+    row = c.fetchone()
+    conn.close()
+    return bool(row and row[0] and datetime.datetime.now() < datetime.datetime.fromisoformat(row[1]))
+
+
+async def legacy_handler(path, user_id):
+    legacy_get_user(path, user_id)
+    legacy_get_user_subscription(path, user_id)
+    await asyncio.sleep(NETWORK_DELAY)
+
+
+async def pooled_handler(path, user_id):
+    await db.get_user(user_id)
+    db.get_user_subscription(user_id)
+    await asyncio.sleep(NETWORK_DELAY)
+
+
+async def drive(handler, path, users, concurrency, rounds):
+    latencies = []
+
+    async def worker(offset):
+        for i in range(rounds):
+            user_id = (offset * rounds + i) % users + 1
+            start = time.perf_counter()
+            await handler(path, user_id)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(n) for n in range(concurrency)))
+    return latencies, time.perf_counter() - start
+
+
+def main():
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    rounds = 20
+    path = temp_db_path()
+    try:
+        seed_users(path, users)
+        latencies, elapsed = asyncio.run(drive(legacy_handler, path, users, concurrency, rounds))
+        report("sqlite3.connect на каждый вызов", latencies, elapsed)
+
+        db.init(path)
+        db.load_entitlements()
+        latencies, elapsed = asyncio.run(drive(pooled_handler, path, users, concurrency, rounds))
+        db.close()
+        report("пул db (WAL, executor)", latencies, elapsed)
+    finally:
+        db.close()
+        remove_db(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""Ежедневная проверка подписок: N+1 запросов на подписчика против пакетного UPDATE по индексу.
+
+Запуск: python -m benchmarks.bench_expiry [подписчиков] [доля истёкших]
+"""
+import asyncio
+import datetime
+import sqlite3
+import sys
+
+import db
+from benchmarks.common import Timer, remove_db, seed_users, temp_db_path
+
+
+def legacy_check_subscriptions(path):
+    conn = sqlite3.connect(path)
+    premium_users = [row[0] for row in conn.execute("SELECT user_id FROM users WHERE is_premium=1")]
+    expired = 0
+    for user_id in premium_users:
+        sub = sqlite3.connect(path)
+        row = sub.execute("SELECT is_premium, subscription_end FROM users WHERE user_id=?", (user_id,)).fetchone()
+        sub.close()
+        if row and row[0] and datetime.datetime.now() >= datetime.datetime.fromisoformat(row[1]):
+            upd = sqlite3.connect(path)
+            upd.execute("UPDATE users SET is_premium=0, subscription_end=NULL WHERE user_id=?", (user_id,))
+            upd.commit()
+            upd.close()
+            expired += 1
+    conn.close()
+    return expired
+
+
+def expire_some(path, share):
+    conn = sqlite3.connect(path)
+    conn.execute("UPDATE users SET subscription_end='2000-01-01T00:00:00' WHERE is_premium=1 AND user_id % ? = 0",
+                 (round(1 / share),))
+    conn.commit()
+    conn.close()
+
+
+def main():
+    subscribers = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    share = float(sys.argv[2]) if len(sys.argv) > 2 else 0.5
+    for name in ("N+1 (старый check_subscriptions)", "expire_subscriptions"):
+        path = temp_db_path("expiry")
+        try:
+            seed_users(path, subscribers, premium_share=1.0)
+            db.init(path)
+            db.create_tables()
+            expire_some(path, share)
+            with Timer() as timer:
+                if name.startswith("N+1"):
+                    expired = legacy_check_subscriptions(path)
+                else:
+                    expired = len(asyncio.run(db.expire_subscriptions()))
+            print(f"{name:<40} подписчиков={subscribers} истекло={expired} {timer.elapsed * 1000:10.1f}ms")
+        finally:
+            db.close()
+            remove_db(path)
+
+
+if __name__ == "__main__":
+    main()
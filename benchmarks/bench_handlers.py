@@ -0,0 +1,158 @@
+"""Сценарии реальных обработчиков main.py на синтетической базе и имитации Bot API без сети.
+
+Каждый сценарий гоняет апдейты от concurrency пользователей параллельно (апдейты одного
+пользователя — по очереди) и печатает p50/p99 и пропускную способность. С --save базовые p99
+сохраняются в JSON, с --compare сравниваются с ним: если сценарий стал заметно медленнее,
+скрипт завершается с кодом 1, так что его можно ставить перед деплоем.
+
+Запуск: python -m benchmarks.bench_handlers [--users N] [--concurrency N] [--repeat N] [--save F | --compare F]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import random
+import sys
+import time
+
+from telegram import Update
+
+import callbacks
+import db
+import main as bot
+import sender
+from benchmarks.common import (percentile, remove_db, report, seed_connections, seed_users, seed_works,
+                               temp_db_path)
+from benchmarks.fake_api import (FakeBotAPI, callback_update, message_update, offline_builder,
+                                 pre_checkout_update, successful_payment_update)
+
+CONNECTIONS_PER_USER = 40
+# a scenario fails --compare when its p99 grows by more than this factor plus SLACK seconds
+TOLERANCE = 2.0
+SLACK = 0.005
+
+
+def scenarios(users, rnd):
+    def peer():
+        return rnd.randint(1, users)
+
+    return {
+        "myprofile": lambda uid: [message_update(uid, "👤 Мой профиль")],
+        "connections": lambda uid: [message_update(uid, "🤝 Мои связи")],
+        "connections: next page": lambda uid: [callback_update(uid, callbacks.CONNECTIONS_NEXT.encode(users // 2))],
+        "inbox": lambda uid: [message_update(uid, "📥 Входящие")],
+        "search": lambda uid: [message_update(uid, "🔍 Поиск связей")],
+        "search: skip": lambda uid: [callback_update(uid, callbacks.SKIP.encode(peer()))],
+        "search: connect": lambda uid: [callback_update(uid, callbacks.CONNECT.encode(peer()))],
+        "find": lambda uid: [message_update(uid, "/find python sql")],
+        "skills": lambda uid: [message_update(uid, "/skills python, sql @Аналитик")],
+    }
+
+
+def payment_flow(uid):
+    return [
+        ("payment: premium", message_update(uid, "💎 Премиум")),
+        ("payment: invoice", callback_update(uid, callbacks.PREMIUM_PURCHASE.encode())),
+        ("payment: pre-checkout", pre_checkout_update(uid)),
+        ("payment: successful", successful_payment_update(uid)),
+    ]
+
+
+async def drive(application, updates, latencies):
+    for name, data in updates:
+        update = Update.de_json(data, application.bot)
+        started = time.perf_counter()
+        await application.process_update(update)
+        latencies.setdefault(name, []).append(time.perf_counter() - started)
+
+
+async def run(args, active):
+    api = FakeBotAPI()
+    application = bot.build_application(offline_builder(api))
+    await application.initialize()
+    await bot.post_init(application)
+    # the benchmark measures handlers, not Telegram's send limits
+    await sender.stop()
+    sender.start(application.bot, global_rate=1e9, global_burst=10 ** 6, chat_rate=1e9, chat_burst=10 ** 6)
+    await application.start()
+
+    rnd = random.Random(4)
+    results = {}
+    try:
+        for name, make in scenarios(args.users, rnd).items():
+            latencies = {}
+            calls = api.count()
+            started = time.perf_counter()
+            await asyncio.gather(*(
+                drive(application, [(name, data) for _ in range(args.repeat) for data in make(uid)], latencies)
+                for uid in active
+            ))
+            elapsed = time.perf_counter() - started
+            report(name, latencies[name], elapsed)
+            results[name] = latencies[name]
+            # handlers queue their sends; count the ones still waiting in the scheduler too
+            await sender.scheduler.drain()
+            print(f"{'':<40} Bot API вызовов на апдейт: {(api.count() - calls) / len(latencies[name]):.2f}")
+
+        buyers = [uid for uid in active if not db.get_user_subscription(uid)]
+        latencies = {}
+        started = time.perf_counter()
+        await asyncio.gather(*(drive(application, payment_flow(uid), latencies) for uid in buyers))
+        elapsed = time.perf_counter() - started
+        for name, values in latencies.items():
+            report(name, values, elapsed)
+            results[name] = values
+    finally:
+        await application.stop()
+        await application.shutdown()
+        await bot.post_shutdown(application)
+    return {name: percentile(values, 99) for name, values in results.items()}
+
+
+def compare(p99, path):
+    with open(path) as f:
+        baseline = json.load(f)
+    regressions = []
+    for name, value in p99.items():
+        before = baseline.get(name)
+        if before is not None and value > before * TOLERANCE + SLACK:
+            regressions.append(f"{name}: p99 {before * 1000:.2f}ms -> {value * 1000:.2f}ms")
+    for line in regressions:
+        print(f"РЕГРЕССИЯ {line}")
+    return not regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--save", help="записать p99 сценариев в JSON")
+    parser.add_argument("--compare", help="сравнить p99 с сохранённым JSON")
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    path = temp_db_path("handlers")
+    try:
+        seed_users(path, args.users)
+        active = random.Random(5).sample(range(1, args.users + 1), args.concurrency)
+        for user_id in active:
+            seed_connections(path, user_id, CONNECTIONS_PER_USER, args.users, seed=user_id)
+        seed_works(path, range(1, args.users + 1, 10))
+        db.init(path)
+        db.create_tables()
+        db.load_entitlements()
+        p99 = asyncio.run(run(args, active))
+    finally:
+        db.close()
+        remove_db(path)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(p99, f, ensure_ascii=False, indent=2)
+    if args.compare and not compare(p99, args.compare):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""Входящие запросы популярного пользователя: страницы, ответы по одному и всей страницей, сводки.
+
+requests пользователей отправляют запрос двум популярным пользователям через реальные
+обработчики. Первый отвечает на каждый запрос отдельно, второй — кнопкой «Принять все» на
+каждой странице. Печатает задержку страниц входящих и ответов, число транзакций и сообщений
+Bot API: сколько ушло популярным пользователям и отправителям после сводок против
+сообщения на каждый запрос и ответ. Если запросы не попали во входящие или после ответов
+что-то осталось, скрипт завершается с кодом 1.
+
+Запуск: python -m benchmarks.bench_inbox [пользователей] [запросов]
+"""
+import asyncio
+import logging
+import random
+import sys
+import time
+
+from telegram import Update
+
+import callbacks
+import db
+import digests
+import main as bot
+import sender
+from benchmarks.common import remove_db, report, seed_users, temp_db_path
+from benchmarks.fake_api import FakeBotAPI, callback_update, message_update, offline_builder
+
+ONE_BY_ONE = 1
+BULK = 2
+
+
+def sent_to(api, chat_ids, since=0):
+    return sum(1 for name, params in api.calls[since:]
+               if name == "sendMessage" and int(params.get("chat_id", 0)) in chat_ids)
+
+
+async def run(users, requests):
+    api = FakeBotAPI()
+    application = bot.build_application(offline_builder(api))
+    await application.initialize()
+    await bot.post_init(application)
+    # the benchmark measures handlers, not Telegram's send limits
+    await sender.stop()
+    sender.start(application.bot, global_rate=1e9, global_burst=10 ** 6, chat_rate=1e9, chat_burst=10 ** 6)
+    await application.start()
+
+    async def process(data, latencies=None):
+        started = time.perf_counter()
+        await application.process_update(Update.de_json(data, application.bot))
+        if latencies is not None:
+            latencies.append(time.perf_counter() - started)
+
+    async def drain():
+        digests.flush()
+        while sender.scheduler.queue_depth():
+            await asyncio.sleep(0.01)
+
+    requesters = random.Random(3).sample(range(BULK + 1, users + 1), requests)
+    failures = []
+    try:
+        for target in (ONE_BY_ONE, BULK):
+            await asyncio.gather(*(process(callback_update(uid, callbacks.CONNECT.encode(target)))
+                                   for uid in requesters))
+        before = len(api.calls)
+        await drain()
+        to_targets = sent_to(api, {ONE_BY_ONE, BULK}, before)
+        print(f"запросов: {2 * requests}, сообщений популярным пользователям: {to_targets} "
+              f"(по сообщению на запрос было бы {2 * requests})")
+        for target in (ONE_BY_ONE, BULK):
+            if await db.pending_requests_count(target) != requests:
+                failures.append(f"во входящих {target} не {requests} запросов")
+
+        latencies = []
+        for _ in range(50):
+            await process(message_update(BULK, "📥 Входящие"), latencies)
+        report("входящие: первая страница", latencies)
+        latencies = []
+        middle = sorted(requesters)[requests // 2]
+        for _ in range(50):
+            await process(callback_update(BULK, callbacks.INBOX_NEXT.encode(middle)), latencies)
+        report("входящие: страница из середины", latencies)
+
+        before = len(api.calls)
+        latencies = []
+        started = time.perf_counter()
+        while True:
+            page, _, _ = await db.get_pending_requests_page(ONE_BY_ONE)
+            if not page:
+                break
+            for request in page:
+                await process(callback_update(ONE_BY_ONE, callbacks.INBOX_ACCEPT.encode(request['user_id'], 0)),
+                              latencies)
+        elapsed = time.perf_counter() - started
+        report("ответ на каждый запрос", latencies, elapsed)
+        print(f"{'':<40} транзакций: {len(latencies)}, {elapsed / requests * 1000:.3f}мс на запрос")
+
+        latencies = []
+        started = time.perf_counter()
+        while True:
+            page, _, _ = await db.get_pending_requests_page(BULK)
+            if not page:
+                break
+            data = callbacks.INBOX_ACCEPT_ALL.encode(page[0]['user_id'], page[-1]['user_id'],
+                                                     max(request['request_id'] for request in page))
+            await process(callback_update(BULK, data), latencies)
+        elapsed = time.perf_counter() - started
+        report("«Принять все» по страницам", latencies, elapsed)
+        print(f"{'':<40} транзакций: {len(latencies)}, {elapsed / requests * 1000:.3f}мс на запрос")
+
+        await drain()
+        to_requesters = sent_to(api, set(requesters), before)
+        print(f"ответов: {2 * requests}, сообщений отправителям: {to_requesters} "
+              f"(по сообщению на ответ было бы {2 * requests})")
+        for target in (ONE_BY_ONE, BULK):
+            page, _, _ = await db.get_connections_page(target, limit=requests)
+            if len(page) != requests or await db.pending_requests_count(target):
+                failures.append(f"у {target} принято {len(page)} из {requests}")
+    finally:
+        await application.stop()
+        await application.shutdown()
+        await bot.post_shutdown(application)
+    return failures
+
+
+def main():
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    requests = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    logging.getLogger().setLevel(logging.WARNING)
+    path = temp_db_path("inbox")
+    try:
+        seed_users(path, users)
+        db.init(path)
+        db.create_tables()
+        db.load_entitlements()
+        failures = asyncio.run(run(users, requests))
+    finally:
+        db.close()
+        remove_db(path)
+    for line in failures:
+        print(f"ОШИБКА {line}")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
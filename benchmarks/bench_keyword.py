@@ -0,0 +1,53 @@
+"""Латентность поиска по ключевым словам (FTS5, bm25, премиум-буст).
+
+Каждый размер прогоняется дважды: с user_id 1..N и с id, собранными в два далёких кластера,
+как у настоящих аккаунтов Telegram (половина от 100000, половина от 5000000000). Если на
+какой-то базе поиск вернул меньше KEYWORD_RESULTS профилей, скрипт завершается с кодом 1.
+
+Запуск: python -m benchmarks.bench_keyword [размер ...]
+"""
+import itertools
+import sys
+import time
+
+import db
+import keywords
+from benchmarks.common import remove_db, report, seed_users, temp_db_path
+
+QUERIES = ["python", "разработчики django", "дизайнер figma", "devops kubernetes docker", "data ml pandas", "seo"]
+
+
+def clustered(size):
+    return itertools.chain(range(100_000, 100_000 + size // 2), itertools.count(5_000_000_000))
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or [1_000_000]
+    short = 0
+    for size in sizes:
+        for layout, ids in (("подряд", None), ("кластеры", clustered(size))):
+            path = temp_db_path("keyword")
+            try:
+                seed_users(path, size, ids=ids)
+                db.init(path)
+                db.create_tables()
+                for text in QUERIES:
+                    match = keywords.build_match_query(text)
+                    latencies = []
+                    for _ in range(20):
+                        start = time.perf_counter()
+                        found = db.run_sync(db._keyword_search, 1, match, db.KEYWORD_RESULTS)
+                        latencies.append(time.perf_counter() - start)
+                        if len(found) < db.KEYWORD_RESULTS:
+                            short += 1
+                    report(f"{size:>9} {layout:<8} {text}", latencies)
+            finally:
+                db.close()
+                remove_db(path)
+    if short:
+        print(f"ОШИБКА неполных выдач: {short}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
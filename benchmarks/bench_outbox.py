@@ -0,0 +1,70 @@
+"""Outbox рассылок: постановка в очередь на всех пользователей, разбор порциями и продолжение после падения.
+
+Отправка идёт через MessageScheduler на фейковом боте без задержек и с поднятым общим лимитом,
+так что замер показывает накладные расходы SQLite; в проде скорость ограничена GLOBAL_RATE.
+
+Запуск: python -m benchmarks.bench_outbox [пользователей]
+"""
+import asyncio
+import sys
+
+import db
+import notifications
+import sender
+from benchmarks.common import Timer, remove_db, seed_users, temp_db_path
+
+
+class FakeBot:
+    def __init__(self):
+        self.delivered = 0
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.delivered += 1
+        return text
+
+
+async def run(users):
+    with Timer() as timer:
+        campaign_id = await db.create_campaign("bench", "📣 Тестовая рассылка")
+    print(f"{'постановка в outbox':<32} {users} строк за {timer.elapsed * 1000:10.1f}ms")
+
+    bot = FakeBot()
+    sender.start(bot, global_rate=1e9, global_burst=10 ** 6, max_in_flight=256)
+    worker = notifications.OutboxWorker(chunk_size=1000, max_queue_depth=10 ** 9)
+
+    # half the campaign, then a "crash" with a claimed but unfinished chunk
+    with Timer() as timer:
+        while bot.delivered < users // 2:
+            await worker.drain_chunk()
+    await db.claim_outbox(1000)
+    print(f"{'первая половина':<32} {bot.delivered} сообщений за {timer.elapsed:8.2f}s")
+
+    with Timer() as timer:
+        await worker.start()
+        while (await db.campaign_progress(campaign_id)).get("sent", 0) < users:
+            await asyncio.sleep(0.1)
+        await worker.stop()
+    print(f"{'после перезапуска':<32} {bot.delivered} сообщений за {timer.elapsed:8.2f}s")
+    await sender.stop()
+
+    stats = await notifications.campaign_stats(campaign_id)
+    print(f"итог: {stats}")
+    real = users / sender.GLOBAL_RATE
+    print(f"при GLOBAL_RATE={sender.GLOBAL_RATE:.0f}/с рассылка на {users} пользователей займёт ~{real / 3600:.1f}ч")
+
+
+def main():
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    path = temp_db_path("outbox")
+    try:
+        seed_users(path, users)
+        db.init(path)
+        db.create_tables()
+        asyncio.run(run(users))
+    finally:
+        db.close()
+        remove_db(path)
+
+
+if __name__ == "__main__":
+    main()
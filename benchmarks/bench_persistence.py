@@ -0,0 +1,46 @@
+"""Отложенная запись состояния PTB: стоимость одного сброса буфера и пропуск неизменившихся записей.
+
+Запуск: python -m benchmarks.bench_persistence [пользователей]
+"""
+import asyncio
+import sys
+
+import db
+import persistence
+from benchmarks.common import Timer, remove_db, temp_db_path
+
+
+async def run(users):
+    p = persistence.DBPersistence()
+    await p.get_user_data()
+    data = {user_id: {"profile_draft": {"name": f"user{user_id}", "bio": "о себе " * 10}} for user_id in range(users)}
+
+    with Timer() as timer:
+        await asyncio.gather(*(p.update_user_data(user_id, value) for user_id, value in data.items()))
+        await p.flush()
+    print(f"{'update_user_data + сброс':<36} {p.rows_written} строк, {p.flushes} транзакций за "
+          f"{timer.elapsed * 1000:8.1f}ms ({timer.elapsed / users * 1e6:.1f}мкс на запись)")
+
+    written = p.rows_written
+    await asyncio.gather(*(p.update_user_data(user_id, value) for user_id, value in data.items()))
+    await p.flush()
+    print(f"{'повтор без изменений':<36} записано строк: {p.rows_written - written}")
+
+    size = await db.fetchone("SELECT sum(length(data)) FROM bot_state")
+    print(f"{'объём в bot_state':<36} {size[0] / users:.0f} байт на пользователя")
+
+
+def main():
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+    path = temp_db_path("persistence")
+    try:
+        db.init(path)
+        db.create_tables()
+        asyncio.run(run(users))
+    finally:
+        db.close()
+        remove_db(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""Офлайн-пересчёт рекомендаций: загрузка индекса и расчёт top-K на 1, 2, ... N ядрах.
+
+Кроме времени печатает, насколько первые профили ленты похожи на смотрящего (общих тегов
+навыков и профессии в среднем) со случайной лентой и с рекомендациями, и задержку выдачи.
+
+Запуск: python -m benchmarks.bench_recommendations [--users N] [--degree N] [--workers 1,2,4]
+"""
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import time
+
+import db
+import keywords
+import recommendations
+from benchmarks.common import Timer, remove_db, report, seed_users, temp_db_path
+
+SAMPLE_VIEWERS = 500
+FIRST = 20
+
+
+def seed_graph(path, users, degree, seed=7):
+    """Случайные принятые связи, в среднем degree на пользователя."""
+    rnd = random.Random(seed)
+    conn = sqlite3.connect(path)
+    edges = users * degree // 2
+    for start in range(0, edges, 100000):
+        conn.executemany(
+            "INSERT OR IGNORE INTO connections (from_user, to_user, status) VALUES (?, ?, 'accepted')",
+            [(rnd.randint(1, users), rnd.randint(1, users)) for _ in range(min(100000, edges - start))],
+        )
+    conn.commit()
+    conn.close()
+
+
+def relevance(path, viewers, first):
+    """Среднее число общих тегов между смотрящим и первыми first профилями его ленты."""
+    conn = sqlite3.connect(path)
+    profiles = {}
+
+    def tags(user_id):
+        if user_id not in profiles:
+            profession, skills = conn.execute("SELECT profession, skills FROM users WHERE user_id=?",
+                                              (user_id,)).fetchone()
+            profiles[user_id] = {*keywords.skill_tags(skills), keywords.profession_tag(profession)}
+        return profiles[user_id]
+
+    async def feeds():
+        latencies, shared = [], []
+        for user_id in viewers:
+            await db.reset_search_seen(user_id)
+            started = time.perf_counter()
+            ids = await db.fill_feed(user_id, first)
+            latencies.append(time.perf_counter() - started)
+            shared.extend(len(tags(user_id) & tags(other)) for other in ids)
+        return latencies, sum(shared) / max(len(shared), 1)
+
+    try:
+        return asyncio.run(feeds())
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=1_000_000)
+    parser.add_argument("--degree", type=int, default=8)
+    cores = os.cpu_count() or 1
+    parser.add_argument("--workers", default=",".join(str(n) for n in (1, 2, 4, 8, 16, 32, cores) if n <= cores))
+    args = parser.parse_args()
+    workers = sorted({int(n) for n in args.workers.split(",")})
+
+    path = temp_db_path("recommendations")
+    try:
+        seed_users(path, args.users)
+        seed_graph(path, args.users, args.degree)
+        db.init(path)
+        db.create_tables()
+        viewers = random.Random(8).sample(range(1, args.users + 1), min(SAMPLE_VIEWERS, args.users))
+        latencies, shared = relevance(path, viewers, FIRST)
+        report("лента: случайная", latencies)
+        print(f"{'':<40} общих тегов в первых {FIRST}: {shared:.2f}")
+
+        with Timer() as t:
+            index = recommendations.load_index()
+        print(f"индекс: {len(index)} пользователей, {len(index.vocabulary.ids)} тегов, {len(index.friend_ids)} "
+              f"рёбер дружбы за {t.elapsed:.1f}с (numpy: {'да' if recommendations.numpy else 'нет'})")
+        baseline = None
+        for n in workers:
+            with Timer() as t:
+                written = recommendations.build(index, workers=n)
+            baseline = baseline or t.elapsed
+            print(f"расчёт top-{recommendations.TOP_K} на {n:>2} процессах: {t.elapsed:8.1f}с "
+                  f"{written / t.elapsed:10.0f} польз./с  ускорение x{baseline / t.elapsed:.2f}")
+
+        latencies, shared = relevance(path, viewers, FIRST)
+        report("лента: рекомендации", latencies)
+        print(f"{'':<40} общих тегов в первых {FIRST}: {shared:.2f}")
+    finally:
+        db.close()
+        remove_db(path)
+
+
+if __name__ == "__main__":
+    main()
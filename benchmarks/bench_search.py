@@ -0,0 +1,64 @@
+"""Латентность выбора следующего профиля: ORDER BY RANDOM() против пакетной выборки ленты по search_rank.
+
+Запуск: python -m benchmarks.bench_search [размер ...]
+"""
+import sqlite3
+import sys
+import time
+
+import db
+import search_feed
+from benchmarks.common import remove_db, report, seed_connections, seed_users, temp_db_path
+
+LEGACY_QUERY = """
+    SELECT u.user_id, u.name, u.profession, u.skills, u.bio, u.photo_id, u.is_premium
+    FROM users u
+    WHERE u.user_id != ?
+    AND NOT EXISTS (
+        SELECT 1 FROM connections c
+        WHERE (c.from_user = ? AND c.to_user = u.user_id)
+        OR (c.to_user = ? AND c.from_user = u.user_id)
+    )
+    ORDER BY RANDOM()
+    LIMIT 1
+"""
+
+
+def legacy_tap(path, user_id):
+    conn = sqlite3.connect(path)
+    conn.execute(LEGACY_QUERY, (user_id, user_id, user_id)).fetchone()
+    conn.close()
+
+
+def measure(fn, rounds):
+    latencies = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or [10_000, 100_000, 1_000_000]
+    user_id = 1
+    for size in sizes:
+        path = temp_db_path("search")
+        try:
+            seed_users(path, size)
+            seed_connections(path, user_id, 500, size)
+            db.init(path)
+            db.create_tables()
+            legacy_rounds = max(5, 2_000_000 // size)
+            report(f"{size:>9} ORDER BY RANDOM()", measure(lambda: legacy_tap(path, user_id), legacy_rounds))
+            feed_latencies = measure(lambda: db.run_sync(db._fill_feed, user_id, search_feed.BATCH_SIZE), 200)
+            report(f"{size:>9} search_rank, пакет ленты", feed_latencies)
+            per_tap = [latency / search_feed.BATCH_SIZE for latency in feed_latencies]
+            report(f"{size:>9} search_rank, на одно нажатие", per_tap)
+        finally:
+            db.close()
+            remove_db(path)
+
+
+if __name__ == "__main__":
+    main()
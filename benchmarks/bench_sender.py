@@ -0,0 +1,79 @@
+"""Исходящая очередь на фейковом боте: соблюдение лимитов, приоритеты, RetryAfter и задержка доставки.
+
+Запуск: python -m benchmarks.bench_sender [сообщений] [чатов]
+"""
+import asyncio
+import collections
+import random
+import sys
+import time
+
+from telegram.error import RetryAfter
+
+import sender
+from benchmarks.common import report
+
+
+class FakeBot:
+    def __init__(self, retry_after_share=0.01, latency=0.02):
+        self.retry_after_share = retry_after_share
+        self.latency = latency
+        self.delivered = []
+        self.rnd = random.Random(1)
+
+    async def send_message(self, chat_id, text, **kwargs):
+        await asyncio.sleep(self.latency)
+        if self.rnd.random() < self.retry_after_share:
+            raise RetryAfter(1)
+        self.delivered.append((time.monotonic(), chat_id, text))
+        return text
+
+
+def max_in_window(times, window):
+    best, start = 0, 0
+    for end in range(len(times)):
+        while times[end] - times[start] >= window:
+            start += 1
+        best = max(best, end - start + 1)
+    return best
+
+
+async def run(total, chats):
+    bot = FakeBot()
+    scheduler = sender.MessageScheduler(bot)
+    scheduler.start()
+    rnd = random.Random(2)
+    futures = []
+    started = time.monotonic()
+    for n in range(total):
+        priority = rnd.choice((sender.PAYMENT, sender.REPLY, sender.NOTIFICATION, sender.NOTIFICATION))
+        futures.append((priority, scheduler.send(rnd.randrange(chats), priority=priority, text=f"{priority}:{n}")))
+    await asyncio.gather(*(future for _, future in futures), return_exceptions=True)
+    elapsed = time.monotonic() - started
+    await scheduler.stop()
+
+    times = sorted(t for t, _, _ in bot.delivered)
+    per_chat = collections.defaultdict(list)
+    for t, chat_id, _ in bot.delivered:
+        per_chat[chat_id].append(t)
+    worst_chat = max(max_in_window(sorted(ts), 1.0) for ts in per_chat.values())
+    finish = {p: [] for p in (sender.PAYMENT, sender.REPLY, sender.NOTIFICATION)}
+    for t, _, text in bot.delivered:
+        finish[int(text.split(":")[0])].append(t - started)
+
+    stats = scheduler.stats()
+    print(f"отправлено {stats['sent']} за {elapsed:.1f}s, RetryAfter {stats['retried']}, ошибок {stats['failed']}")
+    print(f"максимум в секунду: всего {max_in_window(times, 1.0)} (лимит {sender.GLOBAL_RATE:.0f}+burst), "
+          f"в один чат {worst_chat} (лимит {sender.CHAT_RATE:.0f}+burst {sender.CHAT_BURST})")
+    for priority, name in ((sender.PAYMENT, "PAYMENT"), (sender.REPLY, "REPLY"), (sender.NOTIFICATION, "NOTIFICATION")):
+        report(f"время до доставки, {name}", finish[priority])
+
+
+def main():
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 600
+    chats = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    asyncio.run(run(total, chats))
+
+
+if __name__ == "__main__":
+    main()
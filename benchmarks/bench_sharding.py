@@ -0,0 +1,120 @@
+"""Шардирование по процессам: пропускная способность реальных обработчиков на 1, 2, ... N воркерах.
+
+Фронт sharding.ShardFront раздаёт синтетические апдейты (профиль, поиск, пропуск, /find) от
+многих пользователей воркерам по user_id % N. Каждый воркер — отдельный процесс с main.py на
+общей базе и имитацией Bot API (с задержкой --latency на вызов). Время считается до того, как
+все воркеры обработали свою часть и завершились.
+
+Запуск: python -m benchmarks.bench_sharding [--users N] [--updates N] [--workers 1,2,4] [--latency с]
+"""
+import argparse
+import asyncio
+import logging
+import os
+import random
+import sys
+import time
+
+import callbacks
+import db
+import sharding
+import webhook
+from benchmarks.common import remove_db, seed_connections, seed_users, temp_db_path
+from benchmarks.fake_api import FakeBotAPI, callback_update, message_update, offline_builder
+
+CONNECTIONS_PER_USER = 20
+ACTIVE_USERS = 2000
+WORKER_COMMAND = [sys.executable, "-m", "benchmarks.bench_sharding", "--worker"]
+
+
+def make_updates(users, count, rnd):
+    active = rnd.sample(range(1, users + 1), min(ACTIVE_USERS, users))
+    kinds = [
+        lambda uid: message_update(uid, "👤 Мой профиль"),
+        lambda uid: message_update(uid, "🔍 Поиск связей"),
+        lambda uid: callback_update(uid, callbacks.SKIP.encode(rnd.randint(1, users))),
+        lambda uid: message_update(uid, "/find python sql"),
+    ]
+    return [rnd.choice(kinds)(rnd.choice(active)) for _ in range(count)]
+
+
+def run_worker():
+    """Процесс-воркер: база из BENCH_DB, Bot API — имитация с задержкой BENCH_LATENCY."""
+    import main as bot
+    import sender
+
+    logging.getLogger().setLevel(logging.WARNING)
+    db.init(os.environ["BENCH_DB"])
+    db.load_entitlements()
+    api = FakeBotAPI(float(os.environ.get("BENCH_LATENCY", "0")))
+
+    async def post_init(application):
+        await bot.post_init(application)
+        # the benchmark measures handlers, not Telegram's send limits
+        await sender.stop()
+        sender.start(application.bot, global_rate=1e9, global_burst=10 ** 6, chat_rate=1e9, chat_burst=10 ** 6)
+
+    application = bot.build_application(offline_builder(api).concurrent_updates(
+        webhook.PerUserUpdateProcessor(bot.MAX_CONCURRENT_UPDATES)
+    ))
+    application.post_init = post_init
+    try:
+        asyncio.run(sharding.serve_worker(application))
+    finally:
+        db.close()
+
+
+async def measure(count, updates):
+    front = sharding.ShardFront(count, WORKER_COMMAND)
+    await front.start()
+    started = time.perf_counter()
+    try:
+        for data in updates:
+            await front.dispatch(data)
+    finally:
+        # closing the pipes lets every worker drain its share and exit
+        await front.stop()
+    elapsed = time.perf_counter() - started
+    return elapsed, [worker.sent for worker in front.workers]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--updates", type=int, default=20_000)
+    cores = os.cpu_count() or 1
+    parser.add_argument("--workers", default=",".join(str(n) for n in (1, 2, 4, 8, 16, cores) if n <= cores))
+    parser.add_argument("--latency", type=float, default=0.0, help="задержка имитации Bot API на вызов, с")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.worker:
+        run_worker()
+        return
+    logging.getLogger().setLevel(logging.WARNING)
+    workers = sorted({int(n) for n in args.workers.split(",")})
+
+    path = temp_db_path("sharding")
+    try:
+        seed_users(path, args.users)
+        rnd = random.Random(6)
+        for user_id in rnd.sample(range(1, args.users + 1), min(ACTIVE_USERS, args.users)):
+            seed_connections(path, user_id, CONNECTIONS_PER_USER, args.users, seed=user_id)
+        db.init(path)
+        db.create_tables()
+        db.close()
+        updates = make_updates(args.users, args.updates, random.Random(7))
+        os.environ.update(BENCH_DB=path, BENCH_LATENCY=str(args.latency))
+
+        baseline = None
+        print(f"ядер: {cores}")
+        for n in workers:
+            elapsed, sent = asyncio.run(measure(n, updates))
+            baseline = baseline or elapsed
+            print(f"{n:>2} воркеров: {elapsed:8.2f}с {len(updates) / elapsed:10.0f} апд./с  "
+                  f"ускорение x{baseline / elapsed:.2f}  (на воркер: {min(sent)}..{max(sent)})")
+    finally:
+        remove_db(path)
+
+
+if __name__ == "__main__":
+    main()
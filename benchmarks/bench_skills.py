@@ -0,0 +1,97 @@
+"""Фильтр по навыкам и профессии: LIKE по строке skills против пересечения списков в user_skills.
+
+Для каждого фильтра печатает p50/p99 выборки первых 50 пользователей обоими способами и
+сколько найденных LIKE профилей на самом деле не подходят ("go" внутри "django").
+
+Запуск: python -m benchmarks.bench_skills [пользователей] [повторов]
+"""
+import asyncio
+import random
+import sqlite3
+import sys
+import time
+
+import db
+import keywords
+import migrations
+from benchmarks.common import Timer, remove_db, report, seed_users, temp_db_path
+
+FILTERS = [
+    (["python"], None),
+    (["python", "sql"], None),
+    (["python"], "Аналитик"),
+    (["go"], None),
+    (["docker", "kubernetes", "go"], "DevOps"),
+    (["figma", "seo", "excel"], "Дизайнер"),
+    # nobody matches: LIKE has to read every profile
+    (["python", "sql", "ml", "pandas"], None),
+    (["rust"], None),
+]
+
+LIKE_QUERY = """
+    SELECT user_id, profession, skills FROM users
+    WHERE {}
+    AND user_id != ?
+    AND NOT EXISTS (SELECT 1 FROM connections c WHERE c.from_user = ? AND c.to_user = users.user_id)
+    AND NOT EXISTS (SELECT 1 FROM connections c WHERE c.to_user = ? AND c.from_user = users.user_id)
+    LIMIT 50
+"""
+
+
+def like_search(conn, user_id, skills, profession):
+    clauses = ["skills LIKE ?"] * len(skills)
+    params = [f"%{skill}%" for skill in skills]
+    if profession:
+        clauses.append("profession LIKE ?")
+        params.append(f"%{profession}%")
+    return conn.execute(LIKE_QUERY.format(" AND ".join(clauses)), (*params, user_id, user_id, user_id)).fetchall()
+
+
+def wrong(rows, skills, profession):
+    """Сколько строк LIKE не проходят нормализованное сравнение тегов."""
+    wanted = {tag for skill in skills for tag in keywords.skill_tags(skill)}
+    if profession:
+        wanted.add(keywords.profession_tag(profession))
+    return sum(1 for _, prof, text in rows
+               if not wanted <= {*keywords.skill_tags(text), keywords.profession_tag(prof)})
+
+
+def main():
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    path = temp_db_path("skills")
+    try:
+        seed_users(path, users)
+        with Timer() as t:
+            migrations.rebuild("user_skills", path)
+        print(f"разбор навыков в user_skills для {users} пользователей: {t.elapsed:.1f}с")
+        db.init(path)
+        conn = sqlite3.connect(path)
+        rnd = random.Random(9)
+
+        async def facet_round(skills, profession):
+            latencies = []
+            for _ in range(rounds):
+                started = time.perf_counter()
+                await db.facet_search(rnd.randint(1, users), skills, profession)
+                latencies.append(time.perf_counter() - started)
+            return latencies
+
+        for skills, profession in FILTERS:
+            name = ", ".join(skills) + (f" @{profession}" if profession else "")
+            latencies, rows = [], []
+            for _ in range(rounds):
+                started = time.perf_counter()
+                rows = like_search(conn, rnd.randint(1, users), skills, profession)
+                latencies.append(time.perf_counter() - started)
+            report(f"LIKE: {name}", latencies)
+            print(f"{'':<40} неподходящих в выдаче: {wrong(rows, skills, profession)} из {len(rows)}")
+            report(f"user_skills: {name}", asyncio.run(facet_round(skills, profession)))
+        conn.close()
+    finally:
+        db.close()
+        remove_db(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""Холодный старт и миграции: импорт main, проверка версии схемы, порционные миграции с прерыванием.
+
+Печатает время импорта main в новом процессе, проверки схемы при старте против прогона всех
+миграций, полной сборки user_skills и сборки, прерванной kill посередине и продолженной
+повторным запуском. Если после продолжения user_skills отличается от полной сборки,
+скрипт завершается с кодом 1.
+
+Запуск: python -m benchmarks.bench_startup [пользователей]
+"""
+import sqlite3
+import subprocess
+import sys
+import time
+
+import db
+import migrations
+from benchmarks.common import Timer, remove_db, report, seed_users, temp_db_path
+
+IMPORT_ROUNDS = 5
+CHECK_ROUNDS = 200
+SKILLS_QUERY = "SELECT s.name, u.user_id FROM user_skills u JOIN skills s USING (skill_id) ORDER BY 1, 2"
+
+
+def cold_import():
+    latencies = []
+    for _ in range(IMPORT_ROUNDS):
+        started = time.perf_counter()
+        subprocess.run([sys.executable, "-c", "import main"], check=True, capture_output=True)
+        latencies.append(time.perf_counter() - started)
+    return latencies
+
+
+def interrupted_rebuild(path, after):
+    """Сборка user_skills в отдельном процессе, убитом через after секунд; возвращает дошедший ключ."""
+    code = f"import migrations; migrations.rebuild('user_skills', {path!r})"
+    process = subprocess.Popen([sys.executable, "-c", code])
+    time.sleep(after)
+    process.kill()
+    process.wait()
+    conn = sqlite3.connect(path)
+    cursor = conn.execute("SELECT cursor FROM schema_migrations WHERE name = 'user_skills'").fetchone()[0]
+    conn.close()
+    return cursor
+
+
+def main():
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    path = temp_db_path("startup")
+    try:
+        seed_users(path, users)
+        report("холодный импорт main", cold_import())
+
+        db.init(path)
+        latencies = []
+        for _ in range(CHECK_ROUNDS):
+            started = time.perf_counter()
+            db.check_schema()
+            latencies.append(time.perf_counter() - started)
+        report("проверка схемы при старте", latencies)
+        db.run_sync(lambda conn: conn.execute("PRAGMA user_version = 0"))
+        with Timer() as t:
+            db.create_tables()
+        print(f"прогон всех миграций на готовой базе: {t.elapsed * 1000:.1f}ms")
+        db.close()
+
+        with Timer() as t:
+            migrations.rebuild("user_skills", path)
+        print(f"сборка user_skills для {users} пользователей: {t.elapsed:.1f}с")
+        conn = sqlite3.connect(path)
+        expected = conn.execute(SKILLS_QUERY).fetchall()
+        conn.close()
+
+        cursor = interrupted_rebuild(path, t.elapsed / 2)
+        with Timer() as resumed:
+            migrations.migrate(path)
+        print(f"прервана на ключе {cursor}, продолжение: {resumed.elapsed:.1f}с")
+        conn = sqlite3.connect(path)
+        same = conn.execute(SKILLS_QUERY).fetchall() == expected
+        conn.close()
+        print(f"user_skills после продолжения {'совпадает' if same else 'НЕ совпадает'} с полной сборкой")
+    finally:
+        db.close()
+        remove_db(path)
+    if not same:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+import itertools
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+import db
+import migrations
+
+PROFESSIONS = ["Python-разработчик", "Дизайнер", "Аналитик", "DevOps", "Маркетолог", "Product manager", "QA", "Data Scientist"]
+SKILLS = ["python", "django", "sql", "figma", "docker", "kubernetes", "go", "react", "excel", "ml", "pandas", "seo"]
+
+
+def temp_db_path(name="bench"):
+    fd, path = tempfile.mkstemp(prefix=f"colleagues-{name}-", suffix=".db")
+    os.close(fd)
+    return path
+
+
+def remove_db(path):
+    for suffix in ("", "-wal", "-shm"):
+        try:
+            os.remove(path + suffix)
+        except FileNotFoundError:
+            pass
+
+
+USERS_INSERT = """INSERT INTO users
+    (user_id, name, profession, skills, bio, photo_id, username, is_premium, subscription_end, social_link, search_rank)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"""
+
+
+def seed_users(path, count, premium_share=0.1, seed=1, ids=None):
+    rnd = random.Random(seed)
+    db.init(path)
+    db.create_tables()
+    db.close()
+    conn = sqlite3.connect(path)
+    rows = []
+    for user_id in itertools.islice(ids or itertools.count(1), count):
+        is_premium = rnd.random() < premium_share
+        rows.append((
+            user_id,
+            f"User {user_id}",
+            rnd.choice(PROFESSIONS),
+            ", ".join(rnd.sample(SKILLS, 3)),
+            "Опыт работы 5 лет",
+            None,
+            f"user{user_id}",
+            1 if is_premium else 0,
+            "2100-01-01T00:00:00" if is_premium else None,
+            None,
+            rnd.random(),
+        ))
+        if len(rows) >= 50000:
+            conn.executemany(USERS_INSERT, rows)
+            rows.clear()
+    if rows:
+        conn.executemany(USERS_INSERT, rows)
+    conn.commit()
+    conn.close()
+    # the rows bypass the bot, so user_skills is derived the way the migration does it
+    migrations.rebuild("user_skills", path)
+
+
+def seed_connections(path, user_id, count, users, status="accepted", seed=2):
+    rnd = random.Random(seed)
+    targets = rnd.sample(range(1, users + 1), min(count, users))
+    conn = sqlite3.connect(path)
+    conn.executemany(
+        "INSERT OR IGNORE INTO connections (from_user, to_user, status) VALUES (?, ?, ?)",
+        [(user_id, target, status) if i % 2 else (target, user_id, status)
+         for i, target in enumerate(targets) if target != user_id],
+    )
+    conn.commit()
+    conn.close()
+
+
+def seed_works(path, users, per_user=3, seed=3):
+    rnd = random.Random(seed)
+    conn = sqlite3.connect(path)
+    conn.executemany(
+        "INSERT INTO works (user_id, work_title, work_description) VALUES (?, ?, ?)",
+        [(user_id, f"Проект {n}", " ".join(rnd.choices(SKILLS, k=4)))
+         for user_id in users for n in range(1, per_user + 1)],
+    )
+    conn.commit()
+    conn.close()
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = min(len(ordered) - 1, max(0, int(round(p / 100 * (len(ordered) - 1)))))
+    return ordered[k]
+
+
+def report(name, latencies, elapsed=None):
+    line = (f"{name:<40} n={len(latencies):<7} "
+            f"p50={percentile(latencies, 50) * 1000:8.2f}ms "
+            f"p99={percentile(latencies, 99) * 1000:8.2f}ms")
+    if elapsed:
+        line += f" {len(latencies) / elapsed:10.0f}/s"
+    print(line)
+
+
+class Timer:
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = time.perf_counter() - self.start
@@ -0,0 +1,143 @@
+"""Имитация Telegram Bot API для PTB: запросы не уходят в сеть, а записываются и получают готовый ответ."""
+import asyncio
+import itertools
+import json
+import time
+
+from telegram.ext import Application
+from telegram.request import BaseRequest
+
+BOT_TOKEN = "123456:FAKE-TOKEN"
+BOT_USER = {"id": 123456, "is_bot": True, "first_name": "Colleagues", "username": "colleagues_bot"}
+
+MESSAGE_METHODS = {"sendMessage", "sendPhoto", "sendInvoice", "editMessageText", "editMessageCaption",
+                   "editMessageReplyMarkup", "copyMessage", "forwardMessage"}
+
+
+class FakeBotAPI(BaseRequest):
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = []
+        self._message_ids = itertools.count(1)
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None):
+        api_method = url.rsplit("/", 1)[-1]
+        params = request_data.parameters if request_data else {}
+        self.calls.append((api_method, params))
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return 200, json.dumps({"ok": True, "result": self._result(api_method, params)}).encode()
+
+    def _result(self, api_method, params):
+        if api_method == "getMe":
+            return BOT_USER
+        if api_method in MESSAGE_METHODS:
+            chat_id = params.get("chat_id", 0)
+            message = {
+                "message_id": params.get("message_id") or next(self._message_ids),
+                "date": int(time.time()),
+                "chat": {"id": int(chat_id) if str(chat_id).lstrip("-").isdigit() else 0, "type": "private"},
+                "from": BOT_USER,
+            }
+            if "text" in params:
+                message["text"] = params["text"]
+            return message
+        return True
+
+    def count(self, api_method=None):
+        if api_method is None:
+            return len(self.calls)
+        return sum(1 for name, _ in self.calls if name == api_method)
+
+
+def offline_builder(api=None):
+    api = api or FakeBotAPI()
+    return Application.builder().token(BOT_TOKEN).request(api).get_updates_request(FakeBotAPI())
+
+
+_update_ids = itertools.count(1)
+
+
+def _user(user_id):
+    return {"id": user_id, "is_bot": False, "first_name": f"User{user_id}", "username": f"user{user_id}"}
+
+
+def message_update(user_id, text):
+    update_id = next(_update_ids)
+    message = {
+        "message_id": update_id,
+        "date": int(time.time()),
+        "chat": {"id": user_id, "type": "private"},
+        "from": _user(user_id),
+        "text": text,
+    }
+    if text.startswith("/"):
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return {"update_id": update_id, "message": message}
+
+
+def callback_update(user_id, data):
+    update_id = next(_update_ids)
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "from": _user(user_id),
+            "chat_instance": str(user_id),
+            "data": data,
+            "message": {
+                "message_id": update_id,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "from": BOT_USER,
+                "text": "profile",
+            },
+        },
+    }
+
+
+def pre_checkout_update(user_id, payload="premium_subscription", amount=79900, currency="RUB"):
+    update_id = next(_update_ids)
+    return {
+        "update_id": update_id,
+        "pre_checkout_query": {
+            "id": str(update_id),
+            "from": _user(user_id),
+            "currency": currency,
+            "total_amount": amount,
+            "invoice_payload": payload,
+        },
+    }
+
+
+def successful_payment_update(user_id, payload="premium_subscription", amount=79900, currency="RUB",
+                              charge_id=None):
+    update_id = next(_update_ids)
+    charge_id = charge_id or f"tg-{update_id}"
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": _user(user_id),
+            "successful_payment": {
+                "currency": currency,
+                "total_amount": amount,
+                "invoice_payload": payload,
+                "telegram_payment_charge_id": charge_id,
+                "provider_payment_charge_id": f"pm-{charge_id}",
+            },
+        },
+    }
@@ -0,0 +1,145 @@
+"""Повтор платёжных апдейтов: дубликаты и произвольный порядок через реальные обработчики.
+
+Каждому пользователю приходит payments платежей, каждый successful_payment доставляется
+copies раз, всё перемешано и обрабатывается параллельно. После прогона проверяется, что
+каждый платёж проведён ровно один раз, подписки сложились (окончание = первый платёж +
+payments * SUBSCRIPTION_DAYS), подтверждение ушло по разу на платёж, а индекс подписок
+совпадает с базой. Каждый десятый пользователь платит, ещё не заполнив профиль: его
+подписка должна пережить перезапуск, а сам он не должен попасть в поиск. При расхождении
+скрипт завершается с кодом 1.
+
+Запуск: python -m benchmarks.replay_payments [пользователей] [платежей] [копий]
+"""
+import asyncio
+import datetime
+import logging
+import random
+import sys
+import time
+
+from telegram import Update
+
+import db
+import main as bot
+import sender
+from benchmarks.common import remove_db, report, seed_users, temp_db_path
+from benchmarks.fake_api import FakeBotAPI, offline_builder, pre_checkout_update, successful_payment_update
+
+CONCURRENCY = 256
+# every UNREGISTERED-th user pays before filling in a profile
+UNREGISTERED = 10
+
+
+async def replay(users, payments, copies):
+    api = FakeBotAPI()
+    application = bot.build_application(offline_builder(api))
+    await application.initialize()
+    await bot.post_init(application)
+    await sender.stop()
+    sender.start(application.bot, global_rate=1e9, global_burst=10 ** 6, chat_rate=1e9, chat_burst=10 ** 6)
+    await application.start()
+
+    rnd = random.Random(6)
+    updates = []
+    for user_id in range(1, users + 1):
+        for n in range(payments):
+            updates.append(pre_checkout_update(user_id))
+            for _ in range(copies):
+                updates.append(successful_payment_update(user_id, charge_id=f"charge-{user_id}-{n}"))
+    rnd.shuffle(updates)
+
+    slots = asyncio.Semaphore(CONCURRENCY)
+    latencies = []
+
+    async def process(data):
+        async with slots:
+            started = time.perf_counter()
+            await application.process_update(Update.de_json(data, application.bot))
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(*(process(data) for data in updates))
+        elapsed = time.perf_counter() - started
+        await asyncio.sleep(0.5)
+    finally:
+        await application.stop()
+        await application.shutdown()
+        await bot.post_shutdown(application)
+    report("платёжные апдейты", latencies, elapsed)
+    # db.init() below resets the index, so keep what the handlers left in it
+    indexed = {user_id: db.entitlements.expires_at(user_id) for user_id in range(1, users + 1)}
+    return api, indexed
+
+
+def verify(api, indexed, users, payments):
+    errors = []
+    confirmations = sum(1 for name, params in api.calls
+                        if name == "sendMessage" and "активна до" in str(params.get("text", "")))
+    if confirmations != users * payments:
+        errors.append(f"подтверждений {confirmations}, ожидалось {users * payments}")
+    answered = [params for name, params in api.calls if name == "answerPreCheckoutQuery"]
+    if any(str(params.get("ok")).lower() != "true" for params in answered):
+        errors.append("отказ на pre-checkout")
+
+    ledger = db.run_sync(lambda conn: conn.execute(
+        # the payment applied first has the earliest end; the rest stack on top of it
+        "SELECT user_id, n, created_at FROM ("
+        "  SELECT user_id, created_at, count(*) OVER w AS n,"
+        "         row_number() OVER (w ORDER BY subscription_end) AS rn"
+        "  FROM payments WINDOW w AS (PARTITION BY user_id)"
+        ") WHERE rn = 1").fetchall())
+    if sum(count for _, count, _ in ledger) != users * payments:
+        errors.append(f"в журнале {sum(count for _, count, _ in ledger)} платежей, ожидалось {users * payments}")
+    ends = dict(db.run_sync(lambda conn: conn.execute("SELECT user_id, subscription_end FROM users").fetchall()))
+    for user_id, count, first in ledger:
+        expected = datetime.datetime.fromisoformat(first) + datetime.timedelta(days=db.SUBSCRIPTION_DAYS * count)
+        if ends.get(user_id) is None:
+            errors.append(f"пользователь {user_id}: подписка не записана")
+            continue
+        actual = datetime.datetime.fromisoformat(ends[user_id])
+        if actual != expected:
+            errors.append(f"пользователь {user_id}: подписка до {actual}, ожидалось {expected}")
+        # the in-memory index must agree with the database without a reload
+        if indexed[user_id] is None or abs(indexed[user_id] - actual) > datetime.timedelta(milliseconds=1):
+            errors.append(f"пользователь {user_id}: в индексе подписок {indexed[user_id]}")
+
+    # a restart loads subscriptions from the database, profile or not
+    db.load_entitlements()
+    lost = [user_id for user_id in range(1, users + 1) if not db.get_user_subscription(user_id)]
+    if lost:
+        errors.append(f"после перезапуска без подписки {len(lost)} пользователей, например {lost[:5]}")
+    unranked = db.run_sync(lambda conn: conn.execute(
+        "SELECT count(*) FROM users WHERE search_rank IS NOT NULL AND name IS NULL").fetchone()[0])
+    if unranked:
+        errors.append(f"{unranked} пользователей без профиля попадут в поиск")
+    return errors
+
+
+def main():
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    payments = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    copies = int(sys.argv[3]) if len(sys.argv) > 3 else 3
+    logging.getLogger().setLevel(logging.WARNING)
+    path = temp_db_path("payments")
+    try:
+        registered = [user_id for user_id in range(1, users + 1) if user_id % UNREGISTERED]
+        seed_users(path, len(registered), premium_share=0.0, ids=registered)
+        db.init(path)
+        db.create_tables()
+        db.load_entitlements()
+        api, indexed = asyncio.run(replay(users, payments, copies))
+        db.init(path)
+        errors = verify(api, indexed, users, payments)
+    finally:
+        db.close()
+        remove_db(path)
+    for line in errors[:20]:
+        print(f"ОШИБКА {line}")
+    print(f"пользователей={users} платежей={users * payments} доставок={users * payments * copies}: "
+          f"{'OK' if not errors else f'{len(errors)} расхождений'}")
+    sys.exit(1 if errors else 0)
+
+
+if __name__ == "__main__":
+    main()
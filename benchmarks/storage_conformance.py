@@ -0,0 +1,177 @@
+"""Проверки интерфейса хранилища на SQLiteStorage: платежи, связи, подписки и состояние бота.
+
+Запуск: python -m benchmarks.storage_conformance
+"""
+import asyncio
+import datetime
+import sys
+import time
+
+import db
+import rate_limit
+from benchmarks.common import remove_db, temp_db_path
+
+PROFILE = {"name": "Анна", "profession": "Аналитик", "skills": "sql, python", "bio": "bio",
+           "photo_id": None, "username": "anna", "social_link": None}
+
+
+def check(condition, message):
+    if not condition:
+        raise AssertionError(message)
+
+
+async def check_users(s):
+    check(await s.get_user(1) is None, "несуществующий пользователь")
+    await s.update_user_fields(1, PROFILE)
+    row = dict(zip(db.USER_COLUMNS, await s.get_user(1)))
+    check(row["name"] == "Анна" and row["username"] == "anna", f"профиль после создания: {row}")
+    check(row["profile_version"] == 0 and not row["is_premium"], f"новый профиль: {row}")
+    await s.update_user_fields(1, {"bio": "новое"})
+    row = dict(zip(db.USER_COLUMNS, await s.get_user(1)))
+    check(row["bio"] == "новое" and row["name"] == "Анна", "частичное обновление не трогает другие поля")
+    check(row["profile_version"] == 1, "profile_version растёт при правке")
+
+
+async def check_works(s):
+    check(await s.get_user_works(1) == [], "работ нет")
+
+
+async def check_connections(s):
+    for user_id in range(10, 40):
+        await s.update_user_fields(user_id, dict(PROFILE, name=f"u{user_id}"))
+    now = time.time()
+    check(await s.request_connection(1, 10, 3, now) == (rate_limit.SENT, 0.0), "первый запрос")
+    check((await s.request_connection(1, 10, 3, now))[0] == rate_limit.DUPLICATE, "повтор той же паре")
+    check((await s.request_connection(1, 11, 3, now))[0] == rate_limit.SENT, "второй запрос")
+    check((await s.request_connection(1, 12, 3, now))[0] == rate_limit.SENT, "третий запрос")
+    status, wait = await s.request_connection(1, 13, 3, now)
+    check(status == rate_limit.LIMITED and 0 < wait <= rate_limit.DAY / 3, f"лимит: {status} {wait}")
+    await s.reset_connection_limit(1)
+    check((await s.request_connection(1, 13, 3, now))[0] == rate_limit.SENT, "отклонённый лимитом запрос не сохранён")
+
+    check(await s.answer_requests(13, 1, 1, False) == [1], "отклонение запроса")
+    for peer in range(10, 13):
+        check(await s.answer_requests(peer, 1, 1, True) == [1], "принятие запроса")
+    check(await s.answer_requests(10, 1, 1, True) == [], "повторный ответ ничего не меняет")
+    for peer in range(13, 35):
+        await s.request_connection(peer, 1, 200, now)
+    check(await s.pending_count(1) == 22, "число входящих запросов")
+    rows, has_more = await s.pending_page(1, None, None, 10)
+    check([r[0] for r in rows] == list(range(13, 23)) and has_more, "первая страница входящих")
+    rows, has_more = await s.pending_page(1, None, 23, 10)
+    check([r[0] for r in rows] == list(range(13, 23)) and not has_more, "входящие назад")
+    check(sorted(await s.answer_requests(1, 13, 34, True)) == list(range(13, 35)), "принятие диапазона")
+    check(await s.pending_page(1, None, None, 10) == ([], False), "входящих не осталось")
+    rows, has_more = await s.connections_page(1, None, None, 10)
+    check([r[0] for r in rows] == list(range(10, 20)) and has_more, "первая страница")
+    check(rows[0][1] == "u10" and rows[0][3] == "anna", "поля страницы")
+    rows, has_more = await s.connections_page(1, 29, None, 10)
+    check([r[0] for r in rows] == list(range(30, 35)) and not has_more, "последняя страница")
+    rows, has_more = await s.connections_page(1, None, 20, 10)
+    check([r[0] for r in rows] == list(range(10, 20)) and not has_more, "страница назад")
+    rows, _ = await s.connections_page(10, None, None, 10)
+    check([r[0] for r in rows] == [1], "связь видна с обеих сторон")
+    for peer in (35, 36, 38):
+        await s.request_connection(peer, 1, 200, now)
+    check(sorted(await s.answer_requests(1, 35, 37, False)) == [35, 36], "отклонение диапазона")
+    rows, _ = await s.pending_page(1, None, None, 10)
+    check([r[0] for r in rows] == [38], "запрос вне диапазона остался")
+    # a request that arrives after the page was drawn, inside its range, is not answered with it
+    await s.request_connection(37, 1, 200, now)
+    check(await s.answer_requests(1, 37, 38, True, rows[-1][4]) == [38], "принятие по показанной странице")
+    rows, _ = await s.pending_page(1, None, None, 10)
+    check([r[0] for r in rows] == [37] and rows[0][4] > 0, "запрос после показа страницы остался")
+
+
+async def check_subscriptions(s):
+    soon = datetime.datetime.now() + datetime.timedelta(days=1)
+    later = datetime.datetime.now() + datetime.timedelta(days=30)
+    await s.set_premium(10, soon)
+    await s.set_premium(11, later)
+    check(dict(zip(db.USER_COLUMNS, await s.get_user(10)))["is_premium"], "премиум включён")
+    loaded = dict(await s.load_entitlements())
+    check(set(loaded) == {10, 11}, f"загрузка подписок: {loaded}")
+    check(datetime.datetime.fromisoformat(loaded[11]) == later, "дата окончания без потерь")
+    expired = await s.expire_chunk(soon + datetime.timedelta(seconds=1), 100)
+    check(expired == [10], f"истёкшие: {expired}")
+    check(not dict(zip(db.USER_COLUMNS, await s.get_user(10)))["is_premium"], "премиум снят")
+    await s.set_premium(11, None)
+    check(await s.load_entitlements() == [], "отмена подписки")
+
+
+async def check_payments(s):
+    now = datetime.datetime.now().replace(microsecond=0)
+    month = datetime.timedelta(days=30)
+    await s.update_user_fields(50, PROFILE)
+    check(await s.apply_payment(50, "c1", "p1", 100, "RUB", "premium", 30, now) == (True, now + month),
+          "первый платёж")
+    check(await s.apply_payment(50, "c1", "p1", 100, "RUB", "premium", 30, now) == (False, now + month),
+          "повтор платежа не продлевает")
+    # a renewal delivered late, with an earlier timestamp, still stacks on the current end
+    check(await s.apply_payment(50, "c2", "p2", 100, "RUB", "premium", 30, now - datetime.timedelta(days=1))
+          == (True, now + 2 * month), "продление от текущего окончания")
+    check(await s.apply_payment(50, "c1", "p1", 100, "RUB", "premium", 30, now) == (False, now + month),
+          "повтор возвращает окончание из журнала")
+    row = dict(zip(db.USER_COLUMNS, await s.get_user(50)))
+    check(row["is_premium"] and datetime.datetime.fromisoformat(row["subscription_end"]) == now + 2 * month,
+          f"подписка после платежей: {row}")
+
+    await s.update_user_fields(51, PROFILE)
+    results = await asyncio.gather(*(s.apply_payment(51, f"d{i % 3}", f"q{i % 3}", 100, "RUB", "premium", 30, now)
+                                     for i in range(9)))
+    check(sum(applied for applied, _ in results) == 3, f"одновременные повторы проведены один раз: {results}")
+    check(max(end for _, end in results) == now + 3 * month, f"одновременные платежи складываются: {results}")
+
+    # paying before filling in a profile still has to survive a restart
+    check(await s.apply_payment(52, "e1", "r1", 100, "RUB", "premium", 30, now) == (True, now + month),
+          "платёж без профиля")
+    check(dict(await s.load_entitlements()).keys() == {50, 51, 52}, "подписки после платежей")
+    await s.update_user_fields(52, PROFILE)
+    row = dict(zip(db.USER_COLUMNS, await s.get_user(52)))
+    check(row["is_premium"] and row["name"] == PROFILE["name"], f"профиль после платежа: {row}")
+
+
+async def check_state(s):
+    check(await s.load_state("user_data") == [], "пустое состояние")
+    await s.save_state([("user_data", "1", '{"a":1}'), ("user_data", "2", '{"b":"ё"}'),
+                        ("conversation:profile", "[1, 1]", "3")], [])
+    check(sorted(await s.load_state("user_data")) == [("1", '{"a":1}'), ("2", '{"b":"ё"}')], "запись состояния")
+    check(await s.load_state("conversation:profile") == [("[1, 1]", "3")], "виды состояния не смешиваются")
+    await s.save_state([("user_data", "1", '{"a":2}')], [("user_data", "2"), ("user_data", "404")])
+    check(await s.load_state("user_data") == [("1", '{"a":2}')], "перезапись и удаление одной пачкой")
+    await s.save_state([], [("conversation:profile", "[1, 1]")])
+    check(await s.load_state("conversation:profile") == [], "удаление диалога")
+
+
+CHECKS = [check_users, check_works, check_connections, check_subscriptions, check_payments, check_state]
+
+
+async def run_checks(name, s):
+    await s.start()
+    failures = 0
+    try:
+        for fn in CHECKS:
+            try:
+                await fn(s)
+                print(f"{name:<12} {fn.__name__:<24} ok")
+            except AssertionError as e:
+                failures += 1
+                print(f"{name:<12} {fn.__name__:<24} FAIL: {e}")
+    finally:
+        await s.close()
+    return failures
+
+
+def main():
+    path = temp_db_path("conformance")
+    try:
+        db.init(path)
+        failures = asyncio.run(run_checks("sqlite", db.SQLiteStorage()))
+    finally:
+        db.close()
+        remove_db(path)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
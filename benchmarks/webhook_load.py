@@ -0,0 +1,111 @@
+"""Нагрузочный генератор для вебхука: синтетические апдейты Telegram по HTTP на локальный WebhookServer.
+
+Запуск: python -m benchmarks.webhook_load [апдейтов] [соединений] [пользователей] [noop|help]
+
+В режиме noop измеряется сам конвейер (HTTP, очередь, порядок по пользователю), в режиме help —
+реальные обработчики main.py с имитацией Bot API вместо сети.
+"""
+import asyncio
+import json
+import sys
+import time
+
+from telegram import Update
+from telegram.ext import TypeHandler
+
+import db
+import webhook
+from benchmarks.common import remove_db, report, temp_db_path
+from benchmarks.fake_api import FakeBotAPI, message_update, offline_builder
+
+SECRET = "load-test-secret"
+
+
+def build(mode, api):
+    builder = offline_builder(api).updater(None).concurrent_updates(webhook.PerUserUpdateProcessor(64))
+    order = {}
+    if mode == "help":
+        import main
+        application = main.build_application(builder)
+    else:
+        application = builder.build()
+
+    async def record(update, context):
+        order.setdefault(update.effective_user.id, []).append(update.update_id)
+        await asyncio.sleep(0)
+
+    application.add_handler(TypeHandler(Update, record), group=-1)
+    return application, order
+
+
+async def client(port, bodies, latencies, statuses):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    for body in bodies:
+        start = time.perf_counter()
+        writer.write(
+            f"POST /telegram HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\n"
+            f"X-Telegram-Bot-Api-Secret-Token: {SECRET}\r\nContent-Length: {len(body)}\r\n\r\n".encode()
+            + body
+        )
+        await writer.drain()
+        status = int((await reader.readline()).split()[1])
+        while (await reader.readline()) not in (b"\r\n", b""):
+            pass
+        latencies.append(time.perf_counter() - start)
+        statuses[status] = statuses.get(status, 0) + 1
+    writer.close()
+
+
+async def run(total, connections, users, mode):
+    api = FakeBotAPI()
+    application, order = build(mode, api)
+    server = webhook.WebhookServer(application, "127.0.0.1", 0, secret_token=SECRET, queue_size=1000)
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    await server.start()
+    await application.start()
+
+    text = "🆘 Помощь" if mode == "help" else "ping"
+    updates = [message_update(n % users + 1, text) for n in range(total)]
+    bodies = [json.dumps(update).encode() for update in updates]
+    per_client = [bodies[i::connections] for i in range(connections)]
+
+    latencies, statuses = [], {}
+    start = time.perf_counter()
+    await asyncio.gather(*(client(server.port, chunk, latencies, statuses) for chunk in per_client))
+    accepted = time.perf_counter() - start
+    await server.queue.join()
+    processed = time.perf_counter() - start
+
+    await server.stop()
+    await application.stop()
+    await application.shutdown()
+    if application.post_shutdown:
+        await application.post_shutdown(application)
+
+    out_of_order = sum(1 for ids in order.values() if ids != sorted(ids))
+    report(f"HTTP-приём ({mode})", latencies, accepted)
+    print(f"обработано {sum(len(ids) for ids in order.values())} апдейтов за {processed:.2f}s "
+          f"({total / processed:.0f}/s), ответы {statuses}, вызовов Bot API {api.count()}, "
+          f"пользователей с нарушенным порядком: {out_of_order}")
+
+
+def main():
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    connections = int(sys.argv[2]) if len(sys.argv) > 2 else 40
+    users = int(sys.argv[3]) if len(sys.argv) > 3 else 500
+    mode = sys.argv[4] if len(sys.argv) > 4 else "noop"
+    path = temp_db_path("webhook")
+    try:
+        # main.py handlers and persistence need the schema even when only /help is sent
+        db.init(path)
+        db.create_tables()
+        asyncio.run(run(total, connections, users, mode))
+    finally:
+        db.close()
+        remove_db(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+import collections
+import time
+
+MISSING = object()
+
+
+class LRUCache:
+    """LRU-кэш с TTL и счётчиками попаданий, промахов и вытеснений.
+
+    Используется только из цикла событий, поэтому блокировок нет.
+    """
+
+    def __init__(self, maxsize=10000, ttl=300.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = collections.OrderedDict()
+        # bumped on every invalidation so a read that raced a write is not stored
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return MISSING
+        value, expires = entry
+        if expires < time.monotonic():
+            del self._data[key]
+            self.expirations += 1
+            self.misses += 1
+            return MISSING
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value, generation=None):
+        if generation is not None and generation != self.generation:
+            return
+        self._data[key] = (value, time.monotonic() + self.ttl)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key):
+        self.generation += 1
+        self._data.pop(key, None)
+
+    def clear(self):
+        self.generation += 1
+        self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,126 @@
+import asyncio
+import functools
+import logging
+import re
+
+from telegram.error import TelegramError
+from telegram.ext import CallbackQueryHandler
+
+logger = logging.getLogger(__name__)
+
+VERSION = "1"
+# Telegram limit for callback_data
+MAX_BYTES = 64
+SEPARATOR = ":"
+INT_PATTERN = r"[0-9a-z]+"
+
+
+def _encode_int(value):
+    if value < 0:
+        raise ValueError(f"Отрицательное число в callback_data: {value}")
+    digits = []
+    while True:
+        value, digit = divmod(value, 36)
+        digits.append("0123456789abcdefghijklmnopqrstuvwxyz"[digit])
+        if not value:
+            return "".join(reversed(digits))
+
+
+class Action:
+    """Действие inline-кнопки: короткий код и типы аргументов (int или str).
+
+    Новый формат — "<версия><код>:<арг>:...", числа в base36. legacy — регулярка старого
+    формата ("connect_123"), чтобы кнопки в уже отправленных сообщениях продолжали работать.
+    """
+
+    __slots__ = ("name", "code", "types", "legacy", "pattern")
+
+    def __init__(self, name, code, types, legacy=None):
+        self.name = name
+        self.code = code
+        self.types = types
+        self.legacy = re.compile(legacy) if legacy else None
+        parts = [re.escape(VERSION + code)] + [INT_PATTERN if t is int else r"[^:]*" for t in types]
+        current = "^" + re.escape(SEPARATOR).join(parts) + "$"
+        self.pattern = re.compile(f"{current}|{legacy}" if legacy else current)
+
+    def encode(self, *args):
+        if len(args) != len(self.types):
+            raise ValueError(f"{self.name}: ожидается {len(self.types)} аргументов, передано {len(args)}")
+        parts = [VERSION + self.code]
+        for kind, value in zip(self.types, args):
+            if kind is int:
+                parts.append(_encode_int(value))
+            else:
+                value = str(value)
+                if SEPARATOR in value:
+                    raise ValueError(f"{self.name}: '{SEPARATOR}' в строковом аргументе")
+                parts.append(value)
+        data = SEPARATOR.join(parts)
+        if len(data.encode()) > MAX_BYTES:
+            raise ValueError(f"{self.name}: callback_data длиннее {MAX_BYTES} байт")
+        return data
+
+    def decode(self, data):
+        head, *values = data.split(SEPARATOR)
+        if head == VERSION + self.code:
+            return [int(v, 36) if kind is int else v for kind, v in zip(self.types, values)]
+        match = self.legacy.match(data)
+        return [int(v) if kind is int else v for kind, v in zip(self.types, match.groups())]
+
+
+ACTIONS = {}
+
+
+def action(name, code, *types, legacy=None):
+    if code in {a.code for a in ACTIONS.values()}:
+        raise ValueError(f"Код действия уже занят: {code}")
+    ACTIONS[name] = Action(name, code, types, legacy)
+    return ACTIONS[name]
+
+
+PREMIUM_PURCHASE = action("premium_purchase", "pp", legacy=r"^premium_purchase$")
+PREMIUM_CANCEL = action("premium_cancel", "pc", legacy=r"^cancel_premium$")
+CONNECT = action("connect", "c", int, legacy=r"^connect_(\d+)$")
+SKIP = action("skip", "s", int, legacy=r"^skip_(\d+)$")
+ACCEPT = action("accept", "a", int, legacy=r"^accept_(\d+)$")
+DECLINE = action("decline", "d", int, legacy=r"^decline_(\d+)$")
+# pagination never shipped in the old format, so there is nothing legacy to match
+CONNECTIONS_NEXT = action("connections_next", "n", int)
+CONNECTIONS_PREV = action("connections_prev", "p", int)
+VIEW = action("view", "v", int, legacy=r"^view_(\d+)$")
+INBOX = action("inbox", "i")
+INBOX_NEXT = action("inbox_next", "in", int)
+INBOX_PREV = action("inbox_prev", "ip", int)
+# (requester, page start) so the page can be redrawn after the answer
+INBOX_ACCEPT = action("inbox_accept", "ia", int, int)
+INBOX_DECLINE = action("inbox_decline", "id", int, int)
+# (first, last) requester on the page and its newest request id, so requests that came later are kept
+INBOX_ACCEPT_ALL = action("inbox_accept_all", "iaa", int, int, int)
+INBOX_DECLINE_ALL = action("inbox_decline_all", "ida", int, int, int)
+
+
+def route(action_, fn):
+    """CallbackQueryHandler для действия.
+
+    Ответ на query уходит сразу и параллельно с работой обработчика, а fn получает уже
+    разобранные аргументы: fn(update, context, *args).
+    """
+    @functools.wraps(fn)
+    async def callback(update, context):
+        query = update.callback_query
+        answer = asyncio.ensure_future(query.answer())
+        try:
+            await fn(update, context, *action_.decode(query.data))
+        finally:
+            try:
+                await answer
+            except TelegramError as e:
+                logger.warning(f"Не удалось ответить на callback {action_.name}: {e}")
+
+    return CallbackQueryHandler(callback, pattern=action_.pattern)
+
+
+async def answer_unknown(update, context):
+    """Отвечает на устаревшие и неизвестные кнопки, чтобы у пользователя не висели часики."""
+    await update.callback_query.answer()
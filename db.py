@@ -0,0 +1,903 @@
+import array
+import asyncio
+import datetime
+import json
+import logging
+import queue
+import random
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import cache
+import entitlements as entitlements_module
+import keywords
+import rate_limit
+import storage
+
+logger = logging.getLogger(__name__)
+
+DB_PATH = "colleagues.db"
+POOL_SIZE = 4
+STATEMENT_CACHE = 256
+USER_CACHE_SIZE = 50000
+USER_CACHE_TTL = 600.0
+# number of the last step in migrations.py
+SCHEMA_VERSION = 16
+
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-16000",
+    "PRAGMA mmap_size=134217728",
+    "PRAGMA busy_timeout=5000",
+)
+
+
+class ConnectionPool:
+    def __init__(self, path=DB_PATH, size=POOL_SIZE):
+        self.path = path
+        self.size = size
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        # cached_statements keeps prepared statements alive for the lifetime of the connection;
+        # IMMEDIATE takes the write lock at the first write, so a transaction that read before it
+        # waits on busy_timeout instead of failing when another process committed meanwhile
+        conn = sqlite3.connect(self.path, check_same_thread=False, cached_statements=STATEMENT_CACHE,
+                               isolation_level="IMMEDIATE")
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            create = self._created < self.size
+            if create:
+                self._created += 1
+        if create:
+            try:
+                return self._connect()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+        return self._idle.get()
+
+    def release(self, conn):
+        self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._created -= 1
+
+
+_pool = None
+_executor = None
+
+
+def init(path=DB_PATH, size=POOL_SIZE):
+    global _pool, _executor
+    close()
+    user_cache.clear()
+    entitlements.load(())
+    _pool = ConnectionPool(path, size)
+    _executor = ThreadPoolExecutor(max_workers=size, thread_name_prefix="db")
+
+
+def close():
+    global _pool, _executor
+    if _executor is not None:
+        _executor.shutdown(wait=True)
+        _executor = None
+    if _pool is not None:
+        _pool.close()
+        _pool = None
+
+
+def database_path():
+    _ensure_init()
+    return _pool.path
+
+
+def _ensure_init():
+    if _pool is None:
+        init()
+
+
+def run_sync(fn, *args):
+    """Выполняет fn(conn, *args) в одной транзакции на соединении из пула."""
+    _ensure_init()
+    with _pool.connection() as conn:
+        with conn:
+            return fn(conn, *args)
+
+
+async def run(fn, *args):
+    """Асинхронный вариант run_sync: запрос выполняется в пуле потоков, а не в цикле событий."""
+    _ensure_init()
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, run_sync, fn, *args)
+
+
+async def fetchone(sql, params=()):
+    return await run(lambda conn: conn.execute(sql, params).fetchone())
+
+
+async def fetchall(sql, params=()):
+    return await run(lambda conn: conn.execute(sql, params).fetchall())
+
+
+async def execute(sql, params=()):
+    return await run(lambda conn: conn.execute(sql, params).rowcount)
+
+
+def _user_tags(profession, skills):
+    tags = keywords.skill_tags(skills)
+    tag = keywords.profession_tag(profession)
+    if tag:
+        tags.append(tag)
+    return tags
+
+
+def _intern_skills(c, names):
+    """name -> skill_id, новые названия добавляются в словарь."""
+    c.executemany("INSERT INTO skills (name) VALUES (?) ON CONFLICT(name) DO NOTHING", [(name,) for name in names])
+    return dict(c.execute("SELECT name, skill_id FROM skills WHERE name IN (SELECT value FROM json_each(?))",
+                          (json.dumps(list(names), ensure_ascii=False),)))
+
+
+def _sync_user_skills(conn, user_id):
+    profession, skills = conn.execute("SELECT profession, skills FROM users WHERE user_id=?", (user_id,)).fetchone()
+    tags = _user_tags(profession, skills)
+    new = set(_intern_skills(conn, tags).values()) if tags else set()
+    old = {row[0] for row in conn.execute("SELECT skill_id FROM user_skills WHERE user_id=?", (user_id,))}
+    conn.executemany("DELETE FROM user_skills WHERE skill_id=? AND user_id=?", [(s, user_id) for s in old - new])
+    conn.executemany("INSERT INTO user_skills (skill_id, user_id) VALUES (?, ?)", [(s, user_id) for s in new - old])
+    conn.executemany("UPDATE skills SET users = users + ? WHERE skill_id=?",
+                     [(-1, s) for s in old - new] + [(1, s) for s in new - old])
+
+
+def _schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def create_tables():
+    """Доводит схему до SCHEMA_VERSION и возвращает номера применённых миграций."""
+    # imported here: the migration steps are only needed when the schema is behind
+    import migrations
+    _ensure_init()
+    return migrations.migrate(_pool.path)
+
+
+def check_schema():
+    """Проверка при старте: одно чтение PRAGMA user_version вместо DDL.
+
+    Отстающая схема доводится миграциями, схема новее кода — ошибка.
+    """
+    version = run_sync(_schema_version)
+    if version == SCHEMA_VERSION:
+        return
+    if version > SCHEMA_VERSION:
+        raise RuntimeError(f"Схема базы версии {version} новее кода ({SCHEMA_VERSION})")
+    logger.warning(f"Схема базы версии {version}, нужна {SCHEMA_VERSION}: применяю миграции. "
+                   "Большую базу лучше мигрировать заранее: python main.py --migrate-only")
+    create_tables()
+
+
+USER_COLUMNS = ("user_id", "name", "profession", "skills", "bio", "photo_id", "username",
+                "is_premium", "subscription_end", "social_link", "profile_version")
+
+
+class UserRecord:
+    __slots__ = USER_COLUMNS
+
+    def __init__(self, row):
+        for field, value in zip(USER_COLUMNS, row):
+            setattr(self, field, value)
+        self.is_premium = bool(self.is_premium)
+
+
+user_cache = cache.LRUCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+entitlements = entitlements_module.EntitlementIndex()
+connection_limiter = rate_limit.ConnectionLimiter()
+
+
+async def get_user(user_id):
+    user = user_cache.get(user_id)
+    if user is not cache.MISSING:
+        return user
+    generation = user_cache.generation
+    row = await backend.get_user(user_id)
+    user = UserRecord(row) if row else None
+    if user is not None and user.name is None:
+        # only a subscription so far (paid before filling in a profile): no profile yet
+        user = None
+    user_cache.put(user_id, user, generation)
+    return user
+
+
+PROFILE_FIELDS = ("name", "profession", "skills", "bio", "photo_id", "username", "social_link")
+
+
+def _update_user_fields(conn, user_id, fields):
+    columns = list(fields)
+    # one upsert: creates the profile on first edit, otherwise touches only the given columns
+    conn.execute(
+        f"""INSERT INTO users (user_id, search_rank, {', '.join(columns)})
+            VALUES (?, ?, {', '.join(['?'] * len(columns))})
+            ON CONFLICT(user_id) DO UPDATE SET {', '.join(f'{c}=excluded.{c}' for c in columns)},
+                search_rank = coalesce(search_rank, excluded.search_rank),
+                profile_version = profile_version + 1""",
+        (user_id, random.random(), *(fields[c] for c in columns)),
+    )
+    if "skills" in fields or "profession" in fields:
+        _sync_user_skills(conn, user_id)
+
+
+async def update_user_fields(user_id, **fields):
+    if not fields:
+        return
+    for column in fields:
+        if column not in PROFILE_FIELDS:
+            raise ValueError(f"Неизвестное поле профиля: {column}")
+    try:
+        await backend.update_user_fields(user_id, fields)
+    finally:
+        user_cache.invalidate(user_id)
+    if "skills" in fields or "profession" in fields:
+        await mark_recommendations_stale((user_id,))
+
+
+CONNECTIONS_PAGE = 10
+PAGE_FIELDS = ("user_id", "name", "profession", "username")
+
+
+def _page(rows, has_more, after, before, fields=PAGE_FIELDS):
+    page = [dict(zip(fields, row)) for row in rows]
+    if before is not None:
+        return page, has_more, True
+    return page, after is not None, has_more
+
+
+def _connections_page(conn, user_id, after, before, limit):
+    # two range reads on covering indexes, one per direction, instead of an OR-join
+    op, order, bound = storage.keyset(after, before)
+    rows = conn.execute(f"""
+        SELECT users.user_id, users.name, users.profession, users.username
+        FROM (
+            SELECT peer FROM (
+                SELECT to_user AS peer FROM connections
+                WHERE from_user = ? AND status = 'accepted' AND to_user {op} ?
+                ORDER BY to_user {order} LIMIT ?
+            )
+            UNION ALL
+            SELECT peer FROM (
+                SELECT from_user AS peer FROM connections
+                WHERE to_user = ? AND status = 'accepted' AND from_user {op} ?
+                ORDER BY from_user {order} LIMIT ?
+            )
+            ORDER BY peer {order} LIMIT ?
+        ) AS page
+        JOIN users ON users.user_id = page.peer
+        ORDER BY users.user_id {order}
+    """, (user_id, bound, limit + 1, user_id, bound, limit + 1, limit + 1)).fetchall()
+    return storage.cut_page(rows, limit, before)
+
+
+async def get_connections_page(user_id, after=None, before=None, limit=CONNECTIONS_PAGE):
+    """Страница принятых связей по ключу user_id собеседника.
+
+    Возвращает (связи, есть_предыдущая, есть_следующая).
+    """
+    rows, has_more = await backend.connections_page(user_id, after, before, limit)
+    return _page(rows, has_more, after, before)
+
+
+INBOX_PAGE = 10
+
+
+def _pending_page(conn, user_id, after, before, limit):
+    # one range read on (to_user, status, from_user), the same keyset as the connections list;
+    # the index holds the rowid, so connections.id comes without a table lookup
+    op, order, bound = storage.keyset(after, before)
+    rows = conn.execute(f"""
+        SELECT users.user_id, users.name, users.profession, users.username, page.id
+        FROM (
+            SELECT from_user, id FROM connections INDEXED BY idx_connections_to_status
+            WHERE to_user = ? AND status = 'pending' AND from_user {op} ?
+            ORDER BY from_user {order} LIMIT ?
+        ) AS page
+        JOIN users ON users.user_id = page.from_user
+        ORDER BY users.user_id {order}
+    """, (user_id, bound, limit + 1)).fetchall()
+    return storage.cut_page(rows, limit, before)
+
+
+def _answer_requests(conn, to_user, first, last, accept, newest):
+    where = "to_user = ? AND status = 'pending' AND from_user BETWEEN ? AND ?"
+    params = [to_user, first, last]
+    if newest is not None:
+        where += " AND id <= ?"
+        params.append(newest)
+    if accept:
+        sql = f"UPDATE connections SET status = 'accepted' WHERE {where} RETURNING from_user"
+    else:
+        sql = f"DELETE FROM connections WHERE {where} RETURNING from_user"
+    return [row[0] for row in conn.execute(sql, params)]
+
+
+async def get_pending_requests_page(user_id, after=None, before=None, limit=INBOX_PAGE):
+    """Страница входящих запросов на связь по ключу user_id отправителя.
+
+    Возвращает (запросы, есть_предыдущая, есть_следующая); request_id запроса — его
+    connections.id. Входящие тают от ответов, поэтому предыдущая страница после after
+    проверяется отдельным чтением, а не предполагается.
+    """
+    rows, has_more = await backend.pending_page(user_id, after, before, limit)
+    page, has_prev, has_next = _page(rows, has_more, after, before, PAGE_FIELDS + ("request_id",))
+    if after is not None and page:
+        earlier, _ = await backend.pending_page(user_id, None, page[0]['user_id'], 1)
+        has_prev = bool(earlier)
+    return page, has_prev, has_next
+
+
+async def pending_requests_count(user_id):
+    return await backend.pending_count(user_id)
+
+
+async def answer_requests(to_user, first, last, accept, newest=None):
+    """Принимает или отклоняет одной транзакцией входящие запросы от пользователей first..last.
+
+    newest — наибольший request_id показанной страницы: запросы, пришедшие после того, как
+    страницу нарисовали, не затрагиваются. Возвращает user_id отправителей, чьи запросы
+    ещё ждали ответа; повторное нажатие ничего не меняет и возвращает пустой список.
+    """
+    answered = await backend.answer_requests(to_user, first, last, accept, newest)
+    if accept and answered:
+        # both sides get new friends-of-friends
+        await mark_recommendations_stale((to_user, *answered))
+    return answered
+
+
+def _set_premium(conn, user_id, end_date):
+    if end_date:
+        conn.execute("UPDATE users SET is_premium=1, subscription_end=? WHERE user_id=?",
+                     (end_date.isoformat(), user_id))
+    else:
+        conn.execute("UPDATE users SET is_premium=0, subscription_end=NULL WHERE user_id=?", (user_id,))
+
+
+def _load_entitlements(conn):
+    return conn.execute("SELECT user_id, subscription_end FROM users "
+                        "WHERE is_premium=1 AND subscription_end IS NOT NULL").fetchall()
+
+
+def load_entitlements():
+    """Синхронная загрузка индекса подписок из SQLite при старте, до запуска цикла событий."""
+    entitlements.load(run_sync(_load_entitlements))
+
+
+async def reload_entitlements():
+    entitlements.load(await backend.load_entitlements())
+
+
+def get_user_subscription(user_id):
+    """Проверка премиума из индекса в памяти, без обращения к базе."""
+    return entitlements.is_premium(user_id)
+
+
+SUBSCRIPTION_DAYS = 30
+
+
+def _apply_payment(conn, user_id, charge_id, provider_charge_id, amount, currency, payload, days, now):
+    # the ledger insert comes first: it takes the write lock, so concurrent payments of one user queue up
+    inserted = conn.execute(
+        "INSERT INTO payments (charge_id, provider_charge_id, user_id, amount, currency, payload, created_at) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT(charge_id) DO NOTHING",
+        (charge_id, provider_charge_id, user_id, amount, currency, payload, now.isoformat()),
+    ).rowcount
+    if not inserted:
+        row = conn.execute("SELECT subscription_end FROM payments WHERE charge_id=?", (charge_id,)).fetchone()
+        return False, datetime.datetime.fromisoformat(row[0]) if row[0] else None
+    row = conn.execute("SELECT is_premium, subscription_end FROM users WHERE user_id=?", (user_id,)).fetchone()
+    current = datetime.datetime.fromisoformat(row[1]) if row and row[0] and row[1] else now
+    end = max(now, current) + datetime.timedelta(days=days)
+    # a user can pay before filling in a profile: the row is created without search_rank,
+    # so the feed skips it until the first profile edit ranks it
+    conn.execute(
+        "INSERT INTO users (user_id, is_premium, subscription_end) VALUES (?, 1, ?) "
+        "ON CONFLICT(user_id) DO UPDATE SET is_premium=1, subscription_end=excluded.subscription_end",
+        (user_id, end.isoformat()),
+    )
+    conn.execute("UPDATE payments SET subscription_end=? WHERE charge_id=?", (end.isoformat(), charge_id))
+    return True, end
+
+
+async def apply_payment(user_id, charge_id, provider_charge_id, amount, currency, payload,
+                        days=SUBSCRIPTION_DAYS, now=None):
+    """Проводит платёж один раз и продлевает подписку от текущего окончания, а не от сегодня.
+
+    Возвращает (проведён_сейчас, окончание_подписки). Повторная доставка того же платежа
+    (тот же telegram_payment_charge_id) ничего не меняет и возвращает (False, окончание из журнала).
+    """
+    now = now or datetime.datetime.now()
+    try:
+        applied, end = await backend.apply_payment(user_id, charge_id, provider_charge_id, amount, currency,
+                                                   payload, days, now)
+    finally:
+        user_cache.invalidate(user_id)
+    if applied:
+        # concurrent payments can return out of order; the latest end wins
+        current = entitlements.expires_at(user_id)
+        if current is None or end > current:
+            entitlements.set(user_id, end)
+    return applied, end
+
+
+async def get_user_works(user_id):
+    works = await backend.get_user_works(user_id)
+    return [{"title": w[0], "description": w[1]} for w in works]
+
+
+EXPIRY_CHUNK = 1000
+
+
+def _expire_chunk(conn, now, limit):
+    return [row[0] for row in conn.execute("""
+        UPDATE users SET is_premium=0, subscription_end=NULL
+        WHERE user_id IN (
+            SELECT user_id FROM users INDEXED BY idx_users_subscription_end
+            WHERE subscription_end < ? LIMIT ?
+        )
+        RETURNING user_id
+    """, (now.isoformat(), limit))]
+
+
+async def expire_subscriptions(now=None, chunk=EXPIRY_CHUNK):
+    """Снимает премиум со всех истёкших подписок и возвращает их user_id.
+
+    Работает порциями по chunk строк, каждая в своей короткой транзакции,
+    чтобы не держать блокировку записи и не мешать обработчикам.
+    """
+    now = now or datetime.datetime.now()
+    expired = []
+    while True:
+        ids = await backend.expire_chunk(now, chunk)
+        for user_id in ids:
+            user_cache.invalidate(user_id)
+            entitlements.set(user_id, None)
+        expired.extend(ids)
+        if len(ids) < chunk:
+            return expired
+
+
+def _recommended(conn, user_id, limit):
+    row = conn.execute("SELECT candidates FROM recommendations WHERE user_id=?", (user_id,)).fetchone()
+    if row is None:
+        return []
+    candidates = array.array("q")
+    candidates.frombytes(row[0])
+    ids = json.dumps(candidates.tolist())
+    # the list is built offline: drop whoever was shown or connected since then
+    skip = {r[0] for r in conn.execute("""
+        SELECT seen_id FROM search_seen WHERE user_id = ? AND seen_id IN (SELECT value FROM json_each(?))
+        UNION ALL
+        SELECT to_user FROM connections WHERE from_user = ? AND to_user IN (SELECT value FROM json_each(?))
+        UNION ALL
+        SELECT from_user FROM connections WHERE to_user = ? AND from_user IN (SELECT value FROM json_each(?))
+    """, (user_id, ids, user_id, ids, user_id, ids))}
+    return [candidate for candidate in candidates if candidate not in skip][:limit]
+
+
+def _fill_feed(conn, user_id, limit):
+    query = """
+        SELECT u.user_id
+        FROM users u INDEXED BY idx_users_search_rank
+        WHERE {}
+        AND u.user_id != ?
+        AND NOT EXISTS (SELECT 1 FROM connections c WHERE c.from_user = ? AND c.to_user = u.user_id)
+        AND NOT EXISTS (SELECT 1 FROM connections c WHERE c.to_user = ? AND c.from_user = u.user_id)
+        AND NOT EXISTS (SELECT 1 FROM search_seen s WHERE s.user_id = ? AND s.seen_id = u.user_id)
+        ORDER BY u.search_rank
+        LIMIT ?
+    """
+    # precomputed recommendations go first, the random walk fills up the rest
+    ids = _recommended(conn, user_id, limit)
+    # handed-out candidates count as seen, so the next batch never repeats them
+    conn.executemany("INSERT OR IGNORE INTO search_seen (user_id, seen_id) VALUES (?, ?)",
+                     [(user_id, seen_id) for seen_id in ids])
+    if len(ids) >= limit:
+        return ids
+    pivot = random.random()
+    walked = []
+    # walk the shuffled order from a random point, wrapping around once
+    for rank_clause in ("u.search_rank >= ?", "u.search_rank < ?"):
+        params = (pivot, user_id, user_id, user_id, user_id, limit - len(ids) - len(walked))
+        walked.extend(row[0] for row in conn.execute(query.format(rank_clause), params))
+        if len(ids) + len(walked) >= limit:
+            break
+    conn.executemany("INSERT OR IGNORE INTO search_seen (user_id, seen_id) VALUES (?, ?)",
+                     [(user_id, seen_id) for seen_id in walked])
+    return ids + walked
+
+
+async def fill_feed(user_id, limit):
+    return await run(_fill_feed, user_id, limit)
+
+
+async def reset_search_seen(user_id):
+    await execute("DELETE FROM search_seen WHERE user_id=?", (user_id,))
+
+
+async def mark_recommendations_stale(user_ids):
+    now = time.time()
+    await run(lambda conn: conn.executemany(
+        "INSERT INTO recommendations_stale (user_id, marked_at) VALUES (?, ?) "
+        "ON CONFLICT(user_id) DO UPDATE SET marked_at=excluded.marked_at",
+        [(user_id, now) for user_id in user_ids],
+    ))
+
+
+async def stale_recommendations_count():
+    row = await fetchone("SELECT count(*) FROM recommendations_stale")
+    return row[0]
+
+
+KEYWORD_RESULTS = 50
+RERANK_WINDOW = 200
+RANK_BUDGET = 5000
+PREMIUM_BOOST = 1.5
+
+
+def _keyword_search(conn, user_id, match, limit):
+    total = conn.execute("SELECT count(*) FROM users_fts WHERE users_fts MATCH ?", (match,)).fetchone()[0]
+    if not total:
+        return []
+    # bm25 costs microseconds per matching row; for very broad queries only RANK_BUDGET
+    # consecutive matches from a random offset get scored. The slice is cut from the match
+    # list itself (FTS5 yields it in rowid order without ranking), not from the id range:
+    # Telegram ids are clustered, so an id slice can easily hold no matches at all
+    offset = random.randrange(total - RANK_BUDGET + 1) if total > RANK_BUDGET else 0
+    lo, hi = conn.execute("""
+        SELECT MIN(rowid), MAX(rowid) FROM (
+            SELECT rowid FROM users_fts WHERE users_fts MATCH ? ORDER BY rowid LIMIT ? OFFSET ?
+        )
+    """, (match, RANK_BUDGET, offset)).fetchone()
+    # FTS5 picks the best bm25 window on its own; the premium boost only re-orders that window
+    return [row[0] for row in conn.execute("""
+        WITH hits AS (
+            SELECT rowid, rank FROM users_fts
+            WHERE users_fts MATCH ? AND rowid BETWEEN ? AND ?
+            ORDER BY rank LIMIT ?
+        )
+        SELECT u.user_id
+        FROM hits JOIN users u ON u.user_id = hits.rowid
+        WHERE u.user_id != ?
+        AND NOT EXISTS (SELECT 1 FROM connections c WHERE c.from_user = ? AND c.to_user = u.user_id)
+        AND NOT EXISTS (SELECT 1 FROM connections c WHERE c.to_user = ? AND c.from_user = u.user_id)
+        ORDER BY hits.rank * CASE WHEN u.is_premium THEN ? ELSE 1.0 END
+        LIMIT ?
+    """, (match, lo, hi, RERANK_WINDOW, user_id, user_id, user_id, PREMIUM_BOOST, limit))]
+
+
+async def keyword_search(user_id, text, limit=KEYWORD_RESULTS):
+    match = keywords.build_match_query(text)
+    if not match:
+        return []
+    return await run(_keyword_search, user_id, match, limit)
+
+
+FACET_RESULTS = 50
+
+
+def _facet_search(conn, user_id, tags, limit):
+    found = conn.execute("SELECT skill_id, users FROM skills WHERE name IN (SELECT value FROM json_each(?))",
+                         (json.dumps(tags, ensure_ascii=False),)).fetchall()
+    if len(found) < len(tags) or not all(users for _, users in found):
+        # a tag nobody has: the intersection is empty
+        return []
+    # drive from the shortest posting list and probe the others by primary key;
+    # CROSS JOIN keeps SQLite from reordering the loop
+    skill_ids = [skill_id for skill_id, _ in sorted(found, key=lambda row: row[1])]
+    probes = "".join(f" CROSS JOIN user_skills s{n} ON s{n}.skill_id = ? AND s{n}.user_id = s0.user_id"
+                     for n in range(1, len(skill_ids)))
+    # the connection checks name the last probed table, so SQLite runs them only for
+    # users that passed every skill probe
+    last = f"s{len(skill_ids) - 1}"
+    query = f"""
+        SELECT s0.user_id
+        FROM user_skills s0{probes}
+        WHERE s0.skill_id = ? AND {{}}
+        AND s0.user_id != ?
+        AND NOT EXISTS (SELECT 1 FROM connections c WHERE c.from_user = ? AND c.to_user = {last}.user_id)
+        AND NOT EXISTS (SELECT 1 FROM connections c WHERE c.to_user = ? AND c.from_user = {last}.user_id)
+        ORDER BY s0.user_id
+        LIMIT ?
+    """
+    # separate subqueries, so each bound is a single seek at one end of the posting list
+    lo, hi = conn.execute("SELECT (SELECT min(user_id) FROM user_skills WHERE skill_id=?), "
+                          "(SELECT max(user_id) FROM user_skills WHERE skill_id=?)",
+                          (skill_ids[0], skill_ids[0])).fetchone()
+    if lo is None:
+        return []
+    pivot = random.randint(lo, hi)
+    ids = []
+    # start at a random user id and wrap around, so popular filters do not always show the same people
+    for clause in ("s0.user_id >= ?", "s0.user_id < ?"):
+        params = (*skill_ids[1:], skill_ids[0], pivot, user_id, user_id, user_id, limit - len(ids))
+        ids.extend(row[0] for row in conn.execute(query.format(clause), params))
+        if len(ids) >= limit:
+            break
+    return ids
+
+
+async def facet_search(user_id, skills=(), profession=None, limit=FACET_RESULTS):
+    """Пользователи, у которых есть все навыки skills и (если задана) профессия profession.
+
+    Навыки и профессия нормализуются так же, как при сохранении профиля, поэтому "Python"
+    находит "python", а "go" не находит "django".
+    """
+    tags = [tag for text in skills for tag in keywords.skill_tags(text)]
+    if profession:
+        tag = keywords.profession_tag(profession)
+        if tag:
+            tags.append(tag)
+    if not tags:
+        return []
+    return await run(_facet_search, user_id, list(dict.fromkeys(tags)), limit)
+
+
+def _take_token(conn, user_id, capacity, now):
+    # token bucket in rate_limits: capacity is the daily limit, refilled evenly over a day
+    rate = capacity / rate_limit.DAY
+    row = conn.execute("""
+        INSERT INTO rate_limits (user_id, tokens, updated_at) VALUES (?, ? - 1, ?)
+        ON CONFLICT(user_id) DO UPDATE SET
+            tokens = MIN(?, tokens + (excluded.updated_at - updated_at) * ?) - 1,
+            updated_at = excluded.updated_at
+        WHERE MIN(?, tokens + (excluded.updated_at - updated_at) * ?) >= 1
+        RETURNING tokens
+    """, (user_id, capacity, now, capacity, rate, capacity, rate)).fetchone()
+    if row:
+        return True, 0.0
+    tokens, updated_at = conn.execute(
+        "SELECT tokens, updated_at FROM rate_limits WHERE user_id=?", (user_id,)
+    ).fetchone()
+    tokens = min(capacity, tokens + (now - updated_at) * rate)
+    return False, (1 - tokens) / rate
+
+
+def _request_connection(conn, from_user, to_user, capacity, now):
+    inserted = conn.execute(
+        "INSERT INTO connections (from_user, to_user, status) VALUES (?, ?, 'pending') "
+        "ON CONFLICT(from_user, to_user) DO NOTHING",
+        (from_user, to_user),
+    ).rowcount
+    if not inserted:
+        return rate_limit.DUPLICATE, 0.0
+    allowed, wait = _take_token(conn, from_user, capacity, now)
+    if not allowed:
+        conn.rollback()
+        return rate_limit.LIMITED, wait
+    return rate_limit.SENT, 0.0
+
+
+async def request_connection(from_user, to_user, capacity):
+    """Создаёт запрос на связь и списывает токен лимита в одной транзакции.
+
+    Повторный запрос той же паре возвращает DUPLICATE и лимит не тратит.
+    """
+    now = time.time()
+    if connection_limiter.is_blocked(from_user, now):
+        return rate_limit.LIMITED
+    result, wait = await backend.request_connection(from_user, to_user, capacity, now)
+    if result == rate_limit.LIMITED:
+        connection_limiter.block(from_user, wait, now)
+    return result
+
+
+async def reset_connection_limit(user_id):
+    # the next request starts from a full bucket of the user's current tier
+    await backend.reset_connection_limit(user_id)
+    connection_limiter.forget(user_id)
+
+
+async def accept_connection(from_user, to_user):
+    """True, если запрос ещё ждал ответа и теперь принят."""
+    return bool(await answer_requests(to_user, from_user, from_user, True))
+
+
+async def decline_connection(from_user, to_user):
+    return bool(await answer_requests(to_user, from_user, from_user, False))
+
+
+def _save_state(conn, upserts, deletes):
+    conn.executemany("INSERT INTO bot_state (kind, key, data) VALUES (?, ?, ?) "
+                     "ON CONFLICT(kind, key) DO UPDATE SET data=excluded.data", upserts)
+    conn.executemany("DELETE FROM bot_state WHERE kind=? AND key=?", deletes)
+
+
+class SQLiteStorage(storage.Storage):
+    """Хранилище в файле SQLite через пул соединений этого модуля."""
+
+    async def start(self):
+        check_schema()
+
+    async def close(self):
+        # the pool itself is closed by db.close()
+        pass
+
+    async def get_user(self, user_id):
+        return await fetchone(f"SELECT {', '.join(USER_COLUMNS)} FROM users WHERE user_id=?", (user_id,))
+
+    async def update_user_fields(self, user_id, fields):
+        await run(_update_user_fields, user_id, fields)
+
+    async def get_user_works(self, user_id):
+        return await fetchall("SELECT work_title, work_description FROM works WHERE user_id=? ORDER BY id",
+                              (user_id,))
+
+    async def request_connection(self, from_user, to_user, capacity, now):
+        return await run(_request_connection, from_user, to_user, capacity, now)
+
+    async def answer_requests(self, to_user, first, last, accept, newest=None):
+        return await run(_answer_requests, to_user, first, last, accept, newest)
+
+    async def connections_page(self, user_id, after, before, limit):
+        return await run(_connections_page, user_id, after, before, limit)
+
+    async def pending_page(self, user_id, after, before, limit):
+        return await run(_pending_page, user_id, after, before, limit)
+
+    async def pending_count(self, user_id):
+        row = await fetchone("SELECT count(*) FROM connections WHERE to_user=? AND status='pending'", (user_id,))
+        return row[0]
+
+    async def reset_connection_limit(self, user_id):
+        await execute("DELETE FROM rate_limits WHERE user_id=?", (user_id,))
+
+    async def set_premium(self, user_id, end_date):
+        await run(_set_premium, user_id, end_date)
+
+    async def load_entitlements(self):
+        return await run(_load_entitlements)
+
+    async def expire_chunk(self, now, limit):
+        return await run(_expire_chunk, now, limit)
+
+    async def apply_payment(self, user_id, charge_id, provider_charge_id, amount, currency, payload, days, now):
+        return await run(_apply_payment, user_id, charge_id, provider_charge_id, amount, currency, payload, days, now)
+
+    async def load_state(self, kind):
+        return await fetchall("SELECT key, data FROM bot_state WHERE kind=?", (kind,))
+
+    async def save_state(self, upserts, deletes):
+        await run(_save_state, upserts, deletes)
+
+
+backend = SQLiteStorage()
+
+
+async def use_storage(new_backend):
+    """Переключает пользователей, работы, связи и подписки на другое хранилище.
+
+    Лента поиска, полнотекстовый и фасетный поиск, рекомендации и outbox рассылок читают
+    SQLite этого модуля напрямую, так что new_backend должен писать в тот же файл.
+    """
+    global backend
+    await new_backend.start()
+    backend = new_backend
+    user_cache.clear()
+    await reload_entitlements()
+
+
+_pending_backend = None
+
+
+def configure_storage(new_backend):
+    """Запоминает хранилище, которое ensure_storage() подключит уже внутри цикла событий."""
+    global _pending_backend
+    _pending_backend = new_backend
+
+
+async def ensure_storage():
+    # the first caller in the event loop (persistence load or post_init) switches the backend
+    global _pending_backend
+    if _pending_backend is not None:
+        new_backend, _pending_backend = _pending_backend, None
+        await use_storage(new_backend)
+
+
+def _create_campaign(conn, name, text, audience_sql, params):
+    campaign_id = conn.execute(
+        "INSERT INTO campaigns (name, text, created_at) VALUES (?, ?, ?)",
+        (name, text, datetime.datetime.now().isoformat()),
+    ).lastrowid
+    conn.execute(
+        f"INSERT OR IGNORE INTO outbox (campaign_id, user_id) SELECT ?, user_id FROM ({audience_sql})",
+        (campaign_id, *params),
+    )
+    return campaign_id
+
+
+async def create_campaign(name, text, audience_sql="SELECT user_id FROM users", params=()):
+    """Создаёт рассылку и ставит в outbox по строке на каждого получателя из audience_sql."""
+    return await run(_create_campaign, name, text, audience_sql, tuple(params))
+
+
+async def create_campaign_for(name, text, user_ids):
+    return await run(_create_campaign, name, text, "SELECT value AS user_id FROM json_each(?)",
+                     (json.dumps(list(user_ids)),))
+
+
+def _claim_outbox(conn, limit, now):
+    return conn.execute("""
+        UPDATE outbox SET status = 'sending', claimed_at = ?
+        WHERE id IN (
+            SELECT id FROM outbox INDEXED BY idx_outbox_pending
+            WHERE status = 'pending' ORDER BY id LIMIT ?
+        )
+        RETURNING id, user_id, (SELECT text FROM campaigns WHERE campaigns.id = outbox.campaign_id)
+    """, (now, limit)).fetchall()
+
+
+async def claim_outbox(limit):
+    return await run(_claim_outbox, limit, time.time())
+
+
+def _finish_outbox(conn, sent_ids, failed_ids):
+    conn.executemany("UPDATE outbox SET status = 'sent' WHERE id = ?", [(i,) for i in sent_ids])
+    conn.executemany("UPDATE outbox SET status = 'failed' WHERE id = ?", [(i,) for i in failed_ids])
+
+
+async def finish_outbox(sent_ids, failed_ids):
+    await run(_finish_outbox, sent_ids, failed_ids)
+
+
+async def release_stale_outbox(older_than):
+    """Возвращает в очередь строки, захваченные воркером, который не дожил до их отправки."""
+    return await execute("UPDATE outbox SET status = 'pending' WHERE status = 'sending' AND claimed_at < ?",
+                         (time.time() - older_than,))
+
+
+async def purge_outbox(older_than_days):
+    cutoff = (datetime.datetime.now() - datetime.timedelta(days=older_than_days)).isoformat()
+    return await execute("""
+        DELETE FROM outbox WHERE status IN ('sent', 'failed')
+        AND campaign_id IN (SELECT id FROM campaigns WHERE created_at < ?)
+    """, (cutoff,))
+
+
+async def campaign_progress(campaign_id):
+    rows = await fetchall("SELECT status, count(*) FROM outbox WHERE campaign_id = ? GROUP BY status",
+                          (campaign_id,))
+    return dict(rows)
+
+
+async def pending_outbox_count():
+    row = await fetchone("SELECT count(*) FROM outbox INDEXED BY idx_outbox_pending WHERE status = 'pending'")
+    return row[0]
@@ -0,0 +1,93 @@
+import logging
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+import callbacks
+import sender
+
+logger = logging.getLogger(__name__)
+
+DIGEST_INTERVAL = 30
+# names listed in one digest; the rest is a count
+MAX_NAMES = 5
+
+
+class _Names:
+    __slots__ = ("names", "count")
+
+    def __init__(self):
+        self.names = []
+        self.count = 0
+
+    def add(self, name):
+        self.count += 1
+        if len(self.names) < MAX_NAMES:
+            self.names.append(name)
+
+    def __str__(self):
+        text = ", ".join(self.names)
+        if self.count > len(self.names):
+            text += f" и ещё {self.count - len(self.names)}"
+        return text
+
+
+class DigestBuffer:
+    """Копит уведомления о запросах на связь и ответах на них и отправляет сводкой.
+
+    Вместо сообщения на каждый запрос получатель раз в DIGEST_INTERVAL получает одно со
+    списком новых запросов и кнопкой входящих, а отправитель — одно со всеми ответами.
+    Сводки живут в памяти процесса: при падении неотправленные теряются, сами запросы
+    остаются во входящих.
+    """
+
+    def __init__(self):
+        self._requests = {}
+        self._answers = {}
+
+    def add_request(self, target_id, name):
+        self._requests.setdefault(target_id, _Names()).add(name)
+
+    def add_answer(self, requester_ids, name, accepted):
+        for requester_id in requester_ids:
+            answers = self._answers.setdefault(requester_id, (_Names(), _Names()))
+            answers[0 if accepted else 1].add(name)
+
+    def __len__(self):
+        return len(self._requests) + len(self._answers)
+
+    def flush(self):
+        """Ставит накопленные сводки в очередь sender и возвращает их число."""
+        requests, self._requests = self._requests, {}
+        answers, self._answers = self._answers, {}
+        markup = InlineKeyboardMarkup([[InlineKeyboardButton("📥 Открыть входящие",
+                                                             callback_data=callbacks.INBOX.encode())]])
+        for target_id, names in requests.items():
+            sender.send(
+                target_id,
+                priority=sender.NOTIFICATION,
+                text=f"📩 Новые запросы на связь ({names.count}): {names}",
+                reply_markup=markup,
+            )
+        for requester_id, (accepted, declined) in answers.items():
+            lines = []
+            if accepted.count:
+                lines.append(f"🎉 Приняли ваш запрос на связь: {accepted}")
+            if declined.count:
+                lines.append(f"😞 Отклонили ваш запрос на связь: {declined}")
+            sender.send(requester_id, priority=sender.NOTIFICATION, text="\n".join(lines))
+        return len(requests) + len(answers)
+
+
+buffer = DigestBuffer()
+
+
+def add_request(target_id, name):
+    buffer.add_request(target_id, name)
+
+
+def add_answer(requester_ids, name, accepted):
+    buffer.add_answer(requester_ids, name, accepted)
+
+
+def flush():
+    return buffer.flush()
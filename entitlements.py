@@ -0,0 +1,49 @@
+import datetime
+import heapq
+import time
+
+
+class EntitlementIndex:
+    """user_id -> время окончания премиума, с кучей для ленивого снятия истёкших подписок."""
+
+    def __init__(self):
+        self._expiry = {}
+        self._heap = []
+
+    def load(self, rows):
+        self._expiry = {}
+        for user_id, subscription_end in rows:
+            if subscription_end:
+                self._expiry[user_id] = datetime.datetime.fromisoformat(subscription_end).timestamp()
+        self._heap = [(expires, user_id) for user_id, expires in self._expiry.items()]
+        heapq.heapify(self._heap)
+
+    def set(self, user_id, subscription_end):
+        if subscription_end is None:
+            self._expiry.pop(user_id, None)
+            return
+        expires = subscription_end.timestamp()
+        self._expiry[user_id] = expires
+        # the old heap entry stays behind and is skipped once its timestamp no longer matches
+        heapq.heappush(self._heap, (expires, user_id))
+
+    def expires_at(self, user_id):
+        expires = self._expiry.get(user_id)
+        return datetime.datetime.fromtimestamp(expires) if expires is not None else None
+
+    def is_premium(self, user_id, now=None):
+        expires = self._expiry.get(user_id)
+        return expires is not None and expires > (now or time.time())
+
+    def pop_expired(self, now=None):
+        now = now or time.time()
+        expired = []
+        while self._heap and self._heap[0][0] <= now:
+            expires, user_id = heapq.heappop(self._heap)
+            if self._expiry.get(user_id) == expires:
+                del self._expiry[user_id]
+                expired.append(user_id)
+        return expired
+
+    def __len__(self):
+        return len(self._expiry)
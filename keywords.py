@@ -0,0 +1,50 @@
+import re
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+TAG_SPLIT_RE = re.compile(r"[,;/|\n]+")
+# professions share the tag dictionary with skills under this prefix
+PROFESSION_PREFIX = "@"
+MAX_TERMS = 8
+MIN_STEM = 3
+
+# longest endings first so "ами" is stripped before "и"
+RU_ENDINGS = sorted((
+    "иями", "ями", "ами", "ого", "его", "ому", "ему", "ыми", "ими", "ией", "иях", "ах", "ях",
+    "ой", "ый", "ий", "ая", "яя", "ое", "ее", "ые", "ие", "ов", "ев", "ей", "ом", "ем", "ам", "ям",
+    "ию", "ия", "ие", "а", "я", "ы", "и", "е", "у", "ю", "о", "ь",
+), key=len, reverse=True)
+EN_ENDINGS = ("ments", "ment", "ings", "ing", "ers", "er", "ed", "es", "s")
+
+
+def stem(word):
+    word = word.lower().replace("ё", "е")
+    endings = RU_ENDINGS if re.search("[а-я]", word) else EN_ENDINGS
+    for ending in endings:
+        if word.endswith(ending) and len(word) - len(ending) >= MIN_STEM:
+            return word[:-len(ending)]
+    return word
+
+
+def build_match_query(text):
+    """Строит FTS5 MATCH-выражение: каждое слово урезается до основы и ищется по префиксу."""
+    terms = []
+    for token in TOKEN_RE.findall(text)[:MAX_TERMS]:
+        term = stem(token)
+        if term and term not in terms:
+            terms.append(term)
+    return " ".join(f'"{term}"*' for term in terms)
+
+
+def skill_tags(text):
+    """Разбивает строку навыков на нормализованные теги: "Python, Machine learning" -> ["python", "machine learn"]."""
+    tags = []
+    for part in TAG_SPLIT_RE.split(text or ""):
+        tag = " ".join(stem(word) for word in TOKEN_RE.findall(part))
+        if tag and tag not in tags:
+            tags.append(tag)
+    return tags
+
+
+def profession_tag(text):
+    tag = " ".join(stem(word) for word in TOKEN_RE.findall(text or ""))
+    return PROFESSION_PREFIX + tag if tag else None
@@ -1,6 +1,9 @@
+import asyncio
 import logging
-import sqlite3
 import datetime
+import os
+import signal
+import sys
 from telegram import __version__ as TG_VER
 from telegram import (
     InlineKeyboardButton,
@@ -23,6 +26,20 @@ from telegram.ext import (
 )
 from telegram.constants import ParseMode
 
+import callbacks
+import db
+import digests
+import metrics
+import notifications
+import persistence
+import profile_cards
+import rate_limit
+import recommendations
+import search_feed
+import sender
+import storage
+import webhook
+
 if TG_VER.split(".")[0] < "20":
     raise RuntimeError(
         f"Этот пример не совместим с вашей текущей версией PTB {TG_VER}. Для просмотра версии 20.x посетите "
@@ -34,146 +51,80 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+BOT_TOKEN = "***"
 PAYMASTER_TOKEN = "***"
 CURRENCY = "RUB"
 PRICE = 79900  # 799.00 RUB
-
-def create_tables():
-    conn = sqlite3.connect("colleagues.db")
-    c = conn.cursor()
-    
-    c.execute("""CREATE TABLE IF NOT EXISTS users
-                 (user_id INTEGER PRIMARY KEY, 
-                  name TEXT, 
-                  profession TEXT, 
-                  skills TEXT, 
-                  bio TEXT,
-                  photo_id TEXT,
-                  username TEXT,
-                  is_premium INTEGER DEFAULT 0,
-                  subscription_end TEXT,
-                  social_link TEXT)""")
-    
-    c.execute("""CREATE TABLE IF NOT EXISTS works
-                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                  user_id INTEGER,
-                  work_title TEXT,
-                  work_description TEXT)""")
-    
-    c.execute("""CREATE TABLE IF NOT EXISTS connections
-                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                  from_user INTEGER,
-                  to_user INTEGER,
-                  status TEXT)""")
-
-    conn.commit()
-    conn.close()
-
-def get_user(user_id):
-    conn = sqlite3.connect("colleagues.db")
-    c = conn.cursor()
-    c.execute("SELECT * FROM users WHERE user_id=?", (user_id,))
-    row = c.fetchone()
-    conn.close()
-    if row:
-        return {
-            "user_id": row[0],
-            "name": row[1],
-            "profession": row[2],
-            "skills": row[3],
-            "bio": row[4],
-            "photo_id": row[5],
-            "username": row[6],
-            "is_premium": bool(row[7]),
-            "subscription_end": row[8],
-            "social_link": row[9]
-        }
-    return None
-
-def update_user(user_id, name, profession, skills, bio, photo_id=None, username=None, social_link=None):
-    conn = sqlite3.connect("colleagues.db")
-    c = conn.cursor()
-    c.execute("SELECT is_premium, subscription_end FROM users WHERE user_id=?", (user_id,))
-    existing = c.fetchone()
-    is_premium = existing[0] if existing else 0
-    sub_end = existing[1] if existing else None
-    
-    c.execute(
-        """INSERT OR REPLACE INTO users 
-                 (user_id, name, profession, skills, bio, photo_id, username, social_link, is_premium, subscription_end) 
-                 VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
-        (user_id, name, profession, skills, bio, photo_id, username, social_link, is_premium, sub_end),
-    )
-    conn.commit()
-    conn.close()
-
-def get_connections(user_id):
-    conn = sqlite3.connect("colleagues.db")
-    c = conn.cursor()
-    c.execute("""
-        SELECT users.user_id, users.name, users.profession, users.username 
-        FROM connections
-        JOIN users ON users.user_id = CASE 
-            WHEN connections.from_user = ? THEN connections.to_user 
-            ELSE connections.from_user 
-        END
-        WHERE (connections.from_user = ? OR connections.to_user = ?)
-        AND connections.status = 'accepted'
-    """, (user_id, user_id, user_id))
-    connections = [{
-        'user_id': row[0],
-        'name': row[1],
-        'profession': row[2],
-        'username': row[3]
-    } for row in c.fetchall()]
-    conn.close()
-    return connections
-
-def get_user_subscription(user_id):
-    conn = sqlite3.connect("colleagues.db")
-    c = conn.cursor()
-    c.execute("SELECT is_premium, subscription_end FROM users WHERE user_id=?", (user_id,))
-    row = c.fetchone()
-    conn.close()
-    
-    if row and row[0]:
-        end_date = datetime.datetime.fromisoformat(row[1])
-        if datetime.datetime.now() < end_date:
-            return True
-        update_premium_status(user_id, False)
-    return False
-
-def update_premium_status(user_id, is_premium):
-    conn = sqlite3.connect("colleagues.db")
-    c = conn.cursor()
-    if is_premium:
-        end_date = datetime.datetime.now() + datetime.timedelta(days=30)
-        c.execute("UPDATE users SET is_premium=1, subscription_end=? WHERE user_id=?", 
-                 (end_date.isoformat(), user_id))
-    else:
-        c.execute("UPDATE users SET is_premium=0, subscription_end=NULL WHERE user_id=?", (user_id,))
-    conn.commit()
-    conn.close()
-
-def get_user_works(user_id):
-    conn = sqlite3.connect("colleagues.db")
-    c = conn.cursor()
-    c.execute("SELECT work_title, work_description FROM works WHERE user_id=?", (user_id,))
-    works = c.fetchall()
-    conn.close()
-    return [{"title": w[0], "description": w[1]} for w in works]
-
-def check_subscriptions(context: ContextTypes.DEFAULT_TYPE):
+PAYLOAD = "premium_subscription"
+MAX_PREPAID_DAYS = 365
+
+# webhook mode is enabled by setting WEBHOOK_URL, otherwise the bot uses long polling
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL")
+WEBHOOK_HOST = os.environ.get("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.environ.get("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.environ.get("WEBHOOK_PATH", "/telegram")
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET")
+WEBHOOK_CERT = os.environ.get("WEBHOOK_CERT")
+WEBHOOK_KEY = os.environ.get("WEBHOOK_KEY")
+WEBHOOK_UPLOAD_CERT = os.environ.get("WEBHOOK_UPLOAD_CERT") == "1"
+WEBHOOK_QUEUE_SIZE = int(os.environ.get("WEBHOOK_QUEUE_SIZE", "1000"))
+MAX_CONCURRENT_UPDATES = int(os.environ.get("MAX_CONCURRENT_UPDATES", "64"))
+DATABASE_URL = os.environ.get("DATABASE_URL")
+METRICS_HOST = os.environ.get("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.environ["METRICS_PORT"]) if os.environ.get("METRICS_PORT") else None
+RECOMMENDATIONS_REFRESH_INTERVAL = int(os.environ.get("RECOMMENDATIONS_REFRESH_INTERVAL",
+                                                      str(recommendations.REFRESH_INTERVAL)))
+ADMIN_IDS = {int(x) for x in os.environ.get("ADMIN_IDS", "").split(",") if x.strip()}
+OUTBOX_RETENTION_DAYS = 7
+# SHARD_WORKERS > 1 starts a front process that fans updates out to that many worker processes;
+# SHARD_INDEX/SHARD_COUNT are set by the front for each worker
+SHARD_WORKERS = int(os.environ.get("SHARD_WORKERS", "0"))
+SHARD_INDEX = int(os.environ.get("SHARD_INDEX", "0"))
+SHARD_COUNT = int(os.environ.get("SHARD_COUNT", "1"))
+# profiles of other users may be edited in another worker; keep them cached only briefly
+SHARD_USER_CACHE_TTL = 30.0
+
+async def check_subscriptions(context: ContextTypes.DEFAULT_TYPE):
     logger.info("Проверка подписок")
-    conn = sqlite3.connect("colleagues.db")
-    c = conn.cursor()
-    c.execute("SELECT user_id FROM users WHERE is_premium=1")
-    premium_users = [row[0] for row in c.fetchall()]
-    
-    for user_id in premium_users:
-        if not get_user_subscription(user_id):
-            logger.info(f"Подписка истекла для пользователя {user_id}")
-    conn.close()
+    expired = await db.expire_subscriptions()
+    await notifications.notify_expired(expired)
+    logger.info(f"Подписка истекла у {len(expired)} пользователей")
+
+async def apply_expirations(context: ContextTypes.DEFAULT_TYPE):
+    # the index already answers "not premium" at expiry; this only syncs the table
+    if db.entitlements.pop_expired():
+        expired = await db.expire_subscriptions()
+        await notifications.notify_expired(expired)
+        logger.info(f"Подписка истекла у {len(expired)} пользователей")
+
+async def send_digests(context: ContextTypes.DEFAULT_TYPE):
+    digests.flush()
+
+async def send_renewal_reminders(context: ContextTypes.DEFAULT_TYPE):
+    campaign_id = await notifications.queue_renewal_reminders(datetime.datetime.now())
+    logger.info(f"Напоминания о продлении: {await notifications.campaign_stats(campaign_id)}")
+
+async def purge_outbox(context: ContextTypes.DEFAULT_TYPE):
+    removed = await db.purge_outbox(OUTBOX_RETENTION_DAYS)
+    logger.info(f"Удалено старых уведомлений: {removed}")
+
+async def refresh_recommendations(context: ContextTypes.DEFAULT_TYPE):
+    await recommendations.run_job()
+
+async def rebuild_recommendations(context: ContextTypes.DEFAULT_TYPE):
+    await recommendations.run_job(full=True)
+
+async def log_cache_stats(context: ContextTypes.DEFAULT_TYPE):
+    logger.info(f"Кэш профилей: {db.user_cache.stats()}")
+    logger.info(f"Кэш карточек: {profile_cards.card_cache.stats()}")
+    logger.info(f"Ленты поиска: {search_feed.stats()}")
+    logger.info(f"Исходящая очередь: {sender.scheduler.stats()}")
+    logger.info(f"Уведомлений в outbox: {await db.pending_outbox_count()}")
+
+async def log_metrics(context: ContextTypes.DEFAULT_TYPE):
+    logger.info(f"Обработчики: {metrics.registry.summary('handler')}")
+    logger.info(f"Запросы к базе: {metrics.registry.summary('db')}")
+    logger.info(f"Задержка цикла событий: {metrics.registry.summary('event_loop_lag')}")
 
 EDITING, EDIT_PHOTO, EDIT_NAME, EDIT_PROFESSION, EDIT_SKILLS, EDIT_BIO, EDIT_SOCIAL = range(7)
 
@@ -182,7 +133,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     keyboard = [
         [KeyboardButton("👤 Мой профиль"), KeyboardButton("🔍 Поиск связей")],
         [KeyboardButton("🤝 Мои связи"), KeyboardButton("💎 Премиум")],
-        [KeyboardButton("🆘 Помощь")]
+        [KeyboardButton("📥 Входящие"), KeyboardButton("🆘 Помощь")]
     ]
     reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True, input_field_placeholder="Выберите действие")
     
@@ -200,7 +151,10 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "📚 *Справочник команд:*\n\n"
         "👤 _Мой профиль_ - Просмотр и редактирование профиля\n"
         "🔍 _Поиск связей_ - Найти профессионалов\n"
+        "🔎 /find _слова_ - Поиск по имени, профессии и навыкам\n"
+        "🛠 /skills _навыки_ @_профессия_ - Все, у кого есть эти навыки\n"
         "🤝 _Мои связи_ - Ваша сеть контактов\n"
+        "📥 _Входящие_ - Запросы на связь, можно принять или отклонить все сразу\n"
         "💎 _Премиум_ - Расширенные возможности\n"
         "🆘 _Помощь_ - Это справочное меню\n\n"
         "💡 *Советы:*\n"
@@ -211,16 +165,7 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
     await update.message.reply_text(help_text, parse_mode=ParseMode.MARKDOWN)
 
-async def profile(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    query = update.callback_query
-    if query:
-        await query.answer()
-        message = query.message
-    else:
-        message = update.message
-
-    user = get_user(update.effective_user.id)
-    
+def edit_menu_markup(draft=None):
     keyboard = [
         [
             InlineKeyboardButton("📷 Фото", callback_data="edit_photo"),
@@ -233,16 +178,32 @@ async def profile(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         [
             InlineKeyboardButton("📖 Описание", callback_data="edit_bio"),
             InlineKeyboardButton("🌐 Соцсеть", callback_data="edit_social")
-        ],
-        [InlineKeyboardButton("❌ Отмена", callback_data="cancel_edit")]
+        ]
     ]
+    if draft is None:
+        keyboard.append([InlineKeyboardButton("🗂 Изменить несколько полей", callback_data="edit_batch")])
+    else:
+        keyboard.append([InlineKeyboardButton(f"💾 Сохранить ({len(draft)})", callback_data="save_batch")])
+    keyboard.append([InlineKeyboardButton("❌ Отмена", callback_data="cancel_edit")])
+    return InlineKeyboardMarkup(keyboard)
+
+async def profile(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    query = update.callback_query
+    if query:
+        await query.answer()
+        message = query.message
+    else:
+        message = update.message
+
+    context.user_data.pop('profile_draft', None)
+    user = await db.get_user(update.effective_user.id)
     
     text = "✏️ *Редактирование профиля:*\nВыберите что хотите изменить:"
     
     if user:
         await message.reply_text(
             text,
-            reply_markup=InlineKeyboardMarkup(keyboard),
+            reply_markup=edit_menu_markup(),
             parse_mode=ParseMode.MARKDOWN
         )
         return EDITING
@@ -273,171 +234,119 @@ async def edit_field(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     elif choice == "edit_social":
         await query.edit_message_text("🌐 Введите новую ссылку на соцсеть:")
         return EDIT_SOCIAL
+    elif choice == "edit_batch":
+        context.user_data['profile_draft'] = {}
+        await query.edit_message_text(
+            "🗂 Выберите поля по очереди, затем нажмите «Сохранить»:",
+            reply_markup=edit_menu_markup(context.user_data['profile_draft'])
+        )
+        return EDITING
+    elif choice == "save_batch":
+        draft = context.user_data.pop('profile_draft', None) or {}
+        if draft:
+            draft['username'] = query.from_user.username
+            await db.update_user_fields(query.from_user.id, **draft)
+            await query.edit_message_text("✅ Профиль обновлён!")
+        else:
+            await query.edit_message_text("🤷 Нет изменений для сохранения")
+        return ConversationHandler.END
     elif choice == "cancel_edit":
+        context.user_data.pop('profile_draft', None)
         await query.edit_message_text("❌ Редактирование отменено")
         return ConversationHandler.END
     else:
         await query.edit_message_text("⚠️ Неверный выбор. Попробуйте еще раз.")
         return EDITING
 
-async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    user = get_user(update.effective_user.id)
-    photo_file = update.message.photo[-1].file_id
-    update_user(
-        user_id=update.effective_user.id,
-        name=user['name'],
-        profession=user['profession'],
-        skills=user['skills'],
-        bio=user['bio'],
-        photo_id=photo_file,
-        social_link=user['social_link']
+async def save_field(update: Update, context: ContextTypes.DEFAULT_TYPE, field, value, done_text) -> int:
+    draft = context.user_data.get('profile_draft')
+    if draft is not None:
+        draft[field] = value
+        await update.message.reply_text(
+            "📝 Изменение добавлено. Выберите следующее поле или сохраните:",
+            reply_markup=edit_menu_markup(draft)
+        )
+        return EDITING
+    
+    await db.update_user_fields(
+        update.effective_user.id,
+        username=update.effective_user.username,
+        **{field: value}
     )
-    await update.message.reply_text("✅ Фото профиля обновлено!")
+    await update.message.reply_text(done_text)
     return ConversationHandler.END
 
-async def skip_photo(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    await update.message.reply_text("✅ Фото осталось без изменений")
+async def keep_field(update: Update, context: ContextTypes.DEFAULT_TYPE, done_text) -> int:
+    draft = context.user_data.get('profile_draft')
+    if draft is not None:
+        await update.message.reply_text(
+            "Выберите следующее поле или сохраните:",
+            reply_markup=edit_menu_markup(draft)
+        )
+        return EDITING
+    await update.message.reply_text(done_text)
     return ConversationHandler.END
 
+async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    photo_file = update.message.photo[-1].file_id
+    return await save_field(update, context, 'photo_id', photo_file, "✅ Фото профиля обновлено!")
+
+async def skip_photo(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    return await keep_field(update, context, "✅ Фото осталось без изменений")
+
 async def handle_name(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    user = get_user(update.effective_user.id)
-    new_name = update.message.text
-    update_user(
-        user_id=update.effective_user.id,
-        name=new_name,
-        profession=user['profession'],
-        skills=user['skills'],
-        bio=user['bio'],
-        photo_id=user['photo_id'],
-        social_link=user['social_link']
-    )
-    await update.message.reply_text("✅ Имя обновлено!")
-    return ConversationHandler.END
+    return await save_field(update, context, 'name', update.message.text, "✅ Имя обновлено!")
 
 async def handle_profession(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    user = get_user(update.effective_user.id)
-    new_profession = update.message.text
-    update_user(
-        user_id=update.effective_user.id,
-        name=user['name'],
-        profession=new_profession,
-        skills=user['skills'],
-        bio=user['bio'],
-        photo_id=user['photo_id'],
-        social_link=user['social_link']
-    )
-    await update.message.reply_text("✅ Профессия обновлена!")
-    return ConversationHandler.END
+    return await save_field(update, context, 'profession', update.message.text, "✅ Профессия обновлена!")
 
 async def handle_skills(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    user = get_user(update.effective_user.id)
-    new_skills = update.message.text
-    update_user(
-        user_id=update.effective_user.id,
-        name=user['name'],
-        profession=user['profession'],
-        skills=new_skills,
-        bio=user['bio'],
-        photo_id=user['photo_id'],
-        social_link=user['social_link']
-    )
-    await update.message.reply_text("✅ Навыки обновлены!")
-    return ConversationHandler.END
+    return await save_field(update, context, 'skills', update.message.text, "✅ Навыки обновлены!")
 
 async def handle_bio(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    user = get_user(update.effective_user.id)
-    new_bio = update.message.text
-    update_user(
-        user_id=update.effective_user.id,
-        name=user['name'],
-        profession=user['profession'],
-        skills=user['skills'],
-        bio=new_bio,
-        photo_id=user['photo_id'],
-        social_link=user['social_link']
-    )
-    await update.message.reply_text("✅ Описание обновлено!")
-    return ConversationHandler.END
+    return await save_field(update, context, 'bio', update.message.text, "✅ Описание обновлено!")
 
 async def handle_social(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    user = get_user(update.effective_user.id)
     social_link = update.message.text
-    if social_link.startswith(("http://", "https://")):
-        update_user(
-            user_id=update.effective_user.id,
-            name=user['name'],
-            profession=user['profession'],
-            skills=user['skills'],
-            bio=user['bio'],
-            photo_id=user['photo_id'],
-            social_link=social_link
-        )
-        await update.message.reply_text("✅ Ссылка на соцсеть обновлена!")
-    else:
+    if not social_link.startswith(("http://", "https://")):
         await update.message.reply_text("❌ Некорректная ссылка! Попробуйте еще раз.")
         return EDIT_SOCIAL
-    return ConversationHandler.END
+    return await save_field(update, context, 'social_link', social_link, "✅ Ссылка на соцсеть обновлена!")
 
 async def skip_social(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    await update.message.reply_text("✅ Ссылка на соцсеть осталась без изменений")
-    return ConversationHandler.END
+    return await keep_field(update, context, "✅ Ссылка на соцсеть осталась без изменений")
 
 async def myprofile(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    user = get_user(user_id)
+    user = await db.get_user(user_id)
     
     if not user:
         await update.message.reply_text("❌ Профиль не найден. Используйте команду создания профиля")
         return
     
-    premium_badge = " 💎" if user['is_premium'] else ""
-    profile_text = (
-        f"👤 *Имя:* {user['name']}{premium_badge}\n\n"
-        f"💼 *Профессия:* {user['profession']}\n\n"
-        f"🛠️ *Навыки:* {user['skills']}\n\n"
-        f"📖 *О себе:* {user['bio']}"
-    )
-    
-    if user['social_link']:
-        profile_text += f"\n\n🌐 *Соцсеть:* [Ссылка]({user['social_link']})"
-    
-    if user['is_premium']:
-        works = get_user_works(user_id)
-        if works:
-            profile_text += "\n\n🎨 *Примеры работ:*"
-            for i, work in enumerate(works, 1):
-                profile_text += f"\n{i}. *{work['title']}*: {work['description']}"
-
-    keyboard = [[InlineKeyboardButton("🔄 Обновить профиль", callback_data="update_profile")]]
+    card = await profile_cards.get_card(user, profile_cards.OWN)
     
     try:
-        if user['photo_id']:
+        if card.photo_id:
             await update.message.reply_photo(
-                photo=user['photo_id'],
-                caption=profile_text,
+                photo=card.photo_id,
+                caption=card.caption,
                 parse_mode=ParseMode.MARKDOWN,
-                reply_markup=InlineKeyboardMarkup(keyboard)
+                reply_markup=card.markup
             )
         else:
             await update.message.reply_text(
-                profile_text,
+                card.caption,
                 parse_mode=ParseMode.MARKDOWN,
-                reply_markup=InlineKeyboardMarkup(keyboard)
+                reply_markup=card.markup
             )
     except Exception as e:
         logger.error(f"Ошибка отображения профиля: {e}")
         await update.message.reply_text("⚠️ Ошибка отображения профиля")
 
-async def connections(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = update.effective_user.id
-    connections = get_connections(user_id)
-    
-    if not connections:
-        await update.message.reply_text("🤷 У вас пока нет связей. Используйте поиск!")
-        return
-    
+def connections_markup(page, has_prev, has_next):
     keyboard = []
-    for conn in connections:
+    for conn in page:
         contact_button = InlineKeyboardButton(
             "📨 Написать",
             url=f"https://t.me/{conn['username']}" if conn['username'] 
@@ -447,232 +356,268 @@ async def connections(update: Update, context: ContextTypes.DEFAULT_TYPE):
         buttons = [
             InlineKeyboardButton(
                 f"{conn['name']} - {conn['profession']}",
-                callback_data=f"view_{conn['user_id']}"
+                callback_data=callbacks.VIEW.encode(conn['user_id'])
             ),
             contact_button
         ]
         keyboard.append(buttons)
     
+    nav = []
+    if has_prev:
+        nav.append(InlineKeyboardButton("⬅️ Назад", callback_data=callbacks.CONNECTIONS_PREV.encode(page[0]['user_id'])))
+    if has_next:
+        nav.append(InlineKeyboardButton("Далее ➡️", callback_data=callbacks.CONNECTIONS_NEXT.encode(page[-1]['user_id'])))
+    if nav:
+        keyboard.append(nav)
+    return InlineKeyboardMarkup(keyboard)
+
+async def connections(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+    page, has_prev, has_next = await db.get_connections_page(user_id)
+    
+    if not page:
+        await update.message.reply_text("🤷 У вас пока нет связей. Используйте поиск!")
+        return
+    
     await update.message.reply_text(
         "🤝 *Ваши связи:*",
-        reply_markup=InlineKeyboardMarkup(keyboard),
+        reply_markup=connections_markup(page, has_prev, has_next),
         parse_mode=ParseMode.MARKDOWN
     )
 
+def inbox_markup(page, has_prev, has_next):
+    # answers redraw the page from the same position
+    start = page[0]['user_id'] - 1
+    keyboard = []
+    for request in page:
+        keyboard.append([
+            InlineKeyboardButton(
+                f"{request['name']} - {request['profession']}",
+                callback_data=callbacks.VIEW.encode(request['user_id'])
+            ),
+            InlineKeyboardButton("✅", callback_data=callbacks.INBOX_ACCEPT.encode(request['user_id'], start)),
+            InlineKeyboardButton("❌", callback_data=callbacks.INBOX_DECLINE.encode(request['user_id'], start))
+        ])
+    
+    if len(page) > 1:
+        bounds = page[0]['user_id'], page[-1]['user_id'], max(request['request_id'] for request in page)
+        keyboard.append([
+            InlineKeyboardButton("✅ Принять все", callback_data=callbacks.INBOX_ACCEPT_ALL.encode(*bounds)),
+            InlineKeyboardButton("❌ Отклонить все", callback_data=callbacks.INBOX_DECLINE_ALL.encode(*bounds))
+        ])
+    
+    nav = []
+    if has_prev:
+        nav.append(InlineKeyboardButton("⬅️ Назад", callback_data=callbacks.INBOX_PREV.encode(page[0]['user_id'])))
+    if has_next:
+        nav.append(InlineKeyboardButton("Далее ➡️", callback_data=callbacks.INBOX_NEXT.encode(page[-1]['user_id'])))
+    if nav:
+        keyboard.append(nav)
+    return InlineKeyboardMarkup(keyboard)
+
+async def inbox_page(user_id, after=None, before=None):
+    page, has_prev, has_next = await db.get_pending_requests_page(user_id, after=after or None, before=before)
+    if not page and (after or before):
+        # everything on this page was answered meanwhile
+        page, has_prev, has_next = await db.get_pending_requests_page(user_id)
+    if not page:
+        return "📭 Новых запросов на связь нет.", None
+    count = await db.pending_requests_count(user_id)
+    return f"📥 *Входящие запросы на связь: {count}*", inbox_markup(page, has_prev, has_next)
+
+async def inbox(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    text, markup = await inbox_page(update.effective_user.id)
+    await update.effective_message.reply_text(text, reply_markup=markup, parse_mode=ParseMode.MARKDOWN)
+
+async def edit_inbox(update: Update, after=None, before=None):
+    text, markup = await inbox_page(update.effective_user.id, after, before)
+    await update.callback_query.edit_message_text(text, reply_markup=markup, parse_mode=ParseMode.MARKDOWN)
+
+async def inbox_next(update: Update, context: ContextTypes.DEFAULT_TYPE, cursor):
+    await edit_inbox(update, after=cursor)
+
+async def inbox_prev(update: Update, context: ContextTypes.DEFAULT_TYPE, cursor):
+    await edit_inbox(update, before=cursor)
+
+async def answer_inbox(update: Update, first, last, accept, start, newest=None):
+    user = update.effective_user
+    answered = await db.answer_requests(user.id, first, last, accept, newest)
+    digests.add_answer(answered, user.full_name, accept)
+    await edit_inbox(update, after=start)
+
+async def inbox_accept(update: Update, context: ContextTypes.DEFAULT_TYPE, from_id, start):
+    await answer_inbox(update, from_id, from_id, True, start)
+
+async def inbox_decline(update: Update, context: ContextTypes.DEFAULT_TYPE, from_id, start):
+    await answer_inbox(update, from_id, from_id, False, start)
+
+async def inbox_accept_all(update: Update, context: ContextTypes.DEFAULT_TYPE, first, last, newest):
+    await answer_inbox(update, first, last, True, first - 1, newest)
+
+async def inbox_decline_all(update: Update, context: ContextTypes.DEFAULT_TYPE, first, last, newest):
+    await answer_inbox(update, first, last, False, first - 1, newest)
+
 async def search(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    context.user_data['search_skipped'] = []
+    await search_feed.reset(update.effective_user.id)
     await show_next_profile(update, context)
 
-async def show_next_profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def find(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    text = " ".join(context.args)
+    if not text:
+        await update.message.reply_text("🔎 Укажите ключевые слова, например: /find python django")
+        return
+    
     user_id = update.effective_user.id
-    skipped = context.user_data.get('search_skipped', [])
+    results = await db.keyword_search(user_id, text)
+    if not results:
+        await update.message.reply_text("🤷 По вашему запросу никого не найдено.")
+        return
     
-    conn = sqlite3.connect("colleagues.db")
-    c = conn.cursor()
-    query = """
-        SELECT u.user_id, u.name, u.profession, u.skills, u.bio, u.photo_id, u.is_premium 
-        FROM users u
-        WHERE u.user_id != ?
-        AND NOT EXISTS (
-            SELECT 1 FROM connections c
-            WHERE (c.from_user = ? AND c.to_user = u.user_id)
-            OR (c.to_user = ? AND c.from_user = u.user_id)
-        )
-        AND u.user_id NOT IN ({})
-        ORDER BY RANDOM()
-        LIMIT 1
-    """.format(','.join(['?']*len(skipped))) if skipped else """
-        SELECT u.user_id, u.name, u.profession, u.skills, u.bio, u.photo_id, u.is_premium 
-        FROM users u
-        WHERE u.user_id != ?
-        AND NOT EXISTS (
-            SELECT 1 FROM connections c
-            WHERE (c.from_user = ? AND c.to_user = u.user_id)
-            OR (c.to_user = ? AND c.from_user = u.user_id)
+    await search_feed.start_keyword(user_id, results)
+    await show_next_profile(update, context)
+
+async def skills_filter(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    text = " ".join(context.args)
+    skills, _, profession = text.partition("@")
+    if not skills.strip() and not profession.strip():
+        await update.message.reply_text(
+            "🛠 Укажите навыки через запятую и, если нужно, профессию после @, например:\n"
+            "/skills python, sql @Аналитик"
         )
-        ORDER BY RANDOM()
-        LIMIT 1
-    """
+        return
     
-    params = (user_id, user_id, user_id) + tuple(skipped) if skipped else (user_id, user_id, user_id)
+    user_id = update.effective_user.id
+    results = await db.facet_search(user_id, [skills], profession.strip() or None)
+    if not results:
+        await update.message.reply_text("🤷 Никого с такими навыками не найдено.")
+        return
     
-    c.execute(query, params)
-    row = c.fetchone()
-    conn.close()
+    await search_feed.start_keyword(user_id, results)
+    await show_next_profile(update, context)
+
+async def show_next_profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
     
-    if not row:
-        await context.bot.send_message(
-            chat_id=user_id,
+    profile_user = None
+    while profile_user is None:
+        candidate_id = await search_feed.next_candidate(user_id)
+        if candidate_id is None:
+            break
+        profile_user = await db.get_user(candidate_id)
+    
+    if not profile_user:
+        sender.send(
+            user_id,
+            priority=sender.REPLY,
+            coalesce_key="search_profile",
             text="🌟 Больше нет профилей для показа. Попробуйте позже!"
         )
         return
     
-    profile_user = {
-        'user_id': row[0],
-        'name': row[1],
-        'profession': row[2],
-        'skills': row[3],
-        'bio': row[4],
-        'photo_id': row[5],
-        'is_premium': row[6]
-    }
-    
-    premium_badge = " 💎" if profile_user['is_premium'] else ""
-    profile_text = (
-        f"👤 *Имя:* {profile_user['name']}{premium_badge}\n\n"
-        f"💼 *Профессия:* {profile_user['profession']}\n\n"
-        f"🛠️ *Навыки:* {profile_user['skills']}\n\n"
-        f"📖 *О себе:* {profile_user['bio']}"
+    card = await profile_cards.get_card(profile_user, profile_cards.SEARCH)
+    # queued, not awaited: the handler must not wait out the chat's rate limit
+    report_failure(
+        send_card(user_id, card, coalesce_key="search_profile"),
+        user_id, sender.REPLY, "⚠️ Ошибка отображения профиля"
     )
-    
-    keyboard = [
-        [
-            InlineKeyboardButton("🤝 Связаться", callback_data=f"connect_{profile_user['user_id']}"),
-            InlineKeyboardButton("➡️ Пропустить", callback_data=f"skip_{profile_user['user_id']}")
-        ]
-    ]
-    
-    try:
-        if profile_user['photo_id']:
-            await context.bot.send_photo(
-                chat_id=user_id,
-                photo=profile_user['photo_id'],
-                caption=profile_text,
-                reply_markup=InlineKeyboardMarkup(keyboard),
-                parse_mode=ParseMode.MARKDOWN
-            )
-        else:
-            await context.bot.send_message(
-                chat_id=user_id,
-                text=profile_text,
-                reply_markup=InlineKeyboardMarkup(keyboard),
-                parse_mode=ParseMode.MARKDOWN
-            )
-    except Exception as e:
-        logger.error(f"Ошибка показа профиля: {e}")
-        await context.bot.send_message(user_id, "⚠️ Ошибка отображения профиля")
 
-async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def purchase_premium(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await send_invoice(update, context)
+
+async def cancel_premium(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.callback_query.edit_message_text("❌ Отмена премиум подписки.")
+
+async def connect_user(update: Update, context: ContextTypes.DEFAULT_TYPE, target_id):
     query = update.callback_query
-    await query.answer()
     user_id = query.from_user.id
+    is_premium = db.get_user_subscription(user_id)
     
-    if query.data == "premium_purchase":
-        await send_invoice(update, context)
-    elif query.data == "cancel_premium":
-        await query.edit_message_text("❌ Отмена премиум подписки.")
-    elif query.data == "update_profile":
-        await profile(update, context)
-    elif query.data.startswith("connect_"):
-        if not await check_connection_limit(user_id, context):
-            return
-        
-        target_id = int(query.data.split("_")[1])
-        
-        conn = sqlite3.connect("colleagues.db")
-        c = conn.cursor()
-        c.execute(
-            "INSERT INTO connections (from_user, to_user, status) VALUES (?, ?, 'pending')",
-            (user_id, target_id),
-        )
-        conn.commit()
-        conn.close()
-        
-        keyboard = [
-            [
-                InlineKeyboardButton("✅ Принять", callback_data=f"accept_{user_id}"),
-                InlineKeyboardButton("❌ Отклонить", callback_data=f"decline_{user_id}"),
-            ]
-        ]
-        try:
-            await context.bot.send_message(
-                chat_id=target_id,
-                text=f"📩 Новый запрос на связь от {query.from_user.full_name}!",
-                reply_markup=InlineKeyboardMarkup(keyboard),
-            )
-            await query.edit_message_text("📩 Запрос успешно отправлен!")
-        except Exception as e:
-            logger.error(f"Ошибка отправки запроса: {e}")
-            await query.edit_message_text("⚠️ Ошибка отправки запроса.")
-        
-        await show_next_profile(update, context)
-    
-    elif query.data.startswith("skip_"):
-        skipped_id = int(query.data.split("_")[1])
-        context.user_data.setdefault('search_skipped', []).append(skipped_id)
-        await query.message.delete()
+    result = await db.request_connection(user_id, target_id, rate_limit.capacity_for(is_premium))
+    if result == rate_limit.LIMITED:
+        await send_connection_limit(user_id, is_premium, context)
+        return
+    if result == rate_limit.DUPLICATE:
+        await query.edit_message_text("📩 Запрос этому пользователю уже отправлен.")
         await show_next_profile(update, context)
+        return
     
-    elif query.data.startswith("accept_"):
-        from_id = int(query.data.split("_")[1])
-        to_id = user_id
-        
-        conn = sqlite3.connect("colleagues.db")
-        c = conn.cursor()
-        c.execute(
-            "UPDATE connections SET status='accepted' WHERE from_user=? AND to_user=?",
-            (from_id, to_id),
-        )
-        conn.commit()
-        conn.close()
-        
-        await query.edit_message_text("✅ Запрос принят!")
-        try:
-            await context.bot.send_message(
-                from_id, 
-                f"🎉 {query.from_user.full_name} принял(а) ваш запрос на связь!"
-            )
-        except Exception as e:
-            logger.error(f"Ошибка уведомления: {e}")
-    
-    elif query.data.startswith("decline_"):
-        from_id = int(query.data.split("_")[1])
-        to_id = user_id
-        
-        conn = sqlite3.connect("colleagues.db")
-        c = conn.cursor()
-        c.execute(
-            "DELETE FROM connections WHERE from_user=? AND to_user=?", (from_id, to_id)
-        )
-        conn.commit()
-        conn.close()
-        
-        await query.edit_message_text("❌ Запрос отклонен.")
-        try:
-            await context.bot.send_message(
-                from_id, 
-                f"😞 {query.from_user.full_name} отклонил(а) ваш запрос на связь."
-            )
-        except Exception as e:
-            logger.error(f"Ошибка уведомления: {e}")
-
-async def check_connection_limit(user_id, context):
-    now = datetime.datetime.now()
-    if 'last_connection_date' not in context.user_data or \
-       context.user_data['last_connection_date'].date() != now.date():
-        context.user_data['connection_count'] = 0
-        context.user_data['last_connection_date'] = now
+    # the target gets one digest with a link to the inbox instead of a message per request
+    digests.add_request(target_id, query.from_user.full_name)
+    await query.edit_message_text("📩 Запрос успешно отправлен!")
     
-    is_premium = get_user_subscription(user_id)
-    max_connections = 200 if is_premium else 3
+    await show_next_profile(update, context)
+
+async def connections_next(update: Update, context: ContextTypes.DEFAULT_TYPE, cursor):
+    page, has_prev, has_next = await db.get_connections_page(update.effective_user.id, after=cursor)
+    if page:
+        await update.callback_query.edit_message_reply_markup(connections_markup(page, has_prev, has_next))
+
+async def connections_prev(update: Update, context: ContextTypes.DEFAULT_TYPE, cursor):
+    page, has_prev, has_next = await db.get_connections_page(update.effective_user.id, before=cursor)
+    if page:
+        await update.callback_query.edit_message_reply_markup(connections_markup(page, has_prev, has_next))
+
+def report_failure(future, chat_id, priority, text):
+    """Когда отправка из future не удалась, сообщает пользователю text; ошибку уже залогировал sender."""
+    def done(future):
+        if not future.cancelled() and future.exception() is not None:
+            sender.send(chat_id, priority=priority, text=text)
+    future.add_done_callback(done)
+
+def send_card(chat_id, card, coalesce_key=None):
+    """Ставит карточку профиля в очередь sender: фото с подписью или текст."""
+    if card.photo_id:
+        return sender.send(chat_id, "send_photo", priority=sender.REPLY, coalesce_key=coalesce_key,
+                           photo=card.photo_id, caption=card.caption, reply_markup=card.markup,
+                           parse_mode=ParseMode.MARKDOWN)
+    return sender.send(chat_id, priority=sender.REPLY, coalesce_key=coalesce_key,
+                       text=card.caption, reply_markup=card.markup, parse_mode=ParseMode.MARKDOWN)
+
+async def view_profile(update: Update, context: ContextTypes.DEFAULT_TYPE, profile_id):
+    # name buttons in the connections list and the inbox
+    profile_user = await db.get_user(profile_id)
+    if not profile_user:
+        sender.send(update.effective_user.id, priority=sender.REPLY, text="🤷 Профиль не найден.")
+        return
+    send_card(update.effective_user.id, await profile_cards.get_card(profile_user, profile_cards.VIEW))
+
+async def skip_profile(update: Update, context: ContextTypes.DEFAULT_TYPE, profile_id):
+    await update.callback_query.message.delete()
+    await show_next_profile(update, context)
+
+async def accept_request(update: Update, context: ContextTypes.DEFAULT_TYPE, from_id):
+    query = update.callback_query
+    if await db.accept_connection(from_id, query.from_user.id):
+        digests.add_answer((from_id,), query.from_user.full_name, True)
     
-    if context.user_data.get('connection_count', 0) >= max_connections:
-        msg = (f"❌ Достигнут дневной лимит соединений ({max_connections}).\n"
-               "💎 Премиум-пользователи имеют увеличенный лимит.")
-        if not is_premium:
-            msg += "\n\nИспользуйте /premium для расширения возможностей"
-        await context.bot.send_message(user_id, msg)
-        return False
+    await query.edit_message_text("✅ Запрос принят!")
+
+async def decline_request(update: Update, context: ContextTypes.DEFAULT_TYPE, from_id):
+    query = update.callback_query
+    if await db.decline_connection(from_id, query.from_user.id):
+        digests.add_answer((from_id,), query.from_user.full_name, False)
     
-    context.user_data['connection_count'] += 1
-    return True
+    await query.edit_message_text("❌ Запрос отклонен.")
+
+async def send_connection_limit(user_id, is_premium, context):
+    max_connections = rate_limit.capacity_for(is_premium)
+    msg = (f"❌ Достигнут дневной лимит соединений ({max_connections}).\n"
+           "💎 Премиум-пользователи имеют увеличенный лимит.")
+    if not is_premium:
+        msg += "\n\nИспользуйте /premium для расширения возможностей"
+    sender.send(user_id, priority=sender.REPLY, text=msg)
 
 async def premium(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if get_user_subscription(update.effective_user.id):
-        await update.message.reply_text("✅ У вас уже есть активная премиум подписка!")
-        return
+    expires_at = db.entitlements.expires_at(update.effective_user.id)
+    if db.get_user_subscription(update.effective_user.id):
+        header = (
+            f"✅ Премиум подписка активна до *{expires_at:%d.%m.%Y}*.\n"
+            "Продление добавит ещё месяц к текущему сроку.\n\n"
+        )
+    else:
+        header = ""
     
-    text = (
+    text = header + (
         "💎 *Премиум подписка*\n\n"
         "🚀 Расширенные возможности:\n"
         "✔️ До 200 соединений в день\n"
@@ -684,8 +629,8 @@ async def premium(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "👇 Нажмите кнопку ниже для оплаты:"
     )
     keyboard = [
-        [InlineKeyboardButton("💳 Купить премиум", callback_data="premium_purchase")],
-        [InlineKeyboardButton("❌ Отмена", callback_data="cancel_premium")]
+        [InlineKeyboardButton("💳 Купить премиум", callback_data=callbacks.PREMIUM_PURCHASE.encode())],
+        [InlineKeyboardButton("❌ Отмена", callback_data=callbacks.PREMIUM_CANCEL.encode())]
     ]
     await update.message.reply_text(
         text, 
@@ -694,41 +639,37 @@ async def premium(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
 async def send_invoice(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    try:
-        user = update.effective_user
-        if get_user_subscription(user.id):
-            await context.bot.send_message(user.id, "❌ У вас уже есть активная подписка!")
-            return
-            
-        await context.bot.send_invoice(
-            chat_id=user.id,
-            title="Премиум подписка",
-            description="Премиум доступ на 1 месяц",
-            payload="premium_subscription",
-            provider_token=PAYMASTER_TOKEN,
-            currency=CURRENCY,
-            prices=[LabeledPrice("Премиум подписка", PRICE)],
-            need_email=True
-        )
-    except Exception as e:
-        logger.error(f"Ошибка платежа: {str(e)}")
-        await context.bot.send_message(
-            chat_id=user.id,
-            text="❌ Ошибка оплаты. Попробуйте позже."
-        )
+    user = update.effective_user
+    invoice = sender.send(
+        user.id,
+        "send_invoice",
+        priority=sender.PAYMENT,
+        title="Премиум подписка",
+        description="Премиум доступ на 1 месяц",
+        payload=PAYLOAD,
+        provider_token=PAYMASTER_TOKEN,
+        currency=CURRENCY,
+        prices=[LabeledPrice("Премиум подписка", PRICE)],
+        need_email=True
+    )
+    report_failure(invoice, user.id, sender.PAYMENT, "❌ Ошибка оплаты. Попробуйте позже.")
 
 async def precheckout(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.pre_checkout_query
     user_id = query.from_user.id
     
+    # answered from memory only: Telegram gives pre-checkout ten seconds in total
     try:
-        if get_user_subscription(user_id):
-            await query.answer(ok=False, error_message="У вас уже есть активная подписка!")
-            return
-            
-        if query.invoice_payload != "premium_subscription":
+        if (query.invoice_payload != PAYLOAD or query.currency != CURRENCY
+                or query.total_amount != PRICE):
+            logger.warning(f"Неожиданный платёж от {user_id}: {query.invoice_payload} {query.total_amount}")
             await query.answer(ok=False, error_message="Ошибка платежа")
             return
+        
+        expires_at = db.entitlements.expires_at(user_id)
+        if expires_at and expires_at > datetime.datetime.now() + datetime.timedelta(days=MAX_PREPAID_DAYS):
+            await query.answer(ok=False, error_message="Подписка уже оплачена больше чем на год вперёд")
+            return
             
         await query.answer(ok=True)
     except Exception as e:
@@ -737,10 +678,22 @@ async def precheckout(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def successful_payment(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
+    payment = update.message.successful_payment
     try:
-        update_premium_status(user_id, True)
+        applied, subscription_end = await db.apply_payment(
+            user_id,
+            payment.telegram_payment_charge_id,
+            payment.provider_payment_charge_id,
+            payment.total_amount,
+            payment.currency,
+            payment.invoice_payload
+        )
+        if not applied:
+            logger.info(f"Повторная доставка платежа {payment.telegram_payment_charge_id} пропущена")
+            return
+        await db.reset_connection_limit(user_id)
         await update.message.reply_text(
-            "🎉 *Премиум подписка активирована!*\n\n"
+            f"🎉 *Премиум подписка активна до {subscription_end:%d.%m.%Y}!*\n\n"
             "Теперь вам доступны:\n"
             "- Увеличенный лимит соединений\n"
             "- Приоритет в поиске\n"
@@ -764,17 +717,85 @@ async def payment_error(update: Update, context: ContextTypes.DEFAULT_TYPE):
         parse_mode=ParseMode.MARKDOWN
     )
 
+async def broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id not in ADMIN_IDS:
+        return
+    text = " ".join(context.args)
+    if not text:
+        await update.message.reply_text("Использование: /broadcast <текст>")
+        return
+    campaign_id = await db.create_campaign("announcement", text)
+    stats = await notifications.campaign_stats(campaign_id)
+    await update.message.reply_text(
+        f"📣 Рассылка #{campaign_id} поставлена в очередь: {stats.get('pending', 0)} получателей, "
+        f"примерно {stats['eta_seconds'] // 60} мин."
+    )
+
+async def campaign(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id not in ADMIN_IDS:
+        return
+    if not context.args or not context.args[0].isdigit():
+        await update.message.reply_text("Использование: /campaign <номер>")
+        return
+    stats = await notifications.campaign_stats(int(context.args[0]))
+    await update.message.reply_text(
+        f"📊 Рассылка #{context.args[0]}\n"
+        f"Отправлено: {stats.get('sent', 0)}\n"
+        f"Ошибок: {stats.get('failed', 0)}\n"
+        f"В очереди: {stats.get('pending', 0) + stats.get('sending', 0)}\n"
+        f"Осталось примерно: {stats['eta_seconds'] // 60} мин."
+    )
+
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     await update.message.reply_text("❌ Действие отменено.")
     context.user_data.clear()
     return ConversationHandler.END
 
-def main() -> None:
-    create_tables()
-    application = Application.builder().token("***").build()
+async def post_init(application: Application) -> None:
+    await db.ensure_storage()
+    if SHARD_COUNT > 1:
+        db.user_cache.ttl = SHARD_USER_CACHE_TTL
+    # Telegram's global send limit is per bot, so workers split it; worker 0 also drains the outbox
+    global_rate, global_burst = sender.shard_rate(SHARD_INDEX, SHARD_COUNT)
+    sender.start(application.bot, global_rate=global_rate, global_burst=global_burst)
+    notifications.outbox_rate = sender.shard_rate(0, SHARD_COUNT)[0]
+    await metrics.start(METRICS_PORT + SHARD_INDEX if METRICS_PORT else None, METRICS_HOST)
+    metrics.registry.gauge("sender_queue_depth", lambda: sender.scheduler.queue_depth())
+    metrics.registry.gauge("user_cache_hit_rate", lambda: db.user_cache.stats()["hit_rate"])
+    metrics.registry.gauge("profile_card_cache_hit_rate", lambda: profile_cards.card_cache.stats()["hit_rate"])
+    metrics.registry.gauge("search_feeds", lambda: search_feed.stats()["size"])
+    if SHARD_INDEX == 0:
+        await notifications.start()
+
+async def post_shutdown(application: Application) -> None:
+    await metrics.stop()
+    await notifications.stop()
+    digests.flush()
+    await sender.stop()
+    await db.backend.close()
+    db.close()
+
+def build_application(builder) -> Application:
+    application = (
+        builder.persistence(persistence.DBPersistence(shard=(SHARD_INDEX, SHARD_COUNT)))
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
     job_queue = application.job_queue
 
-    job_queue.run_daily(check_subscriptions, time=datetime.time(hour=0, minute=0, second=0))
+    # shared background work runs in one worker only
+    # each worker syncs expiries from its own entitlement index
+    job_queue.run_repeating(apply_expirations, interval=60)
+    job_queue.run_repeating(send_digests, interval=digests.DIGEST_INTERVAL)
+    if SHARD_INDEX == 0:
+        job_queue.run_daily(check_subscriptions, time=datetime.time(hour=0, minute=0, second=0))
+        job_queue.run_daily(send_renewal_reminders, time=datetime.time(hour=12, minute=0, second=0))
+        job_queue.run_daily(purge_outbox, time=datetime.time(hour=3, minute=0, second=0))
+        job_queue.run_daily(rebuild_recommendations, time=datetime.time(hour=4, minute=0, second=0))
+        job_queue.run_repeating(refresh_recommendations, interval=RECOMMENDATIONS_REFRESH_INTERVAL)
+    job_queue.run_repeating(log_cache_stats, interval=3600)
+    job_queue.run_repeating(log_metrics, interval=300)
 
     conv_handler = ConversationHandler(
         entry_points=[
@@ -797,22 +818,133 @@ def main() -> None:
             ]
         },
         fallbacks=[CommandHandler("cancel", cancel)],
-        allow_reentry=True
+        allow_reentry=True,
+        name="profile_edit",
+        persistent=True
     )
 
     application.add_handler(CommandHandler("start", start))
     application.add_handler(MessageHandler(filters.Regex(r'^🆘 Помощь$'), help_command))
     application.add_handler(conv_handler)
     application.add_handler(MessageHandler(filters.Regex(r'^🔍 Поиск связей$'), search))
+    application.add_handler(CommandHandler("find", find))
+    application.add_handler(CommandHandler("skills", skills_filter))
+    application.add_handler(CommandHandler("broadcast", broadcast))
+    application.add_handler(CommandHandler("campaign", campaign))
     application.add_handler(MessageHandler(filters.Regex(r'^👤 Мой профиль$'), myprofile))
     application.add_handler(MessageHandler(filters.Regex(r'^🤝 Мои связи$'), connections))
+    application.add_handler(MessageHandler(filters.Regex(r'^📥 Входящие$'), inbox))
     application.add_handler(MessageHandler(filters.Regex(r'^💎 Премиум$'), premium))
-    application.add_handler(CallbackQueryHandler(button_handler))
+    for action, callback in (
+        (callbacks.PREMIUM_PURCHASE, purchase_premium),
+        (callbacks.PREMIUM_CANCEL, cancel_premium),
+        (callbacks.CONNECT, connect_user),
+        (callbacks.SKIP, skip_profile),
+        (callbacks.ACCEPT, accept_request),
+        (callbacks.DECLINE, decline_request),
+        (callbacks.CONNECTIONS_NEXT, connections_next),
+        (callbacks.CONNECTIONS_PREV, connections_prev),
+        (callbacks.VIEW, view_profile),
+        (callbacks.INBOX, inbox),
+        (callbacks.INBOX_NEXT, inbox_next),
+        (callbacks.INBOX_PREV, inbox_prev),
+        (callbacks.INBOX_ACCEPT, inbox_accept),
+        (callbacks.INBOX_DECLINE, inbox_decline),
+        (callbacks.INBOX_ACCEPT_ALL, inbox_accept_all),
+        (callbacks.INBOX_DECLINE_ALL, inbox_decline_all),
+    ):
+        application.add_handler(callbacks.route(action, callback))
+    application.add_handler(CallbackQueryHandler(callbacks.answer_unknown))
     application.add_handler(PreCheckoutQueryHandler(precheckout))
     application.add_handler(MessageHandler(filters.SUCCESSFUL_PAYMENT, successful_payment))
     application.add_handler(MessageHandler(filters.TEXT, payment_error))
 
-    application.run_polling()
+    metrics.instrument_handlers(application)
+    metrics.instrument_module(db, skip=("run", "fetchone", "fetchall", "execute", "ensure_storage", "use_storage"))
+    return application
+
+def run_webhook_mode(application: Application) -> None:
+    async def serve():
+        stop_event = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop_event.set)
+        await webhook.run_webhook(
+            application,
+            url=WEBHOOK_URL,
+            host=WEBHOOK_HOST,
+            port=WEBHOOK_PORT,
+            path=WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET,
+            cert_path=WEBHOOK_CERT,
+            key_path=WEBHOOK_KEY,
+            upload_certificate=WEBHOOK_UPLOAD_CERT,
+            queue_size=WEBHOOK_QUEUE_SIZE,
+            stop_event=stop_event
+        )
+
+    asyncio.run(serve())
+
+def run_sharded_mode() -> None:
+    # imported here: only the front process needs it
+    import sharding
+
+    async def serve():
+        stop_event = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop_event.set)
+        await sharding.run_front(
+            SHARD_WORKERS,
+            BOT_TOKEN,
+            webhook_url=WEBHOOK_URL,
+            host=WEBHOOK_HOST,
+            port=WEBHOOK_PORT,
+            path=WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET,
+            cert_path=WEBHOOK_CERT,
+            key_path=WEBHOOK_KEY,
+            upload_certificate=WEBHOOK_UPLOAD_CERT,
+            stop_event=stop_event
+        )
+
+    asyncio.run(serve())
+
+def setup_storage() -> None:
+    db.init()
+    if DATABASE_URL:
+        db.configure_storage(storage.open_storage(DATABASE_URL))
+    db.check_schema()
+    db.load_entitlements()
+
+def migrate_only() -> None:
+    db.init()
+    applied = db.create_tables()
+    logger.info(f"Схема версии {db.SCHEMA_VERSION}, применено миграций: {len(applied)}")
+    db.close()
+
+def main() -> None:
+    if "--migrate-only" in sys.argv[1:]:
+        migrate_only()
+        return
+    if SHARD_WORKERS > 1:
+        # migrate once here, so that workers starting together only check the version;
+        # an unusable DATABASE_URL fails here instead of in every restarted worker
+        setup_storage()
+        db.close()
+        # the front only routes updates; workers open the database themselves
+        run_sharded_mode()
+        return
+    setup_storage()
+    builder = Application.builder().token(BOT_TOKEN)
+    
+    # updates of different users run concurrently in both modes, one user's stay in order
+    builder = builder.concurrent_updates(webhook.PerUserUpdateProcessor(MAX_CONCURRENT_UPDATES))
+    if WEBHOOK_URL:
+        builder = builder.updater(None)
+        run_webhook_mode(build_application(builder))
+    else:
+        build_application(builder).run_polling()
 
 if __name__ == "__main__":
     main()
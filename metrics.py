@@ -0,0 +1,216 @@
+import asyncio
+import bisect
+import functools
+import inspect
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# seconds; the last bucket is +Inf
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+LAG_INTERVAL = 0.5
+
+
+class Histogram:
+    """Гистограмма задержек с фиксированными границами, как в Prometheus.
+
+    observe() — один bisect и пара сложений, поэтому её можно оставлять включённой в проде.
+    """
+
+    __slots__ = ("counts", "total", "count", "errors")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+        self.errors = 0
+
+    def observe(self, seconds, error=False):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.total += seconds
+        self.count += 1
+        if error:
+            self.errors += 1
+
+    def quantile(self, q):
+        """Верхняя граница бакета, в который попадает квантиль q."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(BUCKETS, self.counts):
+            seen += n
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+class Registry:
+    def __init__(self):
+        # metric name -> label value -> Histogram
+        self.histograms = {}
+        self.gauges = {}
+
+    def histogram(self, metric, label):
+        series = self.histograms.setdefault(metric, {})
+        hist = series.get(label)
+        if hist is None:
+            hist = series[label] = Histogram()
+        return hist
+
+    def gauge(self, name, fn):
+        """Регистрирует показатель, значение которого берётся из fn() в момент выгрузки."""
+        self.gauges[name] = fn
+
+    def render(self):
+        """Все метрики в текстовом формате Prometheus."""
+        lines = []
+        for metric, series in self.histograms.items():
+            lines.append(f"# TYPE {metric}_seconds histogram")
+            for label, hist in sorted(series.items()):
+                cumulative = 0
+                for bound, n in zip((*BUCKETS, "+Inf"), hist.counts):
+                    cumulative += n
+                    lines.append(f'{metric}_seconds_bucket{{name="{label}",le="{bound}"}} {cumulative}')
+                lines.append(f'{metric}_seconds_sum{{name="{label}"}} {hist.total:.6f}')
+                lines.append(f'{metric}_seconds_count{{name="{label}"}} {hist.count}')
+                lines.append(f'{metric}_errors_total{{name="{label}"}} {hist.errors}')
+        for name, fn in self.gauges.items():
+            try:
+                value = fn()
+            except Exception as e:
+                logger.error(f"Ошибка метрики {name}: {e}")
+                continue
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self, metric, top=5):
+        """Самые медленные по p99 серии метрики, для периодического лога."""
+        series = self.histograms.get(metric, {})
+        rows = sorted(series.items(), key=lambda item: item[1].quantile(0.99), reverse=True)[:top]
+        return ", ".join(
+            f"{label}: n={hist.count} p50≤{hist.quantile(0.5) * 1000:g}ms p99≤{hist.quantile(0.99) * 1000:g}ms "
+            f"err={hist.errors / hist.count:.1%}"
+            for label, hist in rows if hist.count
+        )
+
+
+registry = Registry()
+
+
+def timed(metric, label, fn):
+    """Оборачивает корутинную функцию: время и ошибки каждого вызова пишутся в гистограмму."""
+    hist = registry.histogram(metric, label)
+
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            result = await fn(*args, **kwargs)
+        except Exception:
+            hist.observe(time.perf_counter() - started, error=True)
+            raise
+        hist.observe(time.perf_counter() - started)
+        return result
+
+    wrapper.__wrapped_metric__ = metric
+    return wrapper
+
+
+def instrument_handlers(application):
+    """Оборачивает callback каждого зарегистрированного обработчика, включая вложенные в ConversationHandler."""
+    def visit(handler):
+        nested = [*getattr(handler, "entry_points", ()), *getattr(handler, "fallbacks", ())]
+        for state_handlers in getattr(handler, "states", {}).values():
+            nested.extend(state_handlers)
+        if nested:
+            for child in nested:
+                visit(child)
+            return
+        callback = handler.callback
+        if inspect.iscoroutinefunction(callback) and not hasattr(callback, "__wrapped_metric__"):
+            handler.callback = timed("handler", callback.__name__, callback)
+
+    for group in application.handlers.values():
+        for handler in group:
+            visit(handler)
+
+
+def instrument_module(module, skip=()):
+    """Оборачивает все публичные корутинные функции модуля, например хелперы db."""
+    for name, fn in list(vars(module).items()):
+        if (name.startswith("_") or name in skip or not inspect.iscoroutinefunction(fn)
+                or hasattr(fn, "__wrapped_metric__") or getattr(fn, "__module__", None) != module.__name__):
+            continue
+        setattr(module, name, timed("db", name, fn))
+
+
+async def watch_event_loop(interval=LAG_INTERVAL):
+    """Меряет, насколько позже запланированного просыпается цикл событий."""
+    hist = registry.histogram("event_loop_lag", "main")
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        hist.observe(max(0.0, time.perf_counter() - started - interval))
+
+
+class MetricsServer:
+    """Отдаёт registry.render() на любой GET, для локального сборщика Prometheus."""
+
+    def __init__(self, host="127.0.0.1", port=9100):
+        self.host = host
+        self.port = port
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        logger.info(f"Метрики доступны на http://{self.host}:{self.port}/metrics")
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def _handle(self, reader, writer):
+        try:
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+            body = registry.render().encode()
+            writer.write(
+                b"HTTP/1.1 200 OK\r\n"
+                b"Content-Type: text/plain; version=0.0.4\r\n"
+                + f"Content-Length: {len(body)}\r\n".encode()
+                + b"Connection: close\r\n\r\n"
+                + body
+            )
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+server = None
+_lag_task = None
+
+
+async def start(port=None, host="127.0.0.1"):
+    """Запускает замер задержки цикла событий и, если задан port, HTTP-эндпоинт метрик."""
+    global server, _lag_task
+    _lag_task = asyncio.create_task(watch_event_loop())
+    if port is not None:
+        server = MetricsServer(host, port)
+        await server.start()
+
+
+async def stop():
+    global server, _lag_task
+    if _lag_task is not None:
+        _lag_task.cancel()
+        _lag_task = None
+    if server is not None:
+        await server.stop()
+        server = None
@@ -0,0 +1,394 @@
+import hashlib
+import logging
+import sqlite3
+import time
+from contextlib import contextmanager
+
+import db
+
+logger = logging.getLogger(__name__)
+
+# rows per backfill transaction: long enough to be fast, short enough not to stall the bot's writes
+CHUNK_ROWS = 10000
+PROGRESS_EVERY = 50
+
+SCHEMA_MIGRATIONS = """CREATE TABLE IF NOT EXISTS schema_migrations
+                       (version INTEGER PRIMARY KEY,
+                        name TEXT,
+                        checksum TEXT,
+                        cursor INTEGER,
+                        applied_at REAL)"""
+
+
+class Migration:
+    """Шаг схемы с номером версии.
+
+    steps — SQL-выражения или функции fn(conn), каждое в своей транзакции, поэтому они должны
+    быть идемпотентными (IF NOT EXISTS, проверка колонок). backfill(conn, after) переносит
+    одну порцию строк с ключом больше after и возвращает ключ последней строки или None, когда
+    всё готово; позиция сохраняется в той же транзакции, что и порция, так что прерванный шаг
+    продолжается с места остановки. reset — выражения, после которых backfill можно повторить
+    с начала (rebuild).
+
+    Контрольная сумма берётся от SQL с нормализованными пробелами, имён функций и revision:
+    правка комментария или отступов её не меняет, а изменение того, что делает функция
+    применённого шага, нужно отметить, подняв revision.
+    """
+
+    __slots__ = ("version", "name", "steps", "backfill", "reset", "revision", "checksum")
+
+    def __init__(self, version, name, *steps, backfill=None, reset=(), revision=1):
+        self.version = version
+        self.name = name
+        self.steps = steps
+        self.backfill = backfill
+        self.reset = reset
+        self.revision = revision
+        parts = [name, str(revision)]
+        for part in (*steps, *reset, *([backfill] if backfill else [])):
+            parts.append(part.__name__ if callable(part) else " ".join(part.split()))
+        self.checksum = hashlib.sha256("\n".join(parts).encode()).hexdigest()
+
+
+def _columns(conn, table):
+    return {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+
+
+def _add_search_rank(conn):
+    if "search_rank" not in _columns(conn, "users"):
+        conn.execute("ALTER TABLE users ADD COLUMN search_rank REAL")
+
+
+def _fill_search_rank(conn, after):
+    # search_rank is a random key fixed per user: sampling is an index seek
+    # from a random point instead of ORDER BY RANDOM() over the whole table
+    last = conn.execute("SELECT max(user_id) FROM (SELECT user_id FROM users WHERE user_id > ? "
+                        "ORDER BY user_id LIMIT ?)", (after, CHUNK_ROWS)).fetchone()[0]
+    if last is None:
+        return None
+    conn.execute("UPDATE users SET search_rank = (random() / 18446744073709551616.0) + 0.5 "
+                 "WHERE user_id > ? AND user_id <= ? AND search_rank IS NULL", (after, last))
+    return last
+
+
+def _add_profile_version(conn):
+    # bumped on every profile edit; rendered profile cards are keyed by it
+    if "profile_version" not in _columns(conn, "users"):
+        conn.execute("ALTER TABLE users ADD COLUMN profile_version INTEGER DEFAULT 0")
+
+
+def _unique_connections(conn):
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE name='uq_connections_from_to'").fetchone():
+        return
+    # repeated connect taps used to insert duplicates; keep the accepted row, else the oldest
+    conn.execute("""DELETE FROM connections WHERE id NOT IN (
+                        SELECT id FROM (
+                            SELECT id, ROW_NUMBER() OVER (
+                                PARTITION BY from_user, to_user
+                                ORDER BY status = 'accepted' DESC, id
+                            ) AS n FROM connections
+                        ) WHERE n = 1
+                    )""")
+    conn.execute("DROP INDEX IF EXISTS idx_connections_from_to")
+    conn.execute("CREATE UNIQUE INDEX uq_connections_from_to ON connections(from_user, to_user)")
+
+
+def _create_users_fts(conn):
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE name='users_fts'").fetchone():
+        return
+    conn.execute("""CREATE VIRTUAL TABLE users_fts USING fts5
+                    (name, profession, skills, bio,
+                     content='users', content_rowid='user_id',
+                     tokenize='unicode61 remove_diacritics 2', prefix='2 3')""")
+    conn.execute("INSERT INTO users_fts(users_fts, rank) VALUES('rank', 'bm25(10.0, 5.0, 3.0, 1.0)')")
+    conn.execute("INSERT INTO users_fts(users_fts) VALUES('rebuild')")
+
+
+def _backfill_user_skills(conn, after):
+    if after == 0 and conn.execute("SELECT 1 FROM user_skills LIMIT 1").fetchone():
+        # filled before the schema was versioned
+        return None
+    rows = conn.execute("SELECT user_id, profession, skills FROM users WHERE user_id > ? ORDER BY user_id LIMIT ?",
+                        (after, CHUNK_ROWS)).fetchall()
+    if not rows:
+        conn.execute("UPDATE skills SET users = (SELECT count(*) FROM user_skills s WHERE s.skill_id = skills.skill_id)")
+        return None
+    tags = [(user_id, db._user_tags(profession, skills)) for user_id, profession, skills in rows]
+    interned = db._intern_skills(conn, list({tag for _, user_tags in tags for tag in user_tags}))
+    conn.executemany("INSERT OR IGNORE INTO user_skills (skill_id, user_id) VALUES (?, ?)",
+                     [(interned[tag], user_id) for user_id, user_tags in tags for tag in user_tags])
+    return rows[-1][0]
+
+
+MIGRATIONS = [
+    Migration(
+        1, "base_tables",
+        """CREATE TABLE IF NOT EXISTS users
+           (user_id INTEGER PRIMARY KEY,
+            name TEXT,
+            profession TEXT,
+            skills TEXT,
+            bio TEXT,
+            photo_id TEXT,
+            username TEXT,
+            is_premium INTEGER DEFAULT 0,
+            subscription_end TEXT,
+            social_link TEXT,
+            search_rank REAL,
+            profile_version INTEGER DEFAULT 0)""",
+        """CREATE TABLE IF NOT EXISTS works
+           (id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            work_title TEXT,
+            work_description TEXT)""",
+        """CREATE TABLE IF NOT EXISTS connections
+           (id INTEGER PRIMARY KEY AUTOINCREMENT,
+            from_user INTEGER,
+            to_user INTEGER,
+            status TEXT)""",
+    ),
+    Migration(2, "users_search_rank", _add_search_rank, backfill=_fill_search_rank),
+    Migration(3, "users_search_rank_index", "CREATE INDEX IF NOT EXISTS idx_users_search_rank ON users(search_rank)"),
+    Migration(4, "users_profile_version", _add_profile_version),
+    Migration(5, "users_subscription_end_index",
+              "CREATE INDEX IF NOT EXISTS idx_users_subscription_end ON users(subscription_end)"),
+    Migration(6, "connections_unique_pair", _unique_connections),
+    Migration(
+        7, "connections_indexes",
+        "CREATE INDEX IF NOT EXISTS idx_connections_to_from ON connections(to_user, from_user)",
+        "CREATE INDEX IF NOT EXISTS idx_connections_from_status ON connections(from_user, status, to_user)",
+        "CREATE INDEX IF NOT EXISTS idx_connections_to_status ON connections(to_user, status, from_user)",
+    ),
+    Migration(
+        8, "users_fts",
+        _create_users_fts,
+        # triggers keep the external-content index in step with every write to users
+        """CREATE TRIGGER IF NOT EXISTS users_fts_ai AFTER INSERT ON users BEGIN
+               INSERT INTO users_fts(rowid, name, profession, skills, bio)
+               VALUES (new.user_id, new.name, new.profession, new.skills, new.bio);
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS users_fts_ad AFTER DELETE ON users BEGIN
+               INSERT INTO users_fts(users_fts, rowid, name, profession, skills, bio)
+               VALUES ('delete', old.user_id, old.name, old.profession, old.skills, old.bio);
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS users_fts_au AFTER UPDATE OF name, profession, skills, bio ON users
+           BEGIN
+               INSERT INTO users_fts(users_fts, rowid, name, profession, skills, bio)
+               VALUES ('delete', old.user_id, old.name, old.profession, old.skills, old.bio);
+               INSERT INTO users_fts(rowid, name, profession, skills, bio)
+               VALUES (new.user_id, new.name, new.profession, new.skills, new.bio);
+           END""",
+    ),
+    Migration(
+        9, "rate_limits",
+        """CREATE TABLE IF NOT EXISTS rate_limits
+           (user_id INTEGER PRIMARY KEY,
+            tokens REAL,
+            updated_at REAL)""",
+    ),
+    Migration(
+        10, "outbox",
+        """CREATE TABLE IF NOT EXISTS campaigns
+           (id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT,
+            text TEXT,
+            created_at TEXT)""",
+        """CREATE TABLE IF NOT EXISTS outbox
+           (id INTEGER PRIMARY KEY AUTOINCREMENT,
+            campaign_id INTEGER,
+            user_id INTEGER,
+            status TEXT DEFAULT 'pending',
+            claimed_at REAL,
+            UNIQUE (campaign_id, user_id))""",
+        "CREATE INDEX IF NOT EXISTS idx_outbox_pending ON outbox(id) WHERE status = 'pending'",
+        "CREATE INDEX IF NOT EXISTS idx_outbox_campaign_status ON outbox(campaign_id, status)",
+    ),
+    Migration(
+        11, "payments",
+        """CREATE TABLE IF NOT EXISTS payments
+           (charge_id TEXT PRIMARY KEY,
+            provider_charge_id TEXT,
+            user_id INTEGER,
+            amount INTEGER,
+            currency TEXT,
+            payload TEXT,
+            created_at TEXT,
+            subscription_end TEXT)""",
+        "CREATE INDEX IF NOT EXISTS idx_payments_user ON payments(user_id)",
+    ),
+    Migration(
+        12, "bot_state",
+        """CREATE TABLE IF NOT EXISTS bot_state
+           (kind TEXT,
+            key TEXT,
+            data TEXT,
+            PRIMARY KEY (kind, key)) WITHOUT ROWID""",
+    ),
+    Migration(
+        13, "search_seen",
+        """CREATE TABLE IF NOT EXISTS search_seen
+           (user_id INTEGER,
+            seen_id INTEGER,
+            PRIMARY KEY (user_id, seen_id)) WITHOUT ROWID""",
+    ),
+    Migration(
+        14, "recommendations",
+        # top-K candidates per user, packed int64 ids; built offline by recommendations.py
+        """CREATE TABLE IF NOT EXISTS recommendations
+           (user_id INTEGER PRIMARY KEY,
+            candidates BLOB,
+            built_at REAL)""",
+        """CREATE TABLE IF NOT EXISTS recommendations_stale
+           (user_id INTEGER PRIMARY KEY,
+            marked_at REAL) WITHOUT ROWID""",
+    ),
+    Migration(
+        15, "user_skills",
+        # skills and professions interned once; users is the posting length used to plan intersections
+        """CREATE TABLE IF NOT EXISTS skills
+           (skill_id INTEGER PRIMARY KEY,
+            name TEXT UNIQUE,
+            users INTEGER DEFAULT 0)""",
+        # the primary key is each skill's sorted posting list; the index lists a user's skills
+        """CREATE TABLE IF NOT EXISTS user_skills
+           (skill_id INTEGER,
+            user_id INTEGER,
+            PRIMARY KEY (skill_id, user_id)) WITHOUT ROWID""",
+        backfill=_backfill_user_skills,
+        reset=("DELETE FROM user_skills", "UPDATE skills SET users = 0"),
+    ),
+    # built after the backfill: one sorted pass instead of maintaining it row by row
+    Migration(16, "user_skills_user_index",
+              "CREATE INDEX IF NOT EXISTS idx_user_skills_user ON user_skills(user_id, skill_id)"),
+]
+
+if MIGRATIONS[-1].version != db.SCHEMA_VERSION:
+    raise RuntimeError(f"Последняя миграция {MIGRATIONS[-1].version}, а db.SCHEMA_VERSION = {db.SCHEMA_VERSION}")
+
+
+def _connect(path):
+    # autocommit: every transaction below is opened explicitly
+    conn = sqlite3.connect(path, isolation_level=None)
+    for pragma in db.PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+@contextmanager
+def _transaction(conn):
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+
+def _version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def _verify(conn):
+    version = _version(conn)
+    if version > db.SCHEMA_VERSION:
+        raise RuntimeError(f"Схема базы версии {version} новее кода ({db.SCHEMA_VERSION})")
+    known = {migration.version: migration for migration in MIGRATIONS}
+    for number, name, checksum in conn.execute(
+            "SELECT version, name, checksum FROM schema_migrations WHERE applied_at IS NOT NULL"):
+        if number not in known or known[number].checksum != checksum:
+            raise RuntimeError(f"Применённая миграция {number} ({name}) изменена или удалена из кода")
+
+
+def _run_backfill(conn, migration):
+    chunks = 0
+    while True:
+        with _transaction(conn):
+            # the cursor is read and moved in the chunk's own transaction, so a restart
+            # (or a second process migrating at the same time) continues where it stopped
+            after = conn.execute("SELECT cursor FROM schema_migrations WHERE version=?",
+                                 (migration.version,)).fetchone()[0]
+            if after is not None:
+                after = migration.backfill(conn, after)
+                conn.execute("UPDATE schema_migrations SET cursor=? WHERE version=?", (after, migration.version))
+        if after is None:
+            return
+        chunks += 1
+        if chunks % PROGRESS_EVERY == 0:
+            logger.info(f"Миграция {migration.version} ({migration.name}): обработано до ключа {after}")
+
+
+def _apply(conn, migration):
+    with _transaction(conn):
+        row = conn.execute("SELECT checksum FROM schema_migrations WHERE version=?", (migration.version,)).fetchone()
+        if row is None or row[0] != migration.checksum:
+            # a half-applied step edited meanwhile starts its backfill over
+            conn.execute("""INSERT INTO schema_migrations (version, name, checksum, cursor) VALUES (?, ?, ?, 0)
+                            ON CONFLICT(version) DO UPDATE SET
+                                name=excluded.name, checksum=excluded.checksum, cursor=0""",
+                         (migration.version, migration.name, migration.checksum))
+    for step in migration.steps:
+        with _transaction(conn):
+            if callable(step):
+                step(conn)
+            else:
+                conn.execute(step)
+    if migration.backfill:
+        _run_backfill(conn, migration)
+    with _transaction(conn):
+        conn.execute("UPDATE schema_migrations SET cursor=NULL, applied_at=? WHERE version=?",
+                     (time.time(), migration.version))
+        if _version(conn) < migration.version:
+            conn.execute(f"PRAGMA user_version = {migration.version}")
+
+
+def migrate(path=None):
+    """Применяет недостающие миграции по порядку и возвращает их номера.
+
+    Версия схемы хранится в PRAGMA user_version, контрольные суммы применённых шагов — в
+    schema_migrations; если применённый шаг потом изменили в коде, migrate() отказывается
+    работать. Прерванная миграция или пересборка при следующем запуске продолжается с места
+    остановки.
+    """
+    conn = _connect(path or db.database_path())
+    try:
+        conn.execute(SCHEMA_MIGRATIONS)
+        _verify(conn)
+        applied = []
+        for migration in MIGRATIONS:
+            if _version(conn) >= migration.version:
+                continue
+            started = time.perf_counter()
+            _apply(conn, migration)
+            applied.append(migration.version)
+            logger.info(f"Миграция {migration.version} ({migration.name}) применена "
+                        f"за {time.perf_counter() - started:.1f}с")
+        # a rebuild() that was interrupted left its cursor behind
+        pending = {number for number, in conn.execute(
+            "SELECT version FROM schema_migrations WHERE applied_at IS NOT NULL AND cursor IS NOT NULL")}
+        for migration in MIGRATIONS:
+            if migration.version in pending:
+                logger.info(f"Продолжается пересборка {migration.version} ({migration.name})")
+                _run_backfill(conn, migration)
+        return applied
+    finally:
+        conn.close()
+
+
+def rebuild(name, path=None):
+    """Повторяет порционный шаг миграции name с начала.
+
+    Нужно, когда строки попали в базу в обход бота (импорт, тестовые данные) и производные
+    таблицы вроде user_skills надо пересобрать.
+    """
+    migration = next(m for m in MIGRATIONS if m.name == name)
+    migrate(path)
+    conn = _connect(path or db.database_path())
+    try:
+        with _transaction(conn):
+            for sql in migration.reset:
+                conn.execute(sql)
+            conn.execute("UPDATE schema_migrations SET cursor=0 WHERE version=?", (migration.version,))
+        _run_backfill(conn, migration)
+    finally:
+        conn.close()
@@ -0,0 +1,121 @@
+import asyncio
+import datetime
+import logging
+
+import db
+import sender
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 200
+IDLE_DELAY = 5.0
+# claim the next chunk only when the scheduler has room, so notifications never crowd out replies
+MAX_QUEUE_DEPTH = 500
+REMINDER_DAYS = 3
+# send rate of the process that drains the outbox; set at startup when workers split the budget
+outbox_rate = sender.GLOBAL_RATE
+
+
+class OutboxWorker:
+    """Разбирает outbox порциями через sender с приоритетом NOTIFICATION.
+
+    Строки сначала помечаются 'sending', после отправки — 'sent' или 'failed'. Если процесс
+    упал посреди порции, при следующем старте такие строки возвращаются в 'pending'
+    (доставка «хотя бы один раз»).
+    """
+
+    def __init__(self, chunk_size=CHUNK_SIZE, max_queue_depth=MAX_QUEUE_DEPTH):
+        self.chunk_size = chunk_size
+        self.max_queue_depth = max_queue_depth
+        self._task = None
+        self._stopping = asyncio.Event()
+        self.sent = 0
+        self.failed = 0
+
+    async def start(self):
+        # a single worker owns the outbox, so anything still 'sending' was cut off by a crash
+        released = await db.release_stale_outbox(0)
+        if released:
+            logger.info(f"Возвращено в очередь уведомлений: {released}")
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._stopping.set()
+        if self._task is not None:
+            await self._task
+
+    async def _run(self):
+        while not self._stopping.is_set():
+            try:
+                if sender.scheduler.queue_depth() > self.max_queue_depth:
+                    await self._pause(0.5)
+                elif not await self.drain_chunk():
+                    await self._pause(IDLE_DELAY)
+            except Exception as e:
+                logger.error(f"Ошибка рассылки уведомлений: {e}")
+                await self._pause(IDLE_DELAY)
+
+    async def _pause(self, seconds):
+        try:
+            await asyncio.wait_for(self._stopping.wait(), seconds)
+        except asyncio.TimeoutError:
+            pass
+
+    async def drain_chunk(self):
+        rows = await db.claim_outbox(self.chunk_size)
+        if not rows:
+            return 0
+        futures = [sender.send(user_id, priority=sender.NOTIFICATION, text=text) for _, user_id, text in rows]
+        results = await asyncio.gather(*futures, return_exceptions=True)
+        sent_ids, failed_ids = [], []
+        for (row_id, _, _), result in zip(rows, results):
+            (failed_ids if isinstance(result, Exception) else sent_ids).append(row_id)
+        await db.finish_outbox(sent_ids, failed_ids)
+        self.sent += len(sent_ids)
+        self.failed += len(failed_ids)
+        return len(rows)
+
+
+worker = None
+
+
+async def start():
+    global worker
+    worker = OutboxWorker()
+    await worker.start()
+
+
+async def stop():
+    global worker
+    if worker is not None:
+        await worker.stop()
+        worker = None
+
+
+async def campaign_stats(campaign_id):
+    progress = await db.campaign_progress(campaign_id)
+    pending = progress.get("pending", 0) + progress.get("sending", 0)
+    # delivery is bounded by the outbox process's send rate, so the remaining time is predictable
+    progress["eta_seconds"] = int(pending / outbox_rate)
+    return progress
+
+
+async def notify_expired(user_ids):
+    if not user_ids:
+        return None
+    return await db.create_campaign_for(
+        "subscription_expired",
+        "⌛ Ваша премиум подписка истекла.\n\nПродлите её командой /premium, чтобы сохранить расширенные возможности.",
+        user_ids,
+    )
+
+
+async def queue_renewal_reminders(now):
+    start = now + datetime.timedelta(days=REMINDER_DAYS - 1)
+    end = start + datetime.timedelta(days=1)
+    return await db.create_campaign(
+        f"renewal_reminder {now.date().isoformat()}",
+        f"💎 Ваша премиум подписка закончится в ближайшие {REMINDER_DAYS} дня.\n\nПродлить: /premium",
+        "SELECT user_id FROM users WHERE subscription_end >= ? AND subscription_end < ?",
+        (start.isoformat(), end.isoformat()),
+    )
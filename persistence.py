@@ -0,0 +1,163 @@
+import asyncio
+import json
+import logging
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+import db
+
+logger = logging.getLogger(__name__)
+
+# PTB collects dirty user_data and conversations and hands them over once per interval
+FLUSH_INTERVAL = 0.5
+
+USER_DATA = "user_data"
+CHAT_DATA = "chat_data"
+BOT_DATA = "bot_data"
+CONVERSATION = "conversation:"
+
+
+def _dump(data):
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+
+
+class DBPersistence(BasePersistence):
+    """user_data, chat_data, bot_data и состояния ConversationHandler в таблице bot_state.
+
+    Запись отложенная: PTB раз в FLUSH_INTERVAL передаёт изменённые записи, они копятся в
+    буфере и уходят в базу одной транзакцией. Записи, которые PTB пометил изменёнными, но
+    чей JSON не поменялся, не пишутся вовсе. Данные читаются один раз при старте, поэтому
+    апдейты одного пользователя должны попадать в один процесс. С shard=(index, count)
+    загружаются только пользователи и чаты этого шарда (id % count == index).
+    """
+
+    def __init__(self, update_interval=FLUSH_INTERVAL, shard=None):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=True, chat_data=True, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.shard = shard
+        self._written = {}
+        self._upserts = {}
+        self._deletes = set()
+        self._flush_task = None
+        self.flushes = 0
+        self.rows_written = 0
+
+    def _owned(self, owner_id):
+        return self.shard is None or owner_id % self.shard[1] == self.shard[0]
+
+    async def _load(self, kind, owner=int):
+        await db.ensure_storage()
+        rows = [(key, data) for key, data in await db.backend.load_state(kind) if self._owned(owner(key))]
+        for key, data in rows:
+            self._written[(kind, key)] = hash(data)
+        return rows
+
+    async def get_user_data(self):
+        return {int(key): json.loads(data) for key, data in await self._load(USER_DATA)}
+
+    async def get_chat_data(self):
+        return {int(key): json.loads(data) for key, data in await self._load(CHAT_DATA)}
+
+    async def get_bot_data(self):
+        rows = await self._load(BOT_DATA, owner=lambda key: 0)
+        return json.loads(rows[0][1]) if rows else {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name):
+        # conversation keys are [chat_id, user_id]; shards are split by user
+        rows = await self._load(CONVERSATION + name, owner=lambda key: json.loads(key)[-1])
+        return {tuple(json.loads(key)): json.loads(data) for key, data in rows}
+
+    def _put(self, kind, key, value):
+        entry = (kind, str(key))
+        if value is None or value == {}:
+            self._upserts.pop(entry, None)
+            if entry in self._written:
+                self._deletes.add(entry)
+        else:
+            data = _dump(value)
+            self._deletes.discard(entry)
+            if self._written.get(entry) == hash(data):
+                self._upserts.pop(entry, None)
+            else:
+                self._upserts[entry] = data
+        if (self._upserts or self._deletes) and self._flush_task is None:
+            # update_persistence() passes every dirty entry in one gather; flush once after it
+            self._flush_task = asyncio.create_task(self._write_soon())
+
+    async def update_user_data(self, user_id, data):
+        self._put(USER_DATA, user_id, data)
+
+    async def update_chat_data(self, chat_id, data):
+        self._put(CHAT_DATA, chat_id, data)
+
+    async def update_bot_data(self, data):
+        self._put(BOT_DATA, "", data)
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def update_conversation(self, name, key, new_state):
+        self._put(CONVERSATION + name, _dump(list(key)), new_state)
+
+    async def drop_user_data(self, user_id):
+        self._put(USER_DATA, user_id, None)
+
+    async def drop_chat_data(self, chat_id):
+        self._put(CHAT_DATA, chat_id, None)
+
+    async def refresh_user_data(self, user_id, user_data):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def _write_soon(self):
+        await asyncio.sleep(0)
+        try:
+            while (self._upserts or self._deletes) and await self._write():
+                pass
+        finally:
+            self._flush_task = None
+
+    async def flush(self):
+        # on shutdown: wait for a write already in progress, then write what is left
+        if self._flush_task is not None:
+            await self._flush_task
+        await self._write()
+
+    async def _write(self):
+        upserts, deletes = self._upserts, self._deletes
+        if not upserts and not deletes:
+            return True
+        self._upserts, self._deletes = {}, set()
+        # mark as written up front so entries touched during the write are compared correctly
+        previous = {entry: self._written.get(entry) for entry in (*upserts, *deletes)}
+        for entry, data in upserts.items():
+            self._written[entry] = hash(data)
+        for entry in deletes:
+            self._written.pop(entry, None)
+        try:
+            await db.backend.save_state([(kind, key, data) for (kind, key), data in upserts.items()], list(deletes))
+        except Exception as e:
+            logger.error(f"Ошибка сохранения состояния: {e}")
+            for entry, written in previous.items():
+                if written is None:
+                    self._written.pop(entry, None)
+                else:
+                    self._written[entry] = written
+            # keep what failed for the next round, unless it was overwritten meanwhile
+            for entry, data in upserts.items():
+                self._upserts.setdefault(entry, data)
+            self._deletes |= deletes - set(self._upserts)
+            return False
+        self.flushes += 1
+        self.rows_written += len(upserts) + len(deletes)
+        return True
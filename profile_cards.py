@@ -0,0 +1,88 @@
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.helpers import escape_markdown
+
+import cache
+import callbacks
+import db
+
+CARD_CACHE_SIZE = 20000
+CARD_CACHE_TTL = 3600.0
+
+OWN = "own"
+SEARCH = "search"
+# opened from the connections list or the inbox
+VIEW = "view"
+
+OWN_MARKUP = InlineKeyboardMarkup([[InlineKeyboardButton("🔄 Обновить профиль", callback_data="update_profile")]])
+
+
+class ProfileCard:
+    __slots__ = ("stamp", "caption", "markup", "photo_id")
+
+    def __init__(self, stamp, caption, markup, photo_id):
+        self.stamp = stamp
+        self.caption = caption
+        self.markup = markup
+        self.photo_id = photo_id
+
+
+card_cache = cache.LRUCache(maxsize=CARD_CACHE_SIZE, ttl=CARD_CACHE_TTL)
+
+
+def md(value):
+    """Экранирует пользовательский текст для ParseMode.MARKDOWN, иначе '*' или '_' ломают отправку."""
+    return escape_markdown(str(value), version=1) if value is not None else ""
+
+
+def render_caption(user, works=()):
+    premium_badge = " 💎" if user.is_premium else ""
+    caption = (
+        f"👤 *Имя:* {md(user.name)}{premium_badge}\n\n"
+        f"💼 *Профессия:* {md(user.profession)}\n\n"
+        f"🛠️ *Навыки:* {md(user.skills)}\n\n"
+        f"📖 *О себе:* {md(user.bio)}"
+    )
+    if user.social_link:
+        # inside (...) only ')' ends the link
+        caption += f"\n\n🌐 *Соцсеть:* [Ссылка]({user.social_link.replace(')', '%29')})"
+    if works:
+        caption += "\n\n🎨 *Примеры работ:*"
+        for i, work in enumerate(works, 1):
+            caption += f"\n{i}. *{md(work['title'])}*: {md(work['description'])}"
+    return caption
+
+
+def search_markup(user_id):
+    return InlineKeyboardMarkup([[
+        InlineKeyboardButton("🤝 Связаться", callback_data=callbacks.CONNECT.encode(user_id)),
+        InlineKeyboardButton("➡️ Пропустить", callback_data=callbacks.SKIP.encode(user_id))
+    ]])
+
+
+def contact_markup(user):
+    url = f"https://t.me/{user.username}" if user.username else f"tg://user?id={user.user_id}"
+    return InlineKeyboardMarkup([[InlineKeyboardButton("📨 Написать", url=url)]])
+
+
+async def get_card(user, kind):
+    """Возвращает готовую подпись и клавиатуру профиля.
+
+    Карточка кэшируется по (kind, user_id) и годна, пока совпадают версия профиля и премиум:
+    любое редактирование поднимает profile_version, так что старая карточка не отдаётся.
+    """
+    key = (kind, user.user_id)
+    stamp = (user.profile_version, user.is_premium)
+    card = card_cache.get(key)
+    if card is not cache.MISSING and card.stamp == stamp:
+        return card
+    generation = card_cache.generation
+    if kind == OWN:
+        works = await db.get_user_works(user.user_id) if user.is_premium else ()
+        card = ProfileCard(stamp, render_caption(user, works), OWN_MARKUP, user.photo_id)
+    elif kind == VIEW:
+        card = ProfileCard(stamp, render_caption(user), contact_markup(user), user.photo_id)
+    else:
+        card = ProfileCard(stamp, render_caption(user), search_markup(user.user_id), user.photo_id)
+    card_cache.put(key, card, generation)
+    return card
+
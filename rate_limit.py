@@ -0,0 +1,38 @@
+import time
+
+DAY = 86400.0
+LIMITS = {False: 3, True: 200}
+
+SENT = "sent"
+DUPLICATE = "duplicate"
+LIMITED = "limited"
+
+
+def capacity_for(is_premium):
+    return LIMITS[bool(is_premium)]
+
+
+class ConnectionLimiter:
+    """Кэш отказов по лимиту запросов на связь.
+
+    Повторные нажатия после исчерпания лимита не доходят до базы. Сами token bucket'ы
+    хранит Storage (таблица rate_limits) и списывает в одной транзакции с запросом.
+    """
+
+    def __init__(self):
+        self._blocked_until = {}
+
+    def is_blocked(self, user_id, now=None):
+        until = self._blocked_until.get(user_id)
+        if until is None:
+            return False
+        if (now or time.time()) < until:
+            return True
+        del self._blocked_until[user_id]
+        return False
+
+    def block(self, user_id, wait, now=None):
+        self._blocked_until[user_id] = (now or time.time()) + wait
+
+    def forget(self, user_id):
+        self._blocked_until.pop(user_id, None)
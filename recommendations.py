@@ -0,0 +1,408 @@
+import argparse
+import array
+import asyncio
+import bisect
+import heapq
+import logging
+import math
+import multiprocessing
+import os
+import sys
+import time
+
+import db
+import keywords
+
+logger = logging.getLogger(__name__)
+
+# optional and only needed by the batch job; imported on first index build so bot startup skips it
+numpy = None
+
+TOP_K = 50
+# users scanned per tag; postings of popular tags are read through a window
+POSTING_SAMPLE = 500
+# friends-of-friends fan-out cap per hop, so hubs do not dominate the batch
+MAX_FRIENDS = 200
+FOF_WEIGHT = 0.5
+# mutual friends at which the graph score reaches half of FOF_WEIGHT
+MUTUAL_HALF = 2.0
+CHUNK_USERS = 2000
+WRITE_BATCH = 10000
+# default for RECOMMENDATIONS_REFRESH_INTERVAL; each refresh loads the whole index, see refresh()
+REFRESH_INTERVAL = 600
+
+
+class Vocabulary:
+    """Интернированные теги: строка -> номер и число пользователей с тегом."""
+
+    def __init__(self):
+        self.ids = {}
+        self.df = array.array("i")
+        # raw "Python" and " python" share one normalization
+        self._normalized = {}
+
+    def intern(self, tag):
+        tag_id = self.ids.get(tag)
+        if tag_id is None:
+            tag_id = self.ids[tag] = len(self.df)
+            self.df.append(0)
+        self.df[tag_id] += 1
+        return tag_id
+
+    def user_tags(self, profession, skills):
+        key = (profession, skills)
+        tags = self._normalized.get(key)
+        if tags is None:
+            tags = keywords.skill_tags(skills)
+            tag = keywords.profession_tag(profession)
+            if tag:
+                tags.append(tag)
+            if len(self._normalized) < 1_000_000:
+                self._normalized[key] = tags
+        return [self.intern(tag) for tag in tags]
+
+    def forget_raw(self):
+        self._normalized = {}
+
+
+def _csr(rows, size):
+    """Пары (строка, значение) -> (ptr, values): значения строки r лежат в values[ptr[r]:ptr[r + 1]]."""
+    ptr = array.array("q", bytes(8 * (size + 1)))
+    for row, _ in rows:
+        ptr[row + 1] += 1
+    for row in range(size):
+        ptr[row + 1] += ptr[row]
+    fill = array.array("q", ptr[:-1])
+    values = array.array("i", bytes(4 * ptr[size]))
+    for row, value in rows:
+        values[fill[row]] = value
+        fill[row] += 1
+    return ptr, values
+
+
+def _invert(ptr, values, size):
+    """Транспонирует CSR: из тегов пользователей получаются списки пользователей каждого тега."""
+    out_ptr = array.array("q", bytes(8 * (size + 1)))
+    for value in values:
+        out_ptr[value + 1] += 1
+    for value in range(size):
+        out_ptr[value + 1] += out_ptr[value]
+    fill = array.array("q", out_ptr[:-1])
+    out = array.array("i", bytes(4 * len(values)))
+    for row in range(len(ptr) - 1):
+        for value in values[ptr[row]:ptr[row + 1]]:
+            out[fill[value]] = row
+            fill[value] += 1
+    return out_ptr, out
+
+
+def _import_numpy():
+    global numpy
+    if numpy is None:
+        try:
+            import numpy as module
+        except ImportError:
+            module = False
+        numpy = module
+    return numpy
+
+
+class SkillIndex:
+    """Разреженные векторы тегов всех пользователей и граф связей в компактных массивах.
+
+    Вес тега — idf, вектор пользователя — его навыки и профессия. Всё лежит в array, так что
+    после fork рабочие процессы читают индекс без копирования, а numpy — без конвертации.
+    """
+
+    def __init__(self, users, links):
+        self.vocabulary = Vocabulary()
+        self.user_ids = array.array("q")
+        self.premium = array.array("b")
+        self.position = {}
+        user_tags = []
+        for user_id, profession, skills, is_premium in users:
+            self.position[user_id] = len(self.user_ids)
+            self.user_ids.append(user_id)
+            self.premium.append(1 if is_premium else 0)
+            user_tags.append(self.vocabulary.user_tags(profession, skills))
+        self.vocabulary.forget_raw()
+        count = len(self.user_ids)
+
+        total = max(count, 1)
+        self.weights = array.array("d", (_idf(total, df) for df in self.vocabulary.df))
+        self.tag_ptr = array.array("q", [0])
+        self.tag_ids = array.array("i")
+        self.norms = array.array("d")
+        for tags in user_tags:
+            self.tag_ids.extend(tags)
+            self.tag_ptr.append(len(self.tag_ids))
+            self.norms.append(sum(self.weights[t] ** 2 for t in tags) ** 0.5 or 1.0)
+        del user_tags
+        self.posting_ptr, self.posting_users = _invert(self.tag_ptr, self.tag_ids, len(self.weights))
+
+        friends, connected = [], []
+        for from_user, to_user, status in links:
+            a, b = self.position.get(from_user), self.position.get(to_user)
+            if a is None or b is None:
+                continue
+            connected += ((a, b), (b, a))
+            if status == "accepted":
+                friends += ((a, b), (b, a))
+        self.friend_ptr, self.friend_ids = _csr(friends, count)
+        self.link_ptr, self.link_ids = _csr(connected, count)
+
+        if _import_numpy():
+            self.np = {name: numpy.frombuffer(getattr(self, name), dtype=dtype) for name, dtype in (
+                ("user_ids", numpy.int64), ("premium", numpy.int8), ("norms", numpy.float64),
+                ("posting_users", numpy.int32), ("friend_ids", numpy.int32), ("link_ids", numpy.int32),
+            )}
+
+    def __len__(self):
+        return len(self.user_ids)
+
+    def _postings(self, i, tag_id):
+        start, end = self.posting_ptr[tag_id], self.posting_ptr[tag_id + 1]
+        if end - start > POSTING_SAMPLE:
+            # postings are sorted by position: every tag's window starts at the same per-viewer
+            # anchor, so users sharing several tags land in several windows and add up
+            anchor = (i * 2654435761) % len(self.user_ids)
+            start = min(bisect.bisect_left(self.posting_users, anchor, start, end), end - POSTING_SAMPLE)
+            end = start + POSTING_SAMPLE
+        return start, end
+
+    def _friends(self, i):
+        start = self.friend_ptr[i]
+        return start, min(self.friend_ptr[i + 1], start + MAX_FRIENDS)
+
+    def recommend(self, i, k=TOP_K):
+        """Номера top-k кандидатов для пользователя i, лучшие первыми."""
+        if numpy:
+            return self._recommend_numpy(i, k)
+        return self._recommend_python(i, k)
+
+    def _recommend_python(self, i, k):
+        scores = {}
+        norm = self.norms[i]
+        for tag_id in self.tag_ids[self.tag_ptr[i]:self.tag_ptr[i + 1]]:
+            weight = self.weights[tag_id] ** 2 / norm
+            start, end = self._postings(i, tag_id)
+            for j in self.posting_users[start:end]:
+                scores[j] = scores.get(j, 0.0) + weight
+        for j in scores:
+            scores[j] /= self.norms[j]
+        mutual = {}
+        start, end = self._friends(i)
+        for friend in self.friend_ids[start:end]:
+            f_start, f_end = self._friends(friend)
+            for j in self.friend_ids[f_start:f_end]:
+                mutual[j] = mutual.get(j, 0) + 1
+        for j, m in mutual.items():
+            scores[j] = scores.get(j, 0.0) + FOF_WEIGHT * m / (m + MUTUAL_HALF)
+        excluded = set(self.link_ids[self.link_ptr[i]:self.link_ptr[i + 1]])
+        excluded.add(i)
+        premium = self.premium
+        # ties go to the lower position
+        best = heapq.nlargest(k, (
+            (score * db.PREMIUM_BOOST if premium[j] else score, -j)
+            for j, score in scores.items() if j not in excluded
+        ))
+        return [-j for _, j in best]
+
+    def _recommend_numpy(self, i, k):
+        arrays = self.np
+        norm = self.norms[i]
+        candidates, values = [], []
+        for tag_id in self.tag_ids[self.tag_ptr[i]:self.tag_ptr[i + 1]]:
+            start, end = self._postings(i, tag_id)
+            candidates.append(arrays["posting_users"][start:end])
+            values.append(numpy.full(end - start, self.weights[tag_id] ** 2 / norm))
+        start, end = self._friends(i)
+        for friend in self.friend_ids[start:end]:
+            f_start, f_end = self._friends(friend)
+            candidates.append(arrays["friend_ids"][f_start:f_end])
+            # a negative marker separates mutual-friend counts from skill weights below
+            values.append(numpy.full(f_end - f_start, -1.0))
+        if not candidates:
+            return []
+        candidates = numpy.concatenate(candidates)
+        values = numpy.concatenate(values)
+        unique, inverse = numpy.unique(candidates, return_inverse=True)
+        skill = numpy.bincount(inverse, numpy.where(values > 0, values, 0.0), len(unique))
+        mutual = numpy.bincount(inverse, numpy.where(values < 0, 1.0, 0.0), len(unique))
+        scores = skill / arrays["norms"][unique] + FOF_WEIGHT * mutual / (mutual + MUTUAL_HALF)
+        scores *= numpy.where(arrays["premium"][unique] == 1, db.PREMIUM_BOOST, 1.0)
+        excluded = arrays["link_ids"][self.link_ptr[i]:self.link_ptr[i + 1]]
+        keep = numpy.isin(unique, excluded, invert=True) & (unique != i)
+        unique, scores = unique[keep], scores[keep]
+        if len(unique) > k:
+            # everything tied with the k-th score stays, so ties break the same way as in Python
+            kth = numpy.partition(scores, len(scores) - k)[len(scores) - k]
+            top = scores >= kth
+            unique, scores = unique[top], scores[top]
+        order = numpy.lexsort((unique, -scores))[:k]
+        return unique[order].tolist()
+
+    def pack(self, positions):
+        return array.array("q", (self.user_ids[j] for j in positions)).tobytes()
+
+
+def _idf(total, df):
+    # smoothed, so a tag everyone has still counts a little
+    return math.log((1 + total) / (1 + df)) + 0.1
+
+
+def _load_index(conn):
+    users = conn.execute("SELECT user_id, profession, skills, is_premium FROM users")
+    links = conn.execute("SELECT from_user, to_user, status FROM connections")
+    return SkillIndex(users, links.fetchall())
+
+
+def load_index():
+    return db.run_sync(_load_index)
+
+
+def _write(conn, rows, built_at):
+    conn.executemany("INSERT INTO recommendations (user_id, candidates, built_at) VALUES (?, ?, ?) "
+                     "ON CONFLICT(user_id) DO UPDATE SET candidates=excluded.candidates, built_at=excluded.built_at",
+                     [(user_id, blob, built_at) for user_id, blob in rows])
+
+
+# set in the parent before fork; workers inherit it without pickling
+_index = None
+
+
+def _recommend_chunk(bounds):
+    start, end = bounds
+    return [(_index.user_ids[i], _index.pack(_index.recommend(i))) for i in range(start, end)]
+
+
+def _recommend_positions(positions):
+    return [(_index.user_ids[i], _index.pack(_index.recommend(i))) for i in positions]
+
+
+def build(index, positions=None, workers=1):
+    """Считает top-K для всех пользователей (или для positions) и пишет их в recommendations.
+
+    Пользователи делятся на куски по CHUNK_USERS и считаются в workers процессах; запись идёт
+    из родителя пачками по WRITE_BATCH строк.
+    """
+    global _index
+    _index = index
+    if positions is None:
+        chunks = [(start, min(start + CHUNK_USERS, len(index))) for start in range(0, len(index), CHUNK_USERS)]
+        work = _recommend_chunk
+    else:
+        positions = list(positions)
+        chunks = [positions[n:n + CHUNK_USERS] for n in range(0, len(positions), CHUNK_USERS)]
+        work = _recommend_positions
+    built_at = time.time()
+    written = 0
+    pending = []
+    pool = None
+    if workers > 1 and len(chunks) > 1 and "fork" in multiprocessing.get_all_start_methods():
+        pool = multiprocessing.get_context("fork").Pool(workers)
+        results = pool.imap_unordered(work, chunks)
+    else:
+        results = map(work, chunks)
+    try:
+        for rows in results:
+            pending.extend(rows)
+            if len(pending) >= WRITE_BATCH:
+                db.run_sync(_write, pending, built_at)
+                written += len(pending)
+                pending = []
+        if pending:
+            db.run_sync(_write, pending, built_at)
+            written += len(pending)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        _index = None
+    return written
+
+
+def rebuild(workers=None):
+    """Полный пересчёт рекомендаций, офлайн-задача на ночь."""
+    started = time.time()
+    index = load_index()
+    loaded = time.time()
+    written = build(index, workers=workers or os.cpu_count() or 1)
+    db.run_sync(lambda conn: conn.execute("DELETE FROM recommendations_stale WHERE marked_at <= ?", (started,)))
+    logger.info(f"Рекомендации пересчитаны для {written} пользователей: индекс {loaded - started:.1f}с, "
+                f"расчёт {time.time() - loaded:.1f}с, тегов {len(index.vocabulary.ids)}")
+    return written
+
+
+def _stale(conn):
+    return conn.execute("SELECT user_id, marked_at FROM recommendations_stale").fetchall()
+
+
+def _clear_stale(conn, marks):
+    # a user marked again during the refresh keeps the newer mark
+    conn.executemany("DELETE FROM recommendations_stale WHERE user_id=? AND marked_at=?", marks)
+
+
+def refresh(workers=1):
+    """Пересчитывает только пользователей, чьи профиль или связи менялись с прошлого расчёта.
+
+    Индекс при этом загружается целиком, и это сделано намеренно: вес тега зависит от числа
+    всех его владельцев, а кандидаты берутся из списков тегов и друзей друзей по всей базе,
+    так что частичный индекс дал бы другие рекомендации, чем ночной rebuild. Расчёт идёт
+    только для помеченных пользователей, а без пометок загрузки нет вовсе. Как часто платить
+    за загрузку, задаёт RECOMMENDATIONS_REFRESH_INTERVAL.
+    """
+    marks = db.run_sync(_stale)
+    if not marks:
+        return 0
+    index = load_index()
+    positions = [index.position[user_id] for user_id, _ in marks if user_id in index.position]
+    written = build(index, positions, workers)
+    db.run_sync(_clear_stale, marks)
+    logger.info(f"Рекомендации обновлены для {written} пользователей")
+    return written
+
+
+_job = None
+
+
+async def run_job(full=False):
+    """Запускает пересчёт отдельным процессом, чтобы не занимать цикл событий бота.
+
+    Если предыдущий запуск ещё идёт, новый пропускается.
+    """
+    global _job
+    if _job is not None and _job.returncode is None:
+        logger.info("Пересчёт рекомендаций ещё идёт, пропускаю")
+        return
+    if not full and not await db.stale_recommendations_count():
+        return
+    args = [sys.executable, "-m", "recommendations", "--db", db.database_path()]
+    if not full:
+        args.append("--refresh")
+    _job = await asyncio.create_subprocess_exec(*args)
+    returncode = await _job.wait()
+    if returncode:
+        logger.error(f"Пересчёт рекомендаций завершился с кодом {returncode}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Пересчёт рекомендаций для поиска связей")
+    parser.add_argument("--db", default=db.DB_PATH)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--refresh", action="store_true", help="только пользователи с изменениями")
+    args = parser.parse_args()
+    logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO)
+    db.init(args.db)
+    try:
+        db.check_schema()
+        if args.refresh:
+            refresh(args.workers)
+        else:
+            rebuild(args.workers)
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+import asyncio
+import collections
+import logging
+
+import cache
+import db
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 20
+LOW_WATER = 5
+FEED_CACHE_SIZE = 10000
+# a feed nobody pulled from for this long is dropped; its prefetched candidates stay
+# marked as seen until the user's next /search resets them
+FEED_IDLE_TTL = 1800.0
+
+
+class SearchFeed:
+    __slots__ = ("user_id", "candidates", "exhausted", "_refill_task")
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.candidates = collections.deque()
+        self.exhausted = False
+        self._refill_task = None
+
+    async def _refill(self):
+        ids = await db.fill_feed(self.user_id, BATCH_SIZE)
+        self.candidates.extend(ids)
+        if len(ids) < BATCH_SIZE:
+            self.exhausted = True
+
+    def _refill_done(self, task):
+        self._refill_task = None
+        if not task.cancelled() and task.exception():
+            logger.error(f"Ошибка пополнения ленты поиска: {task.exception()}")
+
+    def _start_refill(self):
+        if self._refill_task is None:
+            self._refill_task = asyncio.create_task(self._refill())
+            self._refill_task.add_done_callback(self._refill_done)
+        return self._refill_task
+
+    async def next(self):
+        if not self.candidates and not self.exhausted:
+            await asyncio.shield(self._start_refill())
+        if not self.candidates:
+            return None
+        candidate_id = self.candidates.popleft()
+        if len(self.candidates) <= LOW_WATER and not self.exhausted:
+            self._start_refill()
+        return candidate_id
+
+    async def wait(self):
+        if self._refill_task is not None:
+            await asyncio.wait([self._refill_task])
+
+
+_feeds = cache.LRUCache(maxsize=FEED_CACHE_SIZE, ttl=FEED_IDLE_TTL)
+
+
+def get_feed(user_id):
+    feed = _feeds.get(user_id)
+    if feed is cache.MISSING:
+        feed = SearchFeed(user_id)
+    # every pull restarts the idle timer
+    _feeds.put(user_id, feed)
+    return feed
+
+
+def _pop(user_id):
+    feed = _feeds.get(user_id)
+    _feeds.invalidate(user_id)
+    return None if feed is cache.MISSING else feed
+
+
+def stats():
+    return _feeds.stats()
+
+
+async def reset(user_id):
+    feed = _pop(user_id)
+    if feed is not None:
+        # let an in-flight refill land first so its rows are cleared too
+        await feed.wait()
+    await db.reset_search_seen(user_id)
+
+
+async def start_keyword(user_id, ids):
+    feed = _pop(user_id)
+    if feed is not None:
+        await feed.wait()
+    feed = SearchFeed(user_id)
+    # keyword results are a complete ranked list, there is nothing to refill
+    feed.candidates.extend(ids)
+    feed.exhausted = True
+    _feeds.put(user_id, feed)
+
+
+async def next_candidate(user_id):
+    feed = get_feed(user_id)
+    candidate_id = await feed.next()
+    if candidate_id is None:
+        _pop(user_id)
+    return candidate_id
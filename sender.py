@@ -0,0 +1,273 @@
+import asyncio
+import collections
+import datetime
+import heapq
+import itertools
+import logging
+import time
+
+from telegram.error import RetryAfter
+
+logger = logging.getLogger(__name__)
+
+PAYMENT = 0
+REPLY = 1
+NOTIFICATION = 2
+
+# Telegram: about 30 messages per second overall and about one per second into a single chat
+GLOBAL_RATE = 30.0
+GLOBAL_BURST = 30
+CHAT_RATE = 1.0
+CHAT_BURST = 3
+# with several worker processes the outbox drains in one of them: it gets this share of the
+# global rate on top of an even split of the rest, which all workers use for replies
+OUTBOX_SHARE = 0.5
+MAX_IN_FLIGHT = 32
+MAX_RETRIES = 5
+LATENCY_SAMPLES = 2048
+
+
+class TokenBucket:
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = now
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now):
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+    def pause(self, seconds, now):
+        self._refill(now)
+        self.tokens = min(self.tokens, 0.0) - seconds * self.rate
+
+    def idle(self, now):
+        return self.tokens + (now - self.updated) * self.rate >= self.burst
+
+
+class _Job:
+    __slots__ = ("chat_id", "method", "kwargs", "priority", "coalesce_key", "future", "enqueued", "attempts")
+
+    def __init__(self, chat_id, method, kwargs, priority, coalesce_key, future, enqueued):
+        self.chat_id = chat_id
+        self.method = method
+        self.kwargs = kwargs
+        self.priority = priority
+        self.coalesce_key = coalesce_key
+        self.future = future
+        self.enqueued = enqueued
+        self.attempts = 0
+
+
+class MessageScheduler:
+    """Очередь исходящих сообщений с лимитами Telegram.
+
+    Сообщения уходят по приоритету (PAYMENT, REPLY, NOTIFICATION) через общий token bucket
+    и bucket на каждый чат. Чат, упёршийся в лимит или получивший RetryAfter, откладывается,
+    не задерживая остальные. Сообщения с одинаковым coalesce_key в одном чате, ещё не
+    отправленные, схлопываются в последнее.
+    """
+
+    def __init__(self, bot, global_rate=GLOBAL_RATE, global_burst=GLOBAL_BURST, chat_rate=CHAT_RATE,
+                 chat_burst=CHAT_BURST, max_in_flight=MAX_IN_FLIGHT, clock=time.monotonic):
+        self.bot = bot
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.clock = clock
+        self._global = TokenBucket(global_rate, global_burst, clock())
+        self._chats = {}
+        self._ready = []
+        self._delayed = []
+        self._pending = {}
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._slots = asyncio.Semaphore(max_in_flight)
+        self._inflight = set()
+        self._worker = None
+        self.sent = 0
+        self.failed = 0
+        self.coalesced = 0
+        self.retried = 0
+        self._latencies = collections.deque(maxlen=LATENCY_SAMPLES)
+
+    def start(self):
+        if self._worker is None:
+            self._worker = asyncio.create_task(self._run())
+
+    async def drain(self):
+        while self._ready or self._delayed or self._inflight:
+            await asyncio.sleep(0.05)
+
+    async def stop(self, drain=True):
+        if drain:
+            await self.drain()
+        if self._worker is not None:
+            self._worker.cancel()
+            self._worker = None
+
+    def send(self, chat_id, method="send_message", priority=NOTIFICATION, coalesce_key=None, **kwargs):
+        """Ставит вызов bot.<method>(chat_id=..., **kwargs) в очередь и возвращает future с результатом."""
+        if coalesce_key is not None:
+            job = self._pending.get((chat_id, coalesce_key))
+            if job is not None and not job.future.done():
+                job.method = method
+                job.kwargs = kwargs
+                self.coalesced += 1
+                return job.future
+        future = asyncio.get_running_loop().create_future()
+        job = _Job(chat_id, method, kwargs, priority, coalesce_key, future, self.clock())
+        if coalesce_key is not None:
+            self._pending[(chat_id, coalesce_key)] = job
+        self._push_ready(job)
+        return future
+
+    def _push_ready(self, job):
+        heapq.heappush(self._ready, (job.priority, next(self._seq), job))
+        self._wakeup.set()
+
+    def _chat_bucket(self, chat_id, now):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            bucket = self._chats[chat_id] = TokenBucket(self.chat_rate, self.chat_burst, now)
+        return bucket
+
+    async def _run(self):
+        while True:
+            now = self.clock()
+            while self._delayed and self._delayed[0][0] <= now:
+                _, _, job = heapq.heappop(self._delayed)
+                self._push_ready(job)
+            if not self._ready:
+                timeout = self._delayed[0][0] - now if self._delayed else None
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            _, _, job = heapq.heappop(self._ready)
+            chat_delay = self._chat_bucket(job.chat_id, now).delay(now)
+            if chat_delay > 0:
+                heapq.heappush(self._delayed, (now + chat_delay, next(self._seq), job))
+                continue
+            global_delay = self._global.delay(now)
+            if global_delay > 0:
+                self._push_ready(job)
+                await asyncio.sleep(global_delay)
+                continue
+
+            self._global.take(now)
+            self._chats[job.chat_id].take(now)
+            await self._slots.acquire()
+            task = asyncio.create_task(self._deliver(job))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+            if len(self._chats) > 10000:
+                self._prune(now)
+
+    async def _deliver(self, job):
+        if job.coalesce_key is not None and self._pending.get((job.chat_id, job.coalesce_key)) is job:
+            del self._pending[(job.chat_id, job.coalesce_key)]
+        try:
+            result = await getattr(self.bot, job.method)(chat_id=job.chat_id, **job.kwargs)
+        except RetryAfter as e:
+            retry_after = e.retry_after
+            if isinstance(retry_after, datetime.timedelta):
+                retry_after = retry_after.total_seconds()
+            job.attempts += 1
+            self.retried += 1
+            now = self.clock()
+            self._chat_bucket(job.chat_id, now).pause(retry_after, now)
+            if job.attempts > MAX_RETRIES:
+                self._fail(job, e)
+            else:
+                heapq.heappush(self._delayed, (now + retry_after, next(self._seq), job))
+                self._wakeup.set()
+        except Exception as e:
+            self._fail(job, e)
+        else:
+            self.sent += 1
+            self._latencies.append(self.clock() - job.enqueued)
+            if not job.future.done():
+                job.future.set_result(result)
+        finally:
+            self._slots.release()
+
+    def _fail(self, job, error):
+        self.failed += 1
+        logger.error(f"Ошибка отправки сообщения в чат {job.chat_id}: {error}")
+        if not job.future.done():
+            job.future.set_exception(error)
+            # nobody may await a fire-and-forget send; mark the exception as retrieved
+            job.future.exception()
+
+    def _prune(self, now):
+        for chat_id in [chat_id for chat_id, bucket in self._chats.items() if bucket.idle(now)]:
+            del self._chats[chat_id]
+
+    def queue_depth(self):
+        return len(self._ready) + len(self._delayed)
+
+    @property
+    def rate(self):
+        return self._global.rate
+
+    def stats(self):
+        latencies = sorted(self._latencies)
+
+        def pct(p):
+            return latencies[min(len(latencies) - 1, int(p / 100 * len(latencies)))] if latencies else 0.0
+
+        return {
+            "queue_depth": self.queue_depth(),
+            "in_flight": len(self._inflight),
+            "sent": self.sent,
+            "failed": self.failed,
+            "retried": self.retried,
+            "coalesced": self.coalesced,
+            "latency_p50": pct(50),
+            "latency_p99": pct(99),
+        }
+
+
+def shard_rate(index, count, outbox_index=0):
+    """Доля GLOBAL_RATE процесса index из count: (сообщений в секунду, burst)."""
+    if count <= 1:
+        return GLOBAL_RATE, GLOBAL_BURST
+    rate = GLOBAL_RATE * (1 - OUTBOX_SHARE) / count
+    if index == outbox_index:
+        rate += GLOBAL_RATE * OUTBOX_SHARE
+    return rate, max(1, int(GLOBAL_BURST * rate / GLOBAL_RATE))
+
+
+scheduler = None
+
+
+def start(bot, **options):
+    global scheduler
+    scheduler = MessageScheduler(bot, **options)
+    scheduler.start()
+    return scheduler
+
+
+async def stop():
+    global scheduler
+    if scheduler is not None:
+        await scheduler.stop()
+        scheduler = None
+
+
+def send(chat_id, method="send_message", priority=NOTIFICATION, coalesce_key=None, **kwargs):
+    return scheduler.send(chat_id, method, priority, coalesce_key, **kwargs)
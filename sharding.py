@@ -0,0 +1,260 @@
+import asyncio
+import json
+import logging
+import os
+import signal
+import sys
+
+from telegram import Bot, Update
+from telegram.error import TelegramError
+from telegram.ext import Application
+
+import webhook
+
+logger = logging.getLogger(__name__)
+
+READY = b"ready\n"
+START_TIMEOUT = 60.0
+STOP_TIMEOUT = 30.0
+RESTART_DELAY = 1.0
+POLL_TIMEOUT = 30
+POLL_RETRY_DELAY = 5.0
+# bytes buffered towards one worker before dispatch() waits for it to catch up
+PIPE_HIGH_WATER = 1024 * 1024
+
+
+def update_user_id(data):
+    """id отправителя из JSON апдейта, без разбора в объекты PTB."""
+    for value in data.values():
+        if isinstance(value, dict):
+            user = value.get("from") or value.get("user")
+            if isinstance(user, dict) and "id" in user:
+                return user["id"]
+    return None
+
+
+def shard_of(user_id, count):
+    # updates without a user (channel posts, polls) all go to the first worker
+    return user_id % count if user_id is not None else 0
+
+
+class WorkerProcess:
+    """Процесс одного шарда. Апдейты идут ему в stdin, по одному JSON на строку."""
+
+    def __init__(self, index, count, command):
+        self.index = index
+        self.count = count
+        self.command = command
+        self.process = None
+        self.sent = 0
+
+    async def start(self):
+        env = dict(os.environ, SHARD_INDEX=str(self.index), SHARD_COUNT=str(self.count))
+        env.pop("SHARD_WORKERS", None)
+        self.process = await asyncio.create_subprocess_exec(
+            *self.command, stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, env=env
+        )
+        self.process.stdin.transport.set_write_buffer_limits(high=PIPE_HIGH_WATER)
+        line = await asyncio.wait_for(self.process.stdout.readline(), START_TIMEOUT)
+        if line != READY:
+            raise RuntimeError(f"Воркер {self.index} не запустился")
+        logger.info(f"Воркер {self.index}/{self.count} запущен, pid {self.process.pid}")
+
+    async def writable(self):
+        # returns at once unless more than PIPE_HIGH_WATER is still waiting for the worker
+        await self.process.stdin.drain()
+
+    def write(self, line):
+        self.process.stdin.write(line)
+        self.sent += 1
+
+    async def stop(self):
+        if self.process is None or self.process.returncode is not None:
+            return
+        # end of input: the worker finishes what it has read, flushes state and exits
+        self.process.stdin.close()
+        try:
+            await asyncio.wait_for(self.process.wait(), STOP_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.error(f"Воркер {self.index} не завершился за {STOP_TIMEOUT}с, останавливаю")
+            self.process.terminate()
+            await self.process.wait()
+
+
+class ShardFront:
+    """Раздаёт апдейты N процессам-воркерам по user_id % N.
+
+    Апдейты одного пользователя всегда попадают в один процесс и обрабатываются там по
+    порядку, поэтому состояния ConversationHandler, лента поиска и лимиты остаются
+    согласованными. Общие данные воркеры держат в базе. Упавший воркер перезапускается;
+    апдейты, которые он не успел прочитать из канала, теряются.
+    """
+
+    def __init__(self, count, command=None):
+        command = command or [sys.executable, "-m", "sharding"]
+        self.workers = [WorkerProcess(index, count, command) for index in range(count)]
+        self._watchers = []
+        self._stopping = False
+
+    async def start(self):
+        await asyncio.gather(*(worker.start() for worker in self.workers))
+        self._watchers = [asyncio.create_task(self._watch(worker)) for worker in self.workers]
+
+    async def _watch(self, worker):
+        while True:
+            returncode = await worker.process.wait()
+            if self._stopping:
+                return
+            logger.error(f"Воркер {worker.index} завершился с кодом {returncode}, перезапуск")
+            await asyncio.sleep(RESTART_DELAY)
+            try:
+                await worker.start()
+            except (RuntimeError, asyncio.TimeoutError, OSError) as e:
+                logger.error(f"Не удалось перезапустить воркер {worker.index}: {e}")
+
+    async def dispatch(self, data, timeout=None):
+        """Передаёт апдейт (dict) воркеру его пользователя; False, если тот не принял его за timeout."""
+        worker = self.workers[shard_of(update_user_id(data), len(self.workers))]
+        try:
+            await asyncio.wait_for(worker.writable(), timeout)
+        except (asyncio.TimeoutError, ConnectionError):
+            return False
+        worker.write(json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode() + b"\n")
+        return True
+
+    async def stop(self):
+        self._stopping = True
+        for watcher in self._watchers:
+            watcher.cancel()
+        await asyncio.gather(*(worker.stop() for worker in self.workers))
+
+
+class ShardedWebhookServer(webhook.WebhookServer):
+    """HTTP-приём вебхука во фронте: тело запроса не разбирается PTB, а сразу уходит воркеру."""
+
+    def __init__(self, front, host="0.0.0.0", port=8443, path="/telegram", secret_token=None, ssl_context=None):
+        super().__init__(None, host, port, path, secret_token, ssl_context)
+        self.front = front
+
+    async def start(self):
+        await self._listen()
+
+    async def stop(self):
+        await self._close()
+
+    async def _enqueue(self, body):
+        try:
+            data = json.loads(body)
+        except ValueError:
+            return 400
+        if not isinstance(data, dict):
+            return 400
+        if not await self.front.dispatch(data, webhook.ENQUEUE_TIMEOUT):
+            self.rejected += 1
+            return 503
+        self.received += 1
+        return 200
+
+
+async def poll(front, bot, stop_event):
+    """Long polling во фронте: getUpdates и раздача апдейтов воркерам."""
+    await bot.delete_webhook()
+    offset = None
+    stop = asyncio.create_task(stop_event.wait())
+    try:
+        while not stop_event.is_set():
+            fetch = asyncio.create_task(bot.get_updates(offset=offset, timeout=POLL_TIMEOUT,
+                                                        allowed_updates=Update.ALL_TYPES))
+            await asyncio.wait((fetch, stop), return_when=asyncio.FIRST_COMPLETED)
+            if not fetch.done():
+                fetch.cancel()
+                break
+            try:
+                updates = fetch.result()
+            except TelegramError as e:
+                logger.warning(f"Ошибка getUpdates: {e}")
+                await asyncio.wait((stop,), timeout=POLL_RETRY_DELAY)
+                continue
+            for update in updates:
+                await front.dispatch(update.to_dict())
+                offset = update.update_id + 1
+        if offset is not None:
+            # confirm what was dispatched, so it is not delivered again after a restart
+            await bot.get_updates(offset=offset, timeout=0, limit=1)
+    finally:
+        stop.cancel()
+
+
+async def run_front(count, token, webhook_url=None, host="0.0.0.0", port=8443, path="/telegram",
+                    secret_token=None, cert_path=None, key_path=None, upload_certificate=False,
+                    max_connections=40, stop_event=None, command=None):
+    """Запускает count воркеров и принимает апдейты вебхуком (если задан webhook_url) или polling."""
+    stop_event = stop_event or asyncio.Event()
+    front = ShardFront(count, command)
+    bot = Bot(token)
+    await bot.initialize()
+    await front.start()
+    try:
+        if webhook_url:
+            ssl_context = webhook.make_ssl_context(cert_path, key_path) if cert_path else None
+            server = ShardedWebhookServer(front, host, port, path, secret_token, ssl_context)
+            await server.start()
+            try:
+                await webhook.set_webhook(bot, webhook_url, secret_token,
+                                          cert_path if upload_certificate else None, max_connections)
+                await stop_event.wait()
+            finally:
+                await server.stop()
+        else:
+            await poll(front, bot, stop_event)
+    finally:
+        await front.stop()
+        await bot.shutdown()
+
+
+async def serve_worker(application):
+    """Цикл воркера: апдейты из stdin в приложение, пока фронт не закроет канал."""
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader(limit=webhook.MAX_BODY + 1)
+    await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    try:
+        await application.start()
+        dispatcher = webhook.UpdateDispatcher(application)
+        sys.stdout.buffer.write(READY)
+        sys.stdout.flush()
+        # nobody reads stdout after the handshake
+        sys.stdout = sys.stderr
+        while line := await reader.readline():
+            try:
+                update = Update.de_json(json.loads(line), application.bot)
+            except (ValueError, TypeError, KeyError) as e:
+                logger.error(f"Некорректный апдейт от фронта: {e}")
+                continue
+            await dispatcher.submit(update)
+        await dispatcher.join()
+    finally:
+        if application.running:
+            await application.stop()
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+
+
+def main():
+    # imported here: main.py imports this module for the front
+    import main as bot
+
+    # Ctrl+C reaches the whole process group; workers stop when the front closes their input
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    bot.setup_storage()
+    builder = Application.builder().token(bot.BOT_TOKEN).updater(None).concurrent_updates(
+        webhook.PerUserUpdateProcessor(bot.MAX_CONCURRENT_UPDATES)
+    )
+    asyncio.run(serve_worker(bot.build_application(builder)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+class Storage:
+    """Интерфейс хранилища пользователей, работ, связей и подписок.
+
+    Кэши и индекс подписок живут в db и одинаковы для всех реализаций; хранилище только
+    читает и пишет строки. Даты подписок передаются как datetime, а возвращаются строкой
+    ISO, как их хранит SQLite.
+    """
+
+    async def start(self):
+        """Открывает соединения и создаёт недостающие таблицы."""
+        raise NotImplementedError
+
+    async def close(self):
+        raise NotImplementedError
+
+    async def get_user(self, user_id):
+        """Строка users в порядке db.USER_COLUMNS или None."""
+        raise NotImplementedError
+
+    async def update_user_fields(self, user_id, fields):
+        """Создаёт профиль или меняет только переданные поля, поднимая profile_version."""
+        raise NotImplementedError
+
+    async def get_user_works(self, user_id):
+        """Список (work_title, work_description)."""
+        raise NotImplementedError
+
+    async def request_connection(self, from_user, to_user, capacity, now):
+        """Создаёт запрос и списывает токен лимита атомарно; возвращает (статус rate_limit, ожидание)."""
+        raise NotImplementedError
+
+    async def answer_requests(self, to_user, first, last, accept, newest=None):
+        """Принимает (или удаляет) ожидающие запросы к to_user от first..last одной транзакцией.
+
+        С newest затрагиваются только запросы с connections.id <= newest, то есть пришедшие
+        не позже показанной страницы. Возвращает user_id отправителей затронутых запросов.
+        """
+        raise NotImplementedError
+
+    async def connections_page(self, user_id, after, before, limit):
+        """Принятые связи по ключу user_id собеседника: (строки user_id, name, profession, username; есть_ещё)."""
+        raise NotImplementedError
+
+    async def pending_page(self, user_id, after, before, limit):
+        """Ожидающие запросы к user_id по ключу user_id отправителя.
+
+        Формат как у connections_page, пятое поле строки — connections.id запроса.
+        """
+        raise NotImplementedError
+
+    async def pending_count(self, user_id):
+        raise NotImplementedError
+
+    async def reset_connection_limit(self, user_id):
+        raise NotImplementedError
+
+    async def set_premium(self, user_id, end_date):
+        """Включает премиум до end_date или снимает его, если end_date is None."""
+        raise NotImplementedError
+
+    async def load_entitlements(self):
+        """Все действующие подписки: список (user_id, subscription_end)."""
+        raise NotImplementedError
+
+    async def expire_chunk(self, now, limit):
+        """Снимает до limit подписок, истёкших к now, и возвращает их user_id."""
+        raise NotImplementedError
+
+    async def apply_payment(self, user_id, charge_id, provider_charge_id, amount, currency, payload, days, now):
+        """Записывает платёж в журнал и продлевает подписку на days дней от max(now, текущее окончание).
+
+        Всё в одной транзакции; если charge_id уже есть в журнале, ничего не меняет.
+        Возвращает (проведён_сейчас, окончание_подписки).
+        """
+        raise NotImplementedError
+
+    async def load_state(self, kind):
+        """Состояние бота (user_data, диалоги) одного вида: список (key, data)."""
+        raise NotImplementedError
+
+    async def save_state(self, upserts, deletes):
+        """Пишет пачку (kind, key, data) и удаляет пачку (kind, key) одной транзакцией."""
+        raise NotImplementedError
+
+
+def keyset(after, before):
+    """(оператор, порядок, граница) страницы по ключу: после after или перед before."""
+    if before is not None:
+        return "<", "DESC", before
+    return ">", "ASC", after if after is not None else -1
+
+
+def cut_page(rows, limit, before):
+    """Выборку из limit + 1 строк превращает в (страница по возрастанию ключа, есть_ещё)."""
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if before is not None:
+        rows.reverse()
+    return rows, has_more
+
+
+def open_storage(url):
+    """Хранилище по адресу: путь к файлу SQLite (можно с префиксом sqlite:///).
+
+    Реализации для PostgreSQL нет: лента поиска, /find, /skills, рекомендации и рассылки
+    читают users и connections из SQLite напрямую, так что другой сервер для профилей
+    отделил бы их от поиска.
+    """
+    if url.startswith(("postgres://", "postgresql://")):
+        raise RuntimeError("DATABASE_URL с PostgreSQL не поддерживается, укажите файл SQLite")
+    import db
+    db.init(url.removeprefix("sqlite:///"))
+    return db.SQLiteStorage()
@@ -0,0 +1,280 @@
+import asyncio
+import hmac
+import json
+import logging
+import ssl
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+MAX_BODY = 1024 * 1024
+HEADER_LIMIT = 64 * 1024
+ENQUEUE_TIMEOUT = 2.0
+# updates handed to the processor at once, counting those queued behind the same user
+MAX_PENDING = 1000
+
+REASONS = {200: "OK", 400: "Bad Request", 403: "Forbidden", 404: "Not Found",
+           405: "Method Not Allowed", 413: "Payload Too Large", 503: "Service Unavailable"}
+
+
+def update_user_id(update):
+    user = getattr(update, "effective_user", None)
+    return user.id if user else None
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Обрабатывает апдейты параллельно, но апдейты одного пользователя строго по очереди.
+
+    Порядок внутри пользователя держится на asyncio.Lock (FIFO), общий предел
+    параллельности — семафор BaseUpdateProcessor. Семафор берётся только после блокировки
+    пользователя, так что очередь апдейтов одного пользователя не занимает слоты остальных.
+    """
+
+    __slots__ = ("_locks",)
+
+    def __init__(self, max_concurrent_updates):
+        super().__init__(max_concurrent_updates)
+        self._locks = {}
+
+    # process_update is marked @final only for type checkers; the base takes the semaphore
+    # first, which would let one user's backlog hold every slot while waiting on its lock
+    async def process_update(self, update, coroutine):  # type: ignore[misc]
+        user_id = update_user_id(update)
+        if user_id is None:
+            await super().process_update(update, coroutine)
+            return
+        entry = self._locks.get(user_id)
+        if entry is None:
+            entry = self._locks[user_id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                await super().process_update(update, coroutine)
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[user_id]
+
+    async def do_process_update(self, update, coroutine):
+        await coroutine
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+
+class UpdateDispatcher:
+    """Передаёт апдейты процессору приложения, держа не больше max_pending начатых апдейтов.
+
+    submit() ждёт свободного места, так что источник апдейтов притормаживает вместе с
+    обработкой. Параллельность ограничивает сам процессор; предел здесь шире, потому что
+    апдейты, ждущие своей очереди у одного пользователя, не должны задерживать других.
+    """
+
+    def __init__(self, application, max_pending=MAX_PENDING):
+        self.application = application
+        self.processor = application.update_processor
+        self._slots = asyncio.Semaphore(max(max_pending, self.processor.max_concurrent_updates))
+        self._inflight = set()
+
+    async def submit(self, update, done=None):
+        await self._slots.acquire()
+        task = asyncio.create_task(self._process(update, done))
+        self._inflight.add(task)
+        task.add_done_callback(self._inflight.discard)
+
+    async def _process(self, update, done):
+        try:
+            await self.processor.process_update(update, self.application.process_update(update))
+        except Exception as e:
+            logger.error(f"Ошибка обработки апдейта: {e}")
+        finally:
+            self._slots.release()
+            if done is not None:
+                done()
+
+    async def join(self):
+        if self._inflight:
+            await asyncio.wait(self._inflight)
+
+
+class WebhookServer:
+    """Минимальный HTTP/1.1 сервер для вебхука Telegram на asyncio.
+
+    Принимает POST на path, проверяет X-Telegram-Bot-Api-Secret-Token и кладёт апдейт
+    в ограниченную очередь. Если очередь не освобождается за ENQUEUE_TIMEOUT, отвечает 503,
+    и Telegram повторит доставку позже.
+    """
+
+    def __init__(self, application, host="0.0.0.0", port=8443, path="/telegram", secret_token=None,
+                 ssl_context=None, queue_size=1000):
+        self.application = application
+        self.host = host
+        self.port = port
+        self.path = path
+        self.secret_token = secret_token
+        self.ssl_context = ssl_context
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self._server = None
+        self._consumer = None
+        self._dispatcher = None
+        self.received = 0
+        self.rejected = 0
+
+    async def start(self):
+        self._dispatcher = UpdateDispatcher(self.application)
+        self._consumer = asyncio.create_task(self._consume())
+        await self._listen()
+
+    async def _listen(self):
+        self._server = await asyncio.start_server(
+            self._handle_connection, self.host, self.port, ssl=self.ssl_context, limit=HEADER_LIMIT
+        )
+        self.port = self._server.sockets[0].getsockname()[1]
+        logger.info(f"Вебхук слушает {self.host}:{self.port}{self.path}")
+
+    async def _close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def stop(self):
+        await self._close()
+        await self.queue.join()
+        if self._consumer is not None:
+            self._consumer.cancel()
+        if self._dispatcher is not None:
+            await self._dispatcher.join()
+
+    async def _consume(self):
+        while True:
+            update = await self.queue.get()
+            # in-flight updates are bounded too, so the queue is the only buffer
+            await self._dispatcher.submit(update, self.queue.task_done)
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            while True:
+                keep_alive = await self._handle_request(reader, writer)
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.LimitOverrunError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _handle_request(self, reader, writer):
+        request_line = await reader.readline()
+        if not request_line:
+            return False
+        method, target, version = request_line.decode("latin-1").split(" ", 2)
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        length = int(headers.get("content-length", 0))
+        keep_alive = headers.get("connection", "").lower() != "close" and "1.1" in version
+
+        if length > MAX_BODY:
+            await self._respond(writer, 413, False)
+            return False
+        body = await reader.readexactly(length) if length else b""
+
+        if target.split("?", 1)[0] != self.path:
+            status = 404
+        elif method != "POST":
+            status = 405
+        elif self.secret_token and not hmac.compare_digest(
+                headers.get("x-telegram-bot-api-secret-token", ""), self.secret_token):
+            status = 403
+        else:
+            status = await self._enqueue(body)
+        await self._respond(writer, status, keep_alive)
+        return keep_alive
+
+    async def _enqueue(self, body):
+        try:
+            data = json.loads(body)
+        except ValueError:
+            return 400
+        if not isinstance(data, dict):
+            return 400
+        try:
+            update = Update.de_json(data, self.application.bot)
+        except (ValueError, TypeError, KeyError):
+            return 400
+        if update is None:
+            return 400
+        try:
+            await asyncio.wait_for(self.queue.put(update), ENQUEUE_TIMEOUT)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            return 503
+        self.received += 1
+        return 200
+
+    async def _respond(self, writer, status, keep_alive):
+        writer.write(
+            f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+            f"Content-Length: 0\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode("latin-1")
+        )
+        await writer.drain()
+
+
+def make_ssl_context(cert_path, key_path):
+    context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    context.load_cert_chain(cert_path, key_path)
+    return context
+
+
+async def set_webhook(bot, url, secret_token=None, certificate_path=None, max_connections=40):
+    certificate = open(certificate_path, "rb") if certificate_path else None
+    try:
+        await bot.set_webhook(
+            url=url,
+            certificate=certificate,
+            secret_token=secret_token,
+            max_connections=max_connections,
+            allowed_updates=Update.ALL_TYPES,
+        )
+    finally:
+        if certificate:
+            certificate.close()
+
+
+async def run_webhook(application, url, host="0.0.0.0", port=8443, path="/telegram", secret_token=None,
+                      cert_path=None, key_path=None, upload_certificate=False, queue_size=1000,
+                      max_connections=40, stop_event=None):
+    """Запускает приложение в режиме вебхука со своим HTTP-сервером.
+
+    TLS можно завершать на обратном прокси (cert_path не задан) или прямо здесь; для
+    самоподписанного сертификата upload_certificate=True передаёт его Telegram.
+    """
+    ssl_context = make_ssl_context(cert_path, key_path) if cert_path else None
+    server = WebhookServer(application, host, port, path, secret_token, ssl_context, queue_size)
+    stop_event = stop_event or asyncio.Event()
+
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    try:
+        await server.start()
+        await application.start()
+        await set_webhook(application.bot, url, secret_token, cert_path if upload_certificate else None,
+                          max_connections)
+        await stop_event.wait()
+    finally:
+        await server.stop()
+        if application.running:
+            await application.stop()
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)